@@ -1,21 +1,17 @@
 #!/bin/bash
 
 # Directory paths
-BACKUP_DIR="/home/pi/ChannoBot/backups"
-DB_PATH="/home/pi/ChannoBot/channobot.db"
-DATE=$(date +%Y%m%d_%H%M%S)
+BOT_DIR="/home/pi/ChannoBot"
+BACKUP_DIR="$BOT_DIR/backups"
+DB_PATH="$BOT_DIR/channobot.db"
 
 # Create backup directory if it doesn't exist
 mkdir -p "$BACKUP_DIR"
 
-# Create backup with timestamp
-cp "$DB_PATH" "$BACKUP_DIR/channobot_$DATE.db"
+# Store only the pages that changed since the last snapshot (deduplicated
+# and compressed); restore with: incremental_backup.py --dir "$BACKUP_DIR/pages" restore <id> <file>
+cd "$BOT_DIR" && "$BOT_DIR/venv/bin/python" incremental_backup.py --dir "$BACKUP_DIR/pages" snapshot --db "$DB_PATH" >> "$BACKUP_DIR/backup.log" 2>&1
 
-# Keep only the last 7 backups
-ls -t "$BACKUP_DIR"/channobot_*.db | tail -n +8 | xargs -r rm
-
-# Log the backup
-echo "Backup created: channobot_$DATE.db" >> "$BACKUP_DIR/backup.log"
-
-# Optional: Compress older backups to save space
-find "$BACKUP_DIR" -name "channobot_*.db" -mtime +1 -exec gzip {} \; 
\ No newline at end of file
+# Drop snapshots older than the change log (30 days, keeping at least 7)
+# and the pages and pack files only they used
+cd "$BOT_DIR" && "$BOT_DIR/venv/bin/python" incremental_backup.py --dir "$BACKUP_DIR/pages" prune >> "$BACKUP_DIR/backup.log" 2>&1
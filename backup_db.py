@@ -1,33 +1,106 @@
-import shutil
+import asyncio
+import logging
+import sqlite3
+import time
 from datetime import datetime
-import os
 from pathlib import Path
+from typing import Callable, Optional
 
-def backup_database():
-    # Ensure backup directory exists
-    backup_dir = Path("data/backups")
+logger = logging.getLogger('bot.backup')
+
+# Pages copied per backup step (4 KiB pages, so 1 MiB per step)
+PAGES_PER_STEP = 256
+# Pause between steps so the copy never saturates the SD card
+STEP_PAUSE = 0.005
+KEEP_BACKUPS = 5
+
+
+def backup_database(source="data/channobot.db", backup_dir="data/backups", keep: int = KEEP_BACKUPS,
+                    pages_per_step: int = PAGES_PER_STEP, step_pause: float = STEP_PAUSE,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Optional[dict]:
+    """Copy the live database with SQLite's online backup API
+
+    Blocking; the bot calls it through backup_database_async() so it runs
+    in a worker thread. Returns a summary dict, or None if there is no
+    database yet. The copy is checked with quick_check before it replaces
+    the temporary file name, and a copy that fails the check is deleted.
+    """
+    source = Path(source)
+    backup_dir = Path(backup_dir)
     backup_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Source database
-    source = Path("data/channobot.db")
     if not source.exists():
-        print("No database file found to backup!")
-        return
-    
-    # Create timestamped backup
+        logger.warning("No database file found to backup!")
+        return None
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_path = backup_dir / f"channobot_{timestamp}.db"
-    
-    # Create backup
-    shutil.copy2(source, backup_path)
-    
-    # Keep only last 5 backups
+    partial_path = backup_path.with_suffix('.db.partial')
+    started = time.perf_counter()
+    steps = 0
+    last_logged = 0
+
+    def on_step(status, remaining, total):
+        nonlocal steps, last_logged
+        steps += 1
+        done = total - remaining
+        if progress is not None:
+            progress(done, total)
+        percent = done * 100 // total if total else 100
+        if percent >= last_logged + 25:
+            last_logged = percent - percent % 25
+            logger.info(f"Backup {percent}% ({done}/{total} pages)")
+        if remaining and step_pause:
+            time.sleep(step_pause)
+
+    src = sqlite3.connect(source, timeout=30)
+    dst = sqlite3.connect(partial_path)
+    try:
+        # Hold one read snapshot for the whole copy. Without it every commit
+        # the bot makes between steps restarts the backup from page 1; with
+        # it (in WAL mode) the bot keeps writing and the copy stays consistent
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages_per_step, progress=on_step)
+        src.rollback()
+        # Make the copy a single self-contained file
+        dst.execute('PRAGMA journal_mode = DELETE')
+        check = dst.execute('PRAGMA quick_check').fetchone()[0]
+        page_count = dst.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+    if check != 'ok':
+        partial_path.unlink()
+        raise RuntimeError(f"Backup failed quick_check: {check}")
+    partial_path.rename(backup_path)
+
+    # Keep only the newest backups
     backups = sorted(backup_dir.glob("channobot_*.db"))
-    if len(backups) > 5:
-        for old_backup in backups[:-5]:
-            old_backup.unlink()
-    
-    print(f"Database backed up to {backup_path}")
+    for old_backup in backups[:-keep] if keep else []:
+        old_backup.unlink()
+
+    summary = {
+        'path': str(backup_path),
+        'pages': page_count,
+        'bytes': backup_path.stat().st_size,
+        'steps': steps,
+        'duration_ms': (time.perf_counter() - started) * 1000,
+        'quick_check': check,
+    }
+    logger.info(f"Database backed up to {backup_path} ({summary['bytes'] / 1024:.0f} KiB, "
+                f"{steps} steps, {summary['duration_ms']:.0f} ms, quick_check ok)")
+    return summary
+
+
+async def backup_database_async(*args, **kwargs) -> Optional[dict]:
+    """Run backup_database() in a worker thread so the event loop keeps running"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: backup_database(*args, **kwargs))
+
 
 if __name__ == "__main__":
-    backup_database() 
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    result = backup_database()
+    if result:
+        print(f"Database backed up to {result['path']}")
@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+Key = Tuple[int, int]
+
+
+class BalanceCache:
+    """Bounded LRU of balances keyed by (user_id, guild_id)
+
+    The points store writes every committed balance through this cache, so
+    a hit is always the value the database holds. Entries idle for longer
+    than idle_seconds are dropped, as is the least recently used entry once
+    max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int = 10000, idle_seconds: float = 1800):
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self._entries: "OrderedDict[Key, Tuple[int, float]]" = OrderedDict()
+        # Bumped on every change so a miss that raced a write is not cached
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id: int, guild_id: int) -> Optional[int]:
+        key = (user_id, guild_id)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or now - entry[1] > self.idle_seconds:
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries[key] = (entry[0], now)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, user_id: int, guild_id: int, balance: int):
+        """Record a committed balance"""
+        self.epoch += 1
+        self._store((user_id, guild_id), balance)
+
+    def fill(self, user_id: int, guild_id: int, balance: int, epoch: int):
+        """Cache a value read from the database, unless something changed since epoch"""
+        if epoch == self.epoch:
+            self._store((user_id, guild_id), balance)
+
+    def adjust(self, user_id: int, guild_id: int, delta: int):
+        """Apply a committed delta to a cached balance, if there is one"""
+        self.epoch += 1
+        key = (user_id, guild_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries[key] = (entry[0] + delta, entry[1])
+
+    def invalidate(self, user_id: int, guild_id: int):
+        self.epoch += 1
+        self._entries.pop((user_id, guild_id), None)
+
+    def invalidate_user(self, user_id: int):
+        """Drop a user's balances in every guild"""
+        self.epoch += 1
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+    def invalidate_guild(self, guild_id: int):
+        self.epoch += 1
+        for key in [key for key in self._entries if key[1] == guild_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self.epoch += 1
+        self._entries.clear()
+
+    def evict_idle(self) -> int:
+        """Drop entries that have not been touched for idle_seconds"""
+        cutoff = time.monotonic() - self.idle_seconds
+        evicted = 0
+        # Entries are kept in touch order, so stop at the first fresh one
+        while self._entries:
+            key, (_, touched) = next(iter(self._entries.items()))
+            if touched >= cutoff:
+                break
+            del self._entries[key]
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def _store(self, key: Key, balance: int):
+        self._entries[key] = (balance, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,17 +1,19 @@
 import discord
 from discord.ext import commands
 import random
-import aiosqlite
 import asyncio
 from typing import Dict, Set, Optional, Union
 from league_api import LeagueAPI
+from match_cache import MatchCache
 import os
 
 class Betting(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.active_bets: Dict[str, dict] = {}  # message_id -> bet_data
-        self.league_api = LeagueAPI(os.getenv('RIOT_API_KEY', ''))
+        self.debug = bot.flight.recorder('betting')
+        # Finished matches never change, so each is fetched from Riot once
+        self.league_api = LeagueAPI(os.getenv('RIOT_API_KEY', ''), cache=MatchCache(bot.db_path.parent / "match_cache.db"))
         
     def cog_help(self) -> discord.Embed:
         """Custom help command for the betting cog"""
@@ -53,7 +55,7 @@ class Betting(commands.Cog):
         
         embed.add_field(
             name="Points System",
-            value="• New users start with 1000 points\n"
+            value="• Earn points by spending time in voice channels\n"
                   "• Points are deducted when both players accept\n"
                   "• Winner gets double their original bet",
             inline=False
@@ -62,20 +64,6 @@ class Betting(commands.Cog):
         embed.set_footer(text="💡 Tip: You can add a custom description to make your bets more interesting!")
         return embed
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """Initialize database tables if they don't exist"""
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT,
-                    guild_id TEXT,
-                    points INTEGER DEFAULT 1000,
-                    PRIMARY KEY (user_id, guild_id)
-                )
-            """)
-            await db.commit()
-
     @commands.command(name="flip")
     async def flip(self, ctx, opponent: discord.Member, amount: int, *, description: str = None):
         """Create a coin flip bet with another user"""
@@ -84,31 +72,16 @@ class Betting(commands.Cog):
             return
 
         # Check if users have enough points
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                (str(ctx.author.id), str(ctx.guild.id))) as cursor:
-                author_points = await cursor.fetchone()
-                if not author_points:
-                    await db.execute("INSERT INTO users (user_id, guild_id) VALUES (?, ?)",
-                                   (str(ctx.author.id), str(ctx.guild.id)))
-                    author_points = (1000,)
-                    await db.commit()
-
-            async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                (str(opponent.id), str(ctx.guild.id))) as cursor:
-                opponent_points = await cursor.fetchone()
-                if not opponent_points:
-                    await db.execute("INSERT INTO users (user_id, guild_id) VALUES (?, ?)",
-                                   (str(opponent.id), str(ctx.guild.id)))
-                    opponent_points = (1000,)
-                    await db.commit()
-
-        if author_points[0] < amount:
-            await ctx.send(f"❌ You don't have enough points! You have {author_points[0]} points.")
+        balances = await self.bot.points.balances([(ctx.author.id, ctx.guild.id), (opponent.id, ctx.guild.id)])
+        author_points = balances[(ctx.author.id, ctx.guild.id)]
+        opponent_points = balances[(opponent.id, ctx.guild.id)]
+
+        if author_points < amount:
+            await ctx.send(f"❌ You don't have enough points! You have {author_points} points.")
             return
 
-        if opponent_points[0] < amount:
-            await ctx.send(f"❌ {opponent.display_name} doesn't have enough points! They have {opponent_points[0]} points.")
+        if opponent_points < amount:
+            await ctx.send(f"❌ {opponent.display_name} doesn't have enough points! They have {opponent_points} points.")
             return
 
         description = description or f"{ctx.author.display_name} vs {opponent.display_name} - {amount} points"
@@ -131,12 +104,12 @@ class Betting(commands.Cog):
             "player2": opponent.id,
             "amount": amount,
             "description": description,
-            "guild_id": str(ctx.guild.id),
+            "guild_id": ctx.guild.id,
             "status": "pending_consent",
             "consented": set(),
             "auto_resolve": True
         }
-        print(f"[DEBUG] Created new flip bet with ID: {bet_id}")
+        self.debug(ctx.guild.id, "Created new flip bet with ID: %s", bet_id)
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
@@ -146,14 +119,14 @@ class Betting(commands.Cog):
 
         message = reaction.message
         message_id = str(message.id)
-        print(f"[DEBUG] Processing reaction on message {message_id}")
+        self.debug(message.guild.id if message.guild else None, "Processing reaction on message %s", message_id)
         
         if str(reaction.emoji) != "👍":
             return
 
         # Find the bet associated with this message
         bet_id = str(message.id)
-        print(f"[DEBUG] Looking for bet with ID: {bet_id}")
+        self.debug(message.guild.id if message.guild else None, "Looking for bet with ID: %s", bet_id)
         
         # Try to find the bet, being more lenient with ID matching
         found_bet = None
@@ -164,7 +137,7 @@ class Betting(commands.Cog):
                 break
 
         if not found_bet:
-            print(f"[DEBUG] No bet found for message {message_id}")
+            self.debug(message.guild.id if message.guild else None, "No bet found for message %s", message_id)
             return
 
         bet = self.active_bets[bet_id]
@@ -172,41 +145,24 @@ class Betting(commands.Cog):
             return
 
         if user.id in [bet["player1"], bet["player2"]] or (bet.get("is_test") and user.id == bet["player1"]):
-            # Check if players still have enough points
-            async with aiosqlite.connect(self.bot.db_path) as db:
-                # Check player1's points
-                async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                    (str(bet["player1"]), bet["guild_id"])) as cursor:
-                    player1_points = await cursor.fetchone()
-                    if not player1_points or player1_points[0] < bet["amount"]:
-                        player1 = await self.bot.fetch_user(bet["player1"])
-                        await message.channel.send(f"❌ {player1.mention} no longer has enough points for this bet!")
-                        del self.active_bets[bet_id]
-                        return
-
-                # Check player2's points
-                async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                    (str(bet["player2"]), bet["guild_id"])) as cursor:
-                    player2_points = await cursor.fetchone()
-                    if not player2_points or player2_points[0] < bet["amount"]:
-                        player2 = await self.bot.fetch_user(bet["player2"])
-                        await message.channel.send(f"❌ {player2.mention} no longer has enough points for this bet!")
-                        del self.active_bets[bet_id]
-                        return
-
             bet["consented"].add(user.id)
 
             # If both players have consented (or if it's a test bet and the real player consented)
             consent_needed = 2 if not bet.get("is_test") else 1
             if len(bet["consented"]) >= consent_needed:
-                bet["status"] = "active"
-
-                # Deduct points from both players for flip bets
+                # Deduct points from both players for flip bets, all-or-nothing
                 if bet["type"] == "flip":
-                    async with aiosqlite.connect(self.bot.db_path) as db:
-                        await db.execute("UPDATE users SET points = points - ? WHERE user_id IN (?, ?) AND guild_id = ?",
-                                       (bet["amount"], bet["player1"], bet["player2"], bet["guild_id"]))
-                        await db.commit()
+                    short = await self.bot.points.try_debit_all([
+                        (bet["player1"], bet["guild_id"], bet["amount"]),
+                        (bet["player2"], bet["guild_id"], bet["amount"]),
+                    ], reason='bet', game='flip', ref_id=bet_id)
+                    if short:
+                        player = await self.bot.fetch_user(short[0])
+                        await message.channel.send(f"❌ {player.mention} no longer has enough points for this bet!")
+                        del self.active_bets[bet_id]
+                        return
+
+                bet["status"] = "active"
 
                 embed = discord.Embed(
                     title="🎲 Bet Activated!",
@@ -223,7 +179,7 @@ class Betting(commands.Cog):
     async def resolve_flip_bet(self, channel, bet_id):
         """Resolve a coin flip bet"""
         if bet_id not in self.active_bets:
-            print(f"[DEBUG] Cannot resolve bet {bet_id} - not found in active bets")
+            self.debug(channel.guild.id, "Cannot resolve bet %s - not found in active bets", bet_id)
             return
 
         bet = self.active_bets[bet_id]
@@ -239,10 +195,7 @@ class Betting(commands.Cog):
         winnings = bet["amount"] * 2
 
         # Update points in database
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute("UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?",
-                           (winnings, str(winner_id), bet["guild_id"]))
-            await db.commit()
+        await self.bot.points.credit(winner_id, bet["guild_id"], winnings, reason='payout', game=bet["type"], ref_id=bet_id)
 
         # Get user objects for mentions
         winner = await self.bot.fetch_user(winner_id)
@@ -261,7 +214,7 @@ class Betting(commands.Cog):
         
         # Remove the bet from active bets
         del self.active_bets[bet_id]
-        print(f"[DEBUG] Resolved and removed bet {bet_id}")
+        self.debug(channel.guild.id, "Resolved and removed bet %s", bet_id)
 
     @commands.command(name="leaguebet")
     async def leaguebet(self, ctx, opponent: discord.Member, outcome: str, amount: int, summoner_name: str):
@@ -284,37 +237,22 @@ class Betting(commands.Cog):
             return
 
         # Verify summoner exists
-        summoner = self.league_api.get_summoner_by_name(summoner_name)
+        summoner = await self.league_api.get_summoner_by_name(summoner_name)
         if not summoner:
             await ctx.send("❌ Could not find that summoner name! Please check the spelling.")
             return
 
         # Check if users have enough points
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                (str(ctx.author.id), str(ctx.guild.id))) as cursor:
-                author_points = await cursor.fetchone()
-                if not author_points:
-                    await db.execute("INSERT INTO users (user_id, guild_id) VALUES (?, ?)",
-                                   (str(ctx.author.id), str(ctx.guild.id)))
-                    author_points = (1000,)
-                    await db.commit()
-
-            async with db.execute("SELECT points FROM users WHERE user_id = ? AND guild_id = ?",
-                                (str(opponent.id), str(ctx.guild.id))) as cursor:
-                opponent_points = await cursor.fetchone()
-                if not opponent_points:
-                    await db.execute("INSERT INTO users (user_id, guild_id) VALUES (?, ?)",
-                                   (str(opponent.id), str(ctx.guild.id)))
-                    opponent_points = (1000,)
-                    await db.commit()
-
-        if author_points[0] < amount:
-            await ctx.send(f"❌ You don't have enough points! You have {author_points[0]} points.")
+        balances = await self.bot.points.balances([(ctx.author.id, ctx.guild.id), (opponent.id, ctx.guild.id)])
+        author_points = balances[(ctx.author.id, ctx.guild.id)]
+        opponent_points = balances[(opponent.id, ctx.guild.id)]
+
+        if author_points < amount:
+            await ctx.send(f"❌ You don't have enough points! You have {author_points} points.")
             return
 
-        if opponent_points[0] < amount:
-            await ctx.send(f"❌ {opponent.display_name} doesn't have enough points! They have {opponent_points[0]} points.")
+        if opponent_points < amount:
+            await ctx.send(f"❌ {opponent.display_name} doesn't have enough points! They have {opponent_points} points.")
             return
 
         # Format the outcome for display
@@ -341,7 +279,7 @@ class Betting(commands.Cog):
             "player2": opponent.id,    # The person accepting the bet
             "amount": amount,
             "description": description,
-            "guild_id": str(ctx.guild.id),
+            "guild_id": ctx.guild.id,
             "status": "pending_consent",
             "consented": set(),
             "auto_resolve": False,
@@ -349,7 +287,7 @@ class Betting(commands.Cog):
             "summoner_name": summoner_name,
             "summoner_puuid": summoner["puuid"]
         }
-        print(f"[DEBUG] Created new league bet with ID: {bet_id}")
+        self.debug(ctx.guild.id, "Created new league bet with ID: %s", bet_id)
 
     @commands.command(name="verify_league")
     async def verify_league(self, ctx, bet_id: str):
@@ -373,13 +311,13 @@ class Betting(commands.Cog):
             return
 
         # Get recent matches
-        matches = self.league_api.get_match_history(bet["summoner_puuid"], count=1)
+        matches = await self.league_api.get_match_history(bet["summoner_puuid"], count=1)
         if not matches:
             await ctx.send("❌ Could not find any recent matches for this summoner!")
             return
 
         # Get most recent match details
-        match_details = self.league_api.get_match_details(matches[0])
+        match_details = await self.league_api.get_match_details(matches[0])
         if not match_details:
             await ctx.send("❌ Could not fetch match details!")
             return
@@ -404,10 +342,7 @@ class Betting(commands.Cog):
         winnings = bet["amount"] * 2
 
         # Update points in database
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute("UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?",
-                           (winnings, str(winner_id), bet["guild_id"]))
-            await db.commit()
+        await self.bot.points.credit(winner_id, bet["guild_id"], winnings, reason='payout', game=bet["type"], ref_id=bet_id)
 
         # Get user objects for mentions
         winner = await self.bot.fetch_user(winner_id)
@@ -426,7 +361,7 @@ class Betting(commands.Cog):
         
         # Remove the bet from active bets
         del self.active_bets[bet_id]
-        print(f"[DEBUG] Resolved and removed league bet {bet_id}")
+        self.debug(ctx.guild.id, "Resolved and removed league bet %s", bet_id)
 
     @commands.command(name="resolve_league")
     async def resolve_league(self, ctx, bet_id: str, actual_outcome: str):
@@ -472,10 +407,7 @@ class Betting(commands.Cog):
         winnings = bet["amount"] * 2
 
         # Update points in database
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute("UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?",
-                           (winnings, str(winner_id), bet["guild_id"]))
-            await db.commit()
+        await self.bot.points.credit(winner_id, bet["guild_id"], winnings, reason='payout', game=bet["type"], ref_id=bet_id)
 
         # Get user objects for mentions
         winner = await self.bot.fetch_user(winner_id)
@@ -494,12 +426,13 @@ class Betting(commands.Cog):
         
         # Remove the bet from active bets
         del self.active_bets[bet_id]
-        print(f"[DEBUG] Resolved and removed league bet {bet_id}")
+        self.debug(ctx.guild.id, "Resolved and removed league bet %s", bet_id)
 
-    def cog_unload(self):
+    async def cog_unload(self):
         """Clean up when cog is unloaded"""
-        print("[DEBUG] Betting cog unloading - clearing active bets")
+        self.debug(None, "Betting cog unloading - clearing active bets")
         self.active_bets.clear()
+        await self.league_api.close()
 
 async def setup(bot):
     await bot.add_cog(Betting(bot)) 
\ No newline at end of file
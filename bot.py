@@ -3,34 +3,39 @@ import discord
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 from datetime import datetime
-import sqlite3
 import logging
-from logging.handlers import RotatingFileHandler
 import random
 import asyncio
-import aiosqlite
 import time
+import traceback
 from pathlib import Path
-from backup_db import backup_database
+from incremental_backup import prune_snapshots_async, snapshot_database_async
+from log_pipeline import setup_logging
+from loop_watchdog import LoopWatchdog
+from metrics import MetricsServer, Registry, rest_trace
+from changelog import ChangeLog
+from db_pool import DatabasePool
+from flight_recorder import FlightRecorder
+from ledger import Ledger
+from points_buffer import PointsBuffer
+from points_client import PointsClient, RemoteVoiceSessionStore
+from database_setup import open_database, stats_fields
+from points_store import PointsStore
+from profiler import LiveProfiler
+from storage_profile import StorageMaintenance
+from sharding import ShardStats, shard_config
+from voice_points import VoiceAccounting, VoiceSessionStore, VoiceShards
 
 # Set up logging
 LOG_DIR = Path('data/logs')
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
-# Configure logging
+# Configure logging: JSON lines written by a background thread, with
+# per-category sampling (LOG_SAMPLING) so busy guilds cannot stall the loop.
+# Each process of a cluster gets its own file
+CLUSTER_ID = os.getenv('CLUSTER_ID')
+log_pipeline = setup_logging('bot', LOG_DIR / (f'channobot-{CLUSTER_ID}.log' if CLUSTER_ID else 'channobot.log'))
 logger = logging.getLogger('bot')
-logger.setLevel(logging.INFO)
-
-# File handler with rotation
-file_handler = RotatingFileHandler(
-    LOG_DIR / 'channobot.log',
-    maxBytes=1024 * 1024,  # 1MB
-    backupCount=5
-)
-file_handler.setLevel(logging.INFO)
-file_formatter = logging.Formatter('%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s')
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
 # Load environment variables
 load_dotenv()
@@ -49,6 +54,12 @@ intents.presences = True  # Needed for member status
 # Blackjack game state
 active_games = {}
 
+# SHARD_COUNT (a number or 'auto') switches to one gateway connection per shard
+SHARDED, SHARD_COUNT, SHARD_IDS = shard_config()
+# Set by cluster.py: points are read and written through the points service
+# listening on this socket instead of opening the database in this process
+POINTS_SOCKET = os.getenv('POINTS_SOCKET')
+
 class CustomHelpCommand(commands.HelpCommand):
     async def send_bot_help(self, mapping):
         embed = discord.Embed(
@@ -62,7 +73,8 @@ class CustomHelpCommand(commands.HelpCommand):
             name="💰 Points & Info",
             value=(
                 "`!points` - Check your current points\n"
-                "`!leaderboard` - Show points leaderboard\n"
+                "`!leaderboard [page]` - Show points leaderboard\n"
+                "`!rank [@user]` - Show your leaderboard position\n"
                 "`!rewards` - Show available rewards"
             ),
             inline=False
@@ -84,7 +96,7 @@ class CustomHelpCommand(commands.HelpCommand):
             name="🎤 Voice Rewards",
             value=(
                 "Join voice channels to earn points!\n"
-                "• 1 point per minute in voice\n"
+                "• 20 points per minute in voice\n"
                 "• Must be unmuted to earn points\n"
                 "• AFK users don't earn points"
             ),
@@ -119,22 +131,72 @@ class CustomHelpCommand(commands.HelpCommand):
         
         await self.get_destination().send(embed=embed)
 
+# Prometheus metrics, served on METRICS_PORT (localhost only) when it is set
+METRICS_PORT = os.getenv('METRICS_PORT')
+metrics = Registry()
+command_seconds = metrics.histogram('channobot_command_seconds', "Time from invocation to completion per command", ['command', 'status'])
+points_seconds = metrics.histogram('channobot_points_operation_seconds', "Points store operation time", ['operation'])
+db_seconds = metrics.histogram('channobot_db_seconds', "Database connection wait and write transaction time", ['kind'])
+rest_seconds = metrics.histogram('channobot_discord_rest_seconds', "Discord REST request time", ['method', 'route'])
+rest_requests = metrics.counter('channobot_discord_rest_requests_total', "Discord REST requests by status", ['method', 'route', 'status'])
+rest_rate_limited = metrics.counter('channobot_discord_rest_rate_limited_total', "Discord REST responses with status 429", ['route', 'scope'])
+# Times the event loop continuously and captures the stack of anything that
+# blocks it for longer than LOOP_STALL_MS; also feeds systemd's watchdog
+loop_watchdog = LoopWatchdog(
+    threshold=int(os.getenv('LOOP_STALL_MS', '250')) / 1000,
+    lag_histogram=metrics.histogram('channobot_event_loop_lag_seconds', "How late the event loop ran a 100 ms timer",
+                                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)),
+    stall_histogram=metrics.histogram('channobot_event_loop_stall_seconds', "Event loop stalls longer than the threshold",
+                                      buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)),
+    stall_counter=metrics.counter('channobot_event_loop_stalls_total', "Event loop stalls by the line that blocked", ['site'])
+)
+
+class ChannoBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    async def setup_hook(self):
+        """Watch the event loop from login on, before the gateway connects"""
+        loop_watchdog.start()
+
+    async def close(self):
+        """Close the shared database pool along with the gateway connection"""
+        await super().close()
+        if self.db_maintenance is not None:
+            await self.db_maintenance.stop()
+        for loop in self.settle_loops.values():
+            loop.cancel()
+        await self.voice_points.stop()
+        self.voice_points.settle()
+        await self.voice_points.flush()
+        await self.voice_sessions.checkpoint(self.voice_points)
+        if POINTS_SOCKET:
+            await self.points.close()
+        else:
+            await self.points.ledger.stop()
+            await self.db.close()
+        await loop_watchdog.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        log_pipeline.stop()
+
 # Initialize bot with custom help command
-bot = commands.Bot(
+shard_options = {'shard_count': SHARD_COUNT, 'shard_ids': SHARD_IDS} if SHARDED else {}
+bot = ChannoBot(
     command_prefix='!',
     intents=intents,
-    help_command=CustomHelpCommand()
+    help_command=CustomHelpCommand(),
+    http_trace=rest_trace(rest_requests, rest_rate_limited, rest_seconds) if METRICS_PORT else None,
+    **shard_options
 )
-logger.info("Bot initialized with intents")
+logger.info(f"Bot initialized with intents ({SHARD_COUNT or 'auto'} shards)" if SHARDED else "Bot initialized with intents")
 
 # SQLite setup
 async def setup_database():
     try:
-        # Backup existing database if it exists
-        if Path(bot.db_path).exists():
-            backup_database()
-            logger.info("Created database backup")
-        
+        if POINTS_SOCKET:
+            # The points service owns the database; wait for it to come up
+            logger.info(f"Connecting to points service at: {POINTS_SOCKET}")
+            await bot.points.connect(attempts=60)
+            return
+
         # Get absolute path to bot directory
         bot_dir = Path(__file__).parent.absolute()
         data_dir = bot_dir / "data"
@@ -143,29 +205,8 @@ async def setup_database():
         db_path = data_dir / "channobot.db"
         logger.info(f"Attempting to connect to database at: {db_path}")
         
-        # Create database with correct schema if it doesn't exist
-        async with aiosqlite.connect(db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER,
-                    guild_id INTEGER,
-                    points INTEGER DEFAULT 0,
-                    PRIMARY KEY (user_id, guild_id)
-                )
-            ''')
-            await db.commit()
-            logger.info("Database schema verified")
-            
-            # Only initialize default points if the table is empty
-            async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-                count = await cursor.fetchone()
-                if count[0] == 0:
-                    logger.info("New database detected, initializing with default points")
-                    await db.execute('INSERT INTO users (user_id, guild_id, points) VALUES (?, ?, ?)', 
-                                   (128712048790994945, 0, 1000))  # Default user with points
-                    await db.commit()
-                else:
-                    logger.info(f"Using existing database with {count[0]} users")
+        # Back up, open, migrate and seed the shared database used by the bot and every cog
+        bot.last_backup = await open_database(bot.db, bot.points, bot.db_path.parent / "backups" / "pages")
                     
     except Exception as e:
         logger.error(f"Database setup error: {str(e)}")
@@ -173,67 +214,182 @@ async def setup_database():
 
 # Make the database connection accessible to cogs
 bot.db_path = Path(__file__).parent.absolute() / "data" / "channobot.db"
+if POINTS_SOCKET:
+    # Cluster mode: the same interface, served by points_service.py
+    bot.db = None
+    bot.changelog = None
+    bot.points = PointsClient(POINTS_SOCKET)
+    bot.db_maintenance = None
+else:
+    bot.db = DatabasePool(bot.db_path)
+    # Atomic debit/credit/transfer primitives used by every game, with a
+    # write-through balance cache and per-guild rankings kept in memory. Every
+    # change lands in the append-only ledger, compacted into users every 5 minutes,
+    # and in a change log outside the database for point-in-time restores
+    bot.changelog = ChangeLog(os.getenv('CHANGELOG_DIR', bot.db_path.parent / "changelog"))
+    bot.points = PointsStore(bot.db, ledger=Ledger(bot.db, changelog=bot.changelog))
+    # WAL checkpoints, PRAGMA optimize and incremental vacuum at quiet times
+    bot.db_maintenance = StorageMaintenance(bot.db)
+# Summary of the most recent backup, shown by !dbstats
+bot.last_backup = None
 
 # Constants
 POINTS_PER_MINUTE = 20
 INACTIVE_THRESHOLD = 15  # minutes
 
-# Voice state tracking
-voice_time_tracker = {}
-last_voice_activity = {}
-
-def is_user_active(member_id):
-    """Check if a user is currently active"""
-    if member_id not in last_voice_activity:
-        return False
-    minutes_inactive = (datetime.now() - last_voice_activity[member_id]).total_seconds() / 60
-    return minutes_inactive < INACTIVE_THRESHOLD
-
-@tasks.loop(seconds=30)
-async def check_voice_activity():
-    """Monitor user activity status in voice channels"""
-    current_time = datetime.now()
-    
-    for guild in bot.guilds:
-        for voice_channel in guild.voice_channels:
-            for member in voice_channel.members:
-                if not member.bot and not member.voice.afk:
-                    # Initialize activity if not present
-                    if member.id not in last_voice_activity:
-                        logger.info(f"Initializing tracking for {member.name} in {voice_channel.name}")
-                        last_voice_activity[member.id] = current_time
-                        voice_time_tracker[member.id] = current_time
-                        continue
-
-                    minutes_inactive = (current_time - last_voice_activity[member.id]).total_seconds() / 60
-                    was_inactive = minutes_inactive >= INACTIVE_THRESHOLD
-
-                    # Log only status changes
-                    if was_inactive != (minutes_inactive >= INACTIVE_THRESHOLD):
-                        logger.info(f"{member.name} is {'now inactive' if minutes_inactive >= INACTIVE_THRESHOLD else 'active again'} in {voice_channel.name}")
-
-@tasks.loop(minutes=1)
-async def check_and_award_points():
-    """Award points to active users in voice channels"""
+# Voice time is accounted per join/leave/mute/AFK interval, separately for
+# each shard; awards are buffered per shard and written once per settlement
+bot.voice_points = VoiceShards(
+    lambda shard_id: VoiceAccounting(PointsBuffer(bot.db, bot.points), POINTS_PER_MINUTE, INACTIVE_THRESHOLD * 60),
+    SHARD_IDS or range(SHARD_COUNT or 1),
+    SHARD_COUNT
+)
+bot.settle_loops = {}
+# Event rates and connection history per shard, shown by !shards
+bot.shard_stats = ShardStats()
+# Recent debug events per guild and per cog, kept in memory and written to
+# data/flight/ when a command or event handler fails, or by !flightrec
+bot.flight = FlightRecorder(bot.db_path.parent / "flight")
+# On-demand profiling of the live process with !profile
+bot.profiler = LiveProfiler(bot.db_path.parent / "profiles")
+
+def cog_state_sizes(attribute):
+    """Entries in a dict attribute of every loaded cog that has one, by cog"""
+    sizes = {}
+    for name, cog in bot.cogs.items():
+        state = getattr(cog, attribute, None)
+        if isinstance(state, dict):
+            sizes[(name,)] = len(state)
+    return sizes
+
+def match_cache_lookups():
+    """Match cache hits per tier and misses, from the cog that owns the Riot client
+
+    Empty unless a loaded cog has a LeagueAPI with a cache; the default
+    extensions in cogs/ don't use the Riot API yet
+    """
+    for cog in bot.cogs.values():
+        cache = getattr(getattr(cog, 'league_api', None), 'cache', None)
+        if cache is not None:
+            stats = cache.stats()
+            return {('memory',): stats['memory_hits'], ('disk',): stats['disk_hits'], ('miss',): stats['misses']}
+    return {}
+
+# Sizes read when /metrics is scraped
+metrics.gauge('channobot_gateway_latency_seconds', "Heartbeat latency per shard",
+              lambda: {(str(shard_id),): latency for shard_id, latency in (bot.latencies if SHARDED else [(0, bot.latency)])
+                       if latency == latency and latency != float('inf')}, ['shard'])
+metrics.gauge('channobot_event_loop_lag_max_seconds', "Worst event loop lag since startup", lambda: {(): loop_watchdog.max_lag})
+metrics.gauge('channobot_active_games', "Games in progress per cog", lambda: cog_state_sizes('active_games'), ['cog'])
+metrics.gauge('channobot_active_bets', "Open bets per cog", lambda: cog_state_sizes('active_bets'), ['cog'])
+metrics.gauge('channobot_voice_sessions', "Open voice sessions per shard",
+              lambda: {(str(shard_id),): len(shard) for shard_id, shard in bot.voice_points.shards.items()}, ['shard'])
+metrics.gauge('channobot_voice_deadlines', "Scheduled inactivity deadlines per shard",
+              lambda: {(str(shard_id),): len(shard.deadlines) for shard_id, shard in bot.voice_points.shards.items()}, ['shard'])
+metrics.gauge('channobot_voice_awards_pending', "Voice points waiting for the next settlement per shard",
+              lambda: {(str(shard_id),): len(shard.awards) for shard_id, shard in bot.voice_points.shards.items()}, ['shard'])
+metrics.gauge('channobot_log_records_dropped', "Log records sampled out or lost to a full queue",
+              lambda: {('lost',): log_pipeline.handler.lost,
+                       **{(category,): stats['dropped'] for category, stats in log_pipeline.sampling.stats.items()}}, ['reason'])
+metrics.gauge('channobot_match_cache_lookups', "Riot match lookups by where they were answered",
+              match_cache_lookups, ['result'])
+if not POINTS_SOCKET:
+    metrics.gauge('channobot_ledger_queued', "Ledger entries waiting to be written", lambda: {(): len(bot.points.ledger)})
+    metrics.gauge('channobot_balance_cache_entries', "Cached balances", lambda: {(): bot.points.cache.stats()['entries']})
+    bot.db.add_timing_hook(lambda kind, seconds: db_seconds.observe(seconds, kind))
+bot.points.add_timing_hook(lambda operation, seconds: points_seconds.observe(seconds, operation))
+bot.metrics_server = MetricsServer(metrics, int(METRICS_PORT), os.getenv('METRICS_HOST', '127.0.0.1')) if METRICS_PORT else None
+# Open sessions are checkpointed after every settlement so restarts resume them
+bot.voice_sessions = RemoteVoiceSessionStore(bot.points) if POINTS_SOCKET else VoiceSessionStore(bot.db)
+
+def can_earn(voice):
+    """Whether a voice state earns points: unmuted and outside the AFK channel"""
+    return not (voice.afk or voice.self_mute or voice.mute)
+
+def local_shard_ids():
+    """Shards this process is connected to"""
+    return sorted(bot.shards) if SHARDED else [0]
+
+async def track_current_voice_states(shard_id=None):
+    """Open or close sessions to match who is in voice right now, on one shard or all of them"""
+    states = {}
     for guild in bot.guilds:
+        if shard_id is not None and guild.shard_id != shard_id:
+            continue
         for voice_channel in guild.voice_channels:
             for member in voice_channel.members:
-                if not member.bot and not member.voice.afk and is_user_active(member.id):
-                    await award_voice_points(member)
+                if not member.bot:
+                    states[(member.id, guild.id)] = can_earn(member.voice)
+    if not bot.voice_points.restored:
+        # First connect since startup: pick up the sessions saved before the restart
+        resumed, opened, closed = bot.voice_points.restore(await bot.voice_sessions.load(), states)
+        logger.info(f"Tracking {len(states)} members in voice ({resumed} sessions resumed, "
+                    f"{opened} new, {closed} stale ones closed)")
+    else:
+        opened, closed = bot.voice_points.reconcile(states, shard_id)
+        shard = "" if shard_id is None else f" on shard {shard_id}"
+        logger.info(f"Tracking {len(states)} members in voice{shard} ({opened} new sessions, {closed} stale ones closed)")
+    await bot.voice_sessions.checkpoint(bot.voice_points)
+
+async def settle_voice_points(shard_id):
+    """Credit the voice time earned by every open session on a shard"""
+    shard = bot.voice_points.shard(shard_id)
+    shard.settle()
+    try:
+        awarded = await shard.awards.flush()
+        if awarded:
+            logger.info(f"Settled voice points for {awarded} members on shard {shard_id}")
+        await bot.voice_sessions.checkpoint(shard)
+    except Exception as e:
+        logger.error(f"Error flushing voice points on shard {shard_id}: {str(e)}")
+        logger.error(f"Error type: {type(e)}")
+
+    if not POINTS_SOCKET:
+        bot.points.cache.evict_idle()
+
+def settle_loop(shard_id, position, shard_total):
+    """One-minute settlement loop for a shard, offset so shards do not all write at once"""
+    @tasks.loop(minutes=1)
+    async def settle():
+        await settle_voice_points(shard_id)
+
+    @settle.before_loop
+    async def stagger():
+        await asyncio.sleep(60 * position / shard_total)
+
+    return settle
 
 @tasks.loop(hours=24)
 async def backup_task():
     """Create daily database backup"""
     try:
-        backup_database()
+        # Only pages changed since the last snapshot are stored; runs in a
+        # worker thread while the bot keeps writing
+        bot.last_backup = await snapshot_database_async(bot.db_path, bot.db_path.parent / "backups" / "pages")
         logger.info("Daily database backup created")
+        await prune_snapshots_async(bot.db_path.parent / "backups" / "pages")
     except Exception as e:
         logger.error(f"Error creating database backup: {str(e)}")
 
 async def setup_hook():
     """Initialize the bot's background tasks"""
-    check_and_award_points.start()
-    backup_task.start()
+    if SHARDED and not bot.voice_points.restored and list(bot.voice_points.shards) != local_shard_ids():
+        # SHARD_COUNT=auto: Discord picked the count while connecting
+        bot.voice_points.configure(local_shard_ids(), bot.shard_count)
+    await track_current_voice_states()
+    bot.voice_points.start()
+    if bot.metrics_server is not None:
+        await bot.metrics_server.start()
+    shard_ids = sorted(bot.voice_points.shards)
+    for position, shard_id in enumerate(shard_ids):
+        if shard_id not in bot.settle_loops:
+            bot.settle_loops[shard_id] = settle_loop(shard_id, position, len(shard_ids))
+            bot.settle_loops[shard_id].start()
+    if not POINTS_SOCKET:
+        # The points service runs these itself in cluster mode
+        backup_task.start()
+        bot.db_maintenance.start()
+        bot.points.ledger.start()
     logger.info("Background tasks started")
 
 class ExampleCog(commands.Cog):
@@ -254,15 +410,12 @@ class ExampleCog(commands.Cog):
             return
 
         cost = 200000 // len(members)
-        user_points = await get_points(ctx.author.id, ctx.guild.id)
 
-        if user_points < cost:
+        # Remove points from user if they can cover the cost
+        if await bot.points.try_debit(ctx.author.id, ctx.guild.id, cost, reason='purchase', game='disconnect') is None:
             await ctx.send(f"You need {cost} points to use this command!")
             return
 
-        # Remove points from user
-        await remove_points(ctx.author.id, ctx.guild.id, cost)
-
         # Choose random member (excluding the command user)
         other_members = [m for m in members if m != ctx.author]
         victim = random.choice(other_members)
@@ -316,6 +469,8 @@ async def on_ready():
     logger.info("Bot on_ready event triggered")
     try:
         logger.info(f'{bot.user} has connected to Discord!')
+        if not SHARDED:
+            bot.shard_stats.ready(0)
         await setup(bot)
         logger.info("Setup complete!")
         
@@ -332,6 +487,34 @@ async def on_ready():
         import traceback
         logger.error(traceback.format_exc())
 
+@bot.event
+async def on_shard_ready(shard_id):
+    bot.shard_stats.ready(shard_id)
+    logger.info(f"Shard {shard_id} ready")
+    # A re-identified shard may have missed voice state events while it was away
+    if bot.voice_points.restored:
+        await track_current_voice_states(shard_id)
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    bot.shard_stats.resumes[shard_id] += 1
+    logger.info(f"Shard {shard_id} resumed")
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    bot.shard_stats.disconnects[shard_id] += 1
+    logger.info(f"Shard {shard_id} disconnected")
+
+@bot.event
+async def on_resumed():
+    if not SHARDED:
+        bot.shard_stats.resumes[0] += 1
+
+@bot.event
+async def on_disconnect():
+    if not SHARDED:
+        bot.shard_stats.disconnects[0] += 1
+
 @bot.command()
 async def whoami(ctx):
     """Test command to verify bot can see user info"""
@@ -343,117 +526,23 @@ async def whoami(ctx):
 async def on_voice_state_update(member, before, after):
     if member.bot:
         return
+    bot.shard_stats.record(member.guild.shard_id, 'voice_state')
+
+    # Leaving closes the session and credits whatever it earned since the last settlement
+    if after.channel is None:
+        if before.channel is not None:
+            points = bot.voice_points.leave(member.id, member.guild.id)
+            logger.info("%s left voice channel %s after earning %d points", member.name, before.channel.name, points,
+                        extra={'category': 'voice', 'user_id': member.id, 'guild_id': member.guild.id})
+        return
 
-    current_time = datetime.now()
-    logger.info(f"\nVoice state update for {member.name}")
-    logger.info(f"Before state: channel={before.channel}, mute={before.self_mute}, deaf={before.self_deaf}, afk={before.afk}")
-    logger.info(f"After state: channel={after.channel}, mute={after.self_mute}, deaf={after.self_deaf}, afk={after.afk}")
-    
-    # Handle joining voice
-    if before.channel is None and after.channel is not None:
-        logger.info(f"{member.name} joined voice channel {after.channel.name}")
-        voice_time_tracker[member.id] = current_time
-        last_voice_activity[member.id] = current_time
-    
-    # Handle leaving voice
-    elif before.channel is not None and after.channel is None:
-        logger.info(f"{member.name} left voice channel {before.channel.name}")
-        await update_points_on_leave(member)
-        if member.id in last_voice_activity:
-            del last_voice_activity[member.id]
-            del voice_time_tracker[member.id]
-
-    # Update activity for any voice state change while in a channel
-    if after.channel is not None:
-        # Always update activity when in a voice channel, unless AFK
-        if not after.afk:
-            logger.info(f"Updating activity for {member.name} in {after.channel.name}")
-            last_voice_activity[member.id] = current_time
-            if member.id not in voice_time_tracker:
-                voice_time_tracker[member.id] = current_time
-            logger.info(f"Activity timestamp updated to {current_time}")
-
-async def award_voice_points(member):
-    """Award points to a member for being in voice chat"""
-    try:
-        logger.info(f"Attempting to award {POINTS_PER_MINUTE} points to {member.name}")
-        async with aiosqlite.connect(bot.db_path) as db:
-            # First try to insert new user
-            try:
-                await db.execute('''
-                    INSERT INTO users (user_id, guild_id, points)
-                    VALUES (?, ?, ?)
-                ''', (member.id, member.guild.id, POINTS_PER_MINUTE))
-                await db.commit()
-                logger.info(f"Created new user {member.name} with {POINTS_PER_MINUTE} points")
-            except sqlite3.IntegrityError:
-                # User exists, update points
-                await db.execute('''
-                    UPDATE users 
-                    SET points = points + ?
-                    WHERE user_id = ? AND guild_id = ?
-                ''', (POINTS_PER_MINUTE, member.id, member.guild.id))
-                await db.commit()
-                logger.info(f"Updated points for existing user {member.name}")
-            
-            # Verify points were awarded
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', 
-                               (member.id, member.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    logger.info(f"{member.name} now has {result[0]} points")
-                else:
-                    logger.error(f"Failed to verify points for {member.name}")
-    except Exception as e:
-        logger.error(f"Error awarding points to {member.name}: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        raise
-
-async def update_points_on_leave(member):
-    """Update points when a member leaves voice chat"""
-    if member.id in voice_time_tracker:
-        start_time = voice_time_tracker[member.id]
-        current_time = datetime.now()
-        minutes = (current_time - start_time).total_seconds() / 60
-        
-        # Only award points if user has been active recently
-        if is_user_active(member.id):
-            points = int(minutes * POINTS_PER_MINUTE)
-            try:
-                async with aiosqlite.connect(bot.db_path) as db:
-                    # First try to insert if user doesn't exist
-                    try:
-                        await db.execute('''
-                            INSERT INTO users (user_id, guild_id, points)
-                            VALUES (?, ?, ?)
-                        ''', (member.id, member.guild.id, points))
-                        await db.commit()
-                        logger.info(f"Created new user {member.name} with {points} points on leave")
-                    except sqlite3.IntegrityError:
-                        # User exists, update points
-                        await db.execute('''
-                            UPDATE users SET points = points + ?
-                            WHERE user_id = ? AND guild_id = ?
-                        ''', (points, member.id, member.guild.id))
-                        await db.commit()
-                        logger.info(f"Updated points for {member.name} with {points} points on leave")
-                    
-                    # Verify points
-                    async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', 
-                                       (member.id, member.guild.id)) as cursor:
-                        result = await cursor.fetchone()
-                        if result:
-                            logger.info(f"{member.name} now has {result[0]} points after leave")
-                        else:
-                            logger.error(f"Failed to verify points for {member.name} after leave")
-            except Exception as e:
-                logger.error(f"Error updating points for {member.name} on leave: {str(e)}")
-                logger.error(f"Error type: {type(e)}")
-        
-        # Clean up tracking
-        del voice_time_tracker[member.id]
-        if member.id in last_voice_activity:
-            del last_voice_activity[member.id]
+    # Joining, moving, muting or going AFK ends the previous interval
+    earning = can_earn(after)
+    bot.voice_points.update(member.id, member.guild.id, earning)
+    # Arguments are only formatted if the record survives sampling
+    logger.info("Voice state for %s: %s -> %s", member.name, before.channel, after.channel,
+                extra={'category': 'voice', 'user_id': member.id, 'guild_id': member.guild.id,
+                       'muted': after.self_mute or after.mute, 'afk': after.afk, 'earning': earning})
 
 @bot.command()
 async def points(ctx, member: discord.Member = None):
@@ -469,15 +558,12 @@ async def points(ctx, member: discord.Member = None):
         
         if is_in_voice:
             channel_name = target.voice.channel.name
-            is_collecting = is_user_active(target.id)
+            is_collecting = bot.voice_points.is_collecting(target.id, ctx.guild.id)
             logger.info(f"Points command - {target.name} in {channel_name}, active: {is_collecting}")
         
-        # Get points from database
-        async with aiosqlite.connect(bot.db_path) as db:
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', (target.id, ctx.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                points = result[0] if result else 0
-                logger.info(f"Retrieved {points} points for {target.name}")
+        # Get points, usually straight from the balance cache
+        points = await bot.points.balance(target.id, ctx.guild.id)
+        logger.info(f"Retrieved {points} points for {target.name}")
         
         # Create status message
         status_msg = ""
@@ -488,7 +574,7 @@ async def points(ctx, member: discord.Member = None):
                 status_msg = f"\n⏰ In {channel_name} but inactive (no points collecting)"
                 # If they're in voice but inactive, update their activity
                 if not target.voice.afk:
-                    last_voice_activity[target.id] = datetime.now()
+                    bot.voice_points.touch(target.id, ctx.guild.id)
                     logger.info(f"Updated activity for {target.name} due to points command")
         
         if member:
@@ -500,24 +586,30 @@ async def points(ctx, member: discord.Member = None):
         await ctx.send("Sorry, there was an error checking points. Please try again.")
 
 @bot.command()
-async def leaderboard(ctx):
-    """Show the points leaderboard for this server"""
-    async with aiosqlite.connect(bot.db_path) as db:
-        async with db.execute('SELECT user_id, points FROM users WHERE guild_id = ? ORDER BY points DESC LIMIT 10', (ctx.guild.id,)) as cursor:
-            results = await cursor.fetchall()
+async def leaderboard(ctx, page: int = 1):
+    """Show the points leaderboard for this server, 10 users per page"""
+    if page < 1:
+        await ctx.send("Page number must be at least 1!")
+        return
+
+    results, pages = await bot.points.leaderboard.page(ctx.guild.id, page)
             
     if not results:
-        await ctx.send("No points recorded yet in this server!")
+        if page == 1:
+            await ctx.send("No points recorded yet in this server!")
+        else:
+            await ctx.send(f"There are only {pages} leaderboard pages!")
         return
         
     embed = discord.Embed(
         title="🏆 Points Leaderboard",
-        description=f"Top 10 Point Earners in {ctx.guild.name}",
+        description=f"Top 10 Point Earners in {ctx.guild.name}" if page == 1 else f"Point Earners in {ctx.guild.name}",
         color=discord.Color.gold()
     )
+    embed.set_footer(text=f"Page {page}/{pages}")
     
     # Create leaderboard text
-    for i, (user_id, points) in enumerate(results, 1):
+    for i, (user_id, points) in enumerate(results, (page - 1) * 10 + 1):
         medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "👤"
         member = ctx.guild.get_member(user_id)
         name = member.name if member else f"User {user_id}"
@@ -529,6 +621,19 @@ async def leaderboard(ctx):
         
     await ctx.send(embed=embed)
 
+@bot.command()
+async def rank(ctx, member: discord.Member = None):
+    """Show your leaderboard position or someone else's"""
+    target = member or ctx.author
+    position, total = await bot.points.leaderboard.rank(target.id, ctx.guild.id)
+    if position is None:
+        await ctx.send(f"{target.name} hasn't earned any points in this server yet!")
+        return
+
+    points = await bot.points.balance(target.id, ctx.guild.id)
+    who = f"{target.name} is" if member else "You are"
+    await ctx.send(f"🏅 {who} ranked #{position:,} of {total:,} with {points:,} points!")
+
 @bot.event
 async def on_guild_join(guild):
     """Log when the bot joins a new guild"""
@@ -544,17 +649,52 @@ async def on_guild_remove(guild):
 @bot.event
 async def on_command(ctx):
     """Log when a command is attempted"""
-    logger.info(f"Command '{ctx.command.name}' attempted by {ctx.author.name} in guild '{ctx.guild.name}' (ID: {ctx.guild.id})")
+    ctx.started_at = time.perf_counter()
+    if ctx.guild:
+        bot.shard_stats.record(ctx.guild.shard_id, 'command')
+    logger.info("Command '%s' attempted by %s in guild '%s'", ctx.command.name, ctx.author.name, ctx.guild.name if ctx.guild else None,
+                extra={'category': 'command', 'command': ctx.command.name, 'user_id': ctx.author.id,
+                       'guild_id': ctx.guild.id if ctx.guild else None})
+
+@bot.event
+async def on_command_completion(ctx):
+    command_seconds.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name, 'ok')
 
 @bot.event
 async def on_command_error(ctx, error):
     """Log command errors"""
+    if hasattr(ctx, 'started_at'):
+        command_seconds.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name, 'error')
     logger.error(f"Error executing command '{ctx.command}' in guild '{ctx.guild.name}' (ID: {ctx.guild.id})")
     logger.error(f"Error: {str(error)}")
     if isinstance(error, commands.errors.CommandNotFound):
         return
+    if isinstance(error, commands.CommandInvokeError):
+        # A bug rather than bad input: keep what led up to it
+        guild_id = ctx.guild.id if ctx.guild else None
+        cog = FlightRecorder.cog_name(ctx.cog) if ctx.cog else None
+        details = "".join(traceback.format_exception(error.original))
+        bot.flight.record(cog or 'bot', guild_id, "Command %s failed: %s", ctx.message.content, details)
+        await bot.flight.dump(f"!{ctx.command} failed: {error.original!r}", guild_id)
     await ctx.send(f"An error occurred: {str(error)}")
 
+def event_guild_id(args):
+    """Guild of the object an event was dispatched for, if any"""
+    for arg in args:
+        for obj in (arg, getattr(arg, 'message', None), getattr(arg, 'channel', None)):
+            guild = getattr(obj, 'guild', None)
+            if guild is not None:
+                return guild.id
+    return None
+
+@bot.event
+async def on_error(event, *args, **kwargs):
+    """Log unhandled exceptions in event handlers and dump the flight recorder"""
+    logger.exception(f"Unhandled exception in {event}")
+    guild_id = event_guild_id(args)
+    bot.flight.record('bot', guild_id, "Unhandled exception in %s: %s", event, traceback.format_exc())
+    await bot.flight.dump(f"Unhandled exception in {event}", guild_id)
+
 @bot.command()
 async def test(ctx):
     """Simple test command that always responds"""
@@ -574,25 +714,17 @@ async def on_message(message):
     """Log messages and process commands"""
     if message.author.bot:
         return
+    if message.guild:
+        bot.shard_stats.record(message.guild.shard_id, 'message')
+
+    # Most messages are chat: nothing to log or parse unless it has our prefix
+    if not message.content.startswith('!'):
+        return
 
     try:
-        # Log all message details
-        guild_info = f"Guild: {message.guild.name} (ID: {message.guild.id})"
-        channel_info = f"Channel: {message.channel.name} (ID: {message.channel.id})"
-        author_info = f"Author: {message.author.name}#{message.author.discriminator}"
-        content_info = f"Content: {message.content}"
-        bot_permissions = message.guild.me.guild_permissions
-        bot_roles = [role.name for role in message.guild.me.roles]
-        
-        logger.info(f"\nMessage Details:\n{guild_info}\n{channel_info}\n{author_info}\n{content_info}")
-        logger.info(f"Bot permissions in this guild: {bot_permissions}")
-        logger.info(f"Bot roles in this guild: {bot_roles}")
-        
-        # If it starts with our prefix, log extra command debug info
-        if message.content.startswith('!'):
-            logger.info(f"Potential command detected: {message.content}")
-            logger.info(f"Can bot send messages here: {message.channel.permissions_for(message.guild.me).send_messages}")
-            logger.info(f"Can bot read messages here: {message.channel.permissions_for(message.guild.me).read_messages}")
+        logger.info("Potential command from %s: %s", message.author.name, message.content,
+                    extra={'category': 'message', 'guild_id': message.guild.id if message.guild else None,
+                           'channel_id': message.channel.id, 'user_id': message.author.id})
             
         # Process commands
         await bot.process_commands(message)
@@ -605,10 +737,101 @@ async def on_message(message):
 @commands.is_owner()
 async def addpoints(ctx, user_id: int, amount: int):
     """Add points to a user (owner only)"""
-    async with aiosqlite.connect('data/channobot.db') as db:
-        await db.execute('UPDATE users SET points = points + ? WHERE user_id = ?', (amount, user_id))
-        await db.commit()
-        await ctx.send(f"Added {amount} points to user {user_id}")
+    await bot.points.adjust_all_guilds(user_id, amount, reason='admin')
+    await ctx.send(f"Added {amount} points to user {user_id}")
+
+@bot.command()
+@commands.is_owner()
+async def dbstats(ctx):
+    """Show storage settings and maintenance statistics (owner only)"""
+    if POINTS_SOCKET:
+        fields = await bot.points.stats_fields()
+        client = bot.points.stats
+        fields.append(("Points Client", (
+            f"Requests: {client['requests']:,} in {client['batches']:,} writes (largest {client['largest_batch']})\n"
+            f"Sent: {client['bytes_sent'] / 1024:,.0f} KiB, reconnects: {client['reconnects']}"
+        )))
+    else:
+        fields = stats_fields(bot.db, bot.db_maintenance, bot.points, bot.last_backup)
+    embed = discord.Embed(title="🗄️ Database Stats", color=discord.Color.blue())
+    for name, value in fields:
+        embed.add_field(name=name, value=value, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command()
+@commands.is_owner()
+async def shards(ctx):
+    """Show gateway latency, event rates and voice sessions per shard (owner only)"""
+    latencies = dict(bot.latencies) if SHARDED else {0: bot.latency}
+    guilds = {}
+    for guild in bot.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+    stats = bot.shard_stats
+    embed = discord.Embed(title="🧩 Shards", color=discord.Color.blue())
+    for shard_id in local_shard_ids():
+        events = stats.events.get(shard_id, {})
+        voice = bot.voice_points.shards.get(shard_id)
+        embed.add_field(
+            name=f"Shard {shard_id}",
+            value=(
+                f"Latency: {latencies.get(shard_id, float('nan')) * 1000:.0f} ms, {guilds.get(shard_id, 0)} guilds\n"
+                f"Events: {stats.per_minute(shard_id):,}/min ({events.get('voice_state', 0):,} voice, "
+                f"{events.get('message', 0):,} messages, {events.get('command', 0):,} commands)\n"
+                f"Voice: {len(voice) if voice else 0} sessions, {len(voice.deadlines) if voice else 0} deadlines\n"
+                f"Connects: {stats.connects[shard_id]}, resumes: {stats.resumes[shard_id]}, "
+                f"disconnects: {stats.disconnects[shard_id]}"
+            ),
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@bot.command()
+@commands.is_owner()
+async def flightrec(ctx, target: str = None):
+    """Dump recent debug events for this server, a server id, a cog, or 'all' (owner only)"""
+    guild_id, cog = None, None
+    if target is None:
+        guild_id = ctx.guild.id if ctx.guild else None
+    elif target.isdigit():
+        guild_id = int(target)
+    elif target != 'all':
+        cog = target.lower()
+    path = await bot.flight.dump(f"Requested by {ctx.author.name}", guild_id, cog, force=True)
+    count = len(bot.flight.events(guild_id, cog))
+    await ctx.send(f"📼 {count} events written to `{path.name}`", file=discord.File(path) if count else None)
+
+def profile_report(result):
+    """Top hotspots as a message that fits in one Discord message"""
+    lines = [f"Profiled {result['seconds']:.1f}s, {result['samples']:,} samples, {result['idle']:.0%} idle",
+             "Files: " + ", ".join(path.name for path in (result['pstats'], result['collapsed']) if path is not None), ""]
+    if result['pstats'] is not None:
+        lines.insert(1, "cProfile was on, so call-heavy code is over-represented")
+    lines += [f"{share:6.1%}  {where}" for share, where in result['top']]
+    text = "\n".join(lines)
+    return f"```\n{text[:1900]}\n```"
+
+@bot.command()
+@commands.is_owner()
+async def profile(ctx, action: str, seconds: int = 30, mode: str = ''):
+    """Profile the running bot: !profile start [seconds] [exact] or !profile stop (owner only)"""
+    if action == 'start':
+        if bot.profiler.running:
+            await ctx.send("The profiler is already running; `!profile stop` first.")
+            return
+        seconds = max(1, min(seconds, 600))
+
+        async def report(result):
+            await ctx.send(profile_report(result))
+
+        bot.profiler.start(seconds, on_timeout=report, exact=mode == 'exact')
+        await ctx.send(f"⏱️ Profiling for up to {seconds}s; `!profile stop` to finish early.")
+    elif action == 'stop':
+        if not bot.profiler.running:
+            await ctx.send("The profiler is not running.")
+            return
+        await ctx.send(profile_report(await bot.profiler.stop()))
+    else:
+        await ctx.send("Usage: `!profile start [seconds] [exact]` or `!profile stop`")
 
 def is_authorized_user():
     async def predicate(ctx):
@@ -620,35 +843,22 @@ def is_authorized_user():
 async def givepoints(ctx, user: discord.Member, amount: int):
     """Give points to a user (only authorized users can use this)"""
     try:
-        async with aiosqlite.connect(bot.db_path) as db:
-            # First try to insert if user doesn't exist
-            try:
-                await db.execute('''
-                    INSERT INTO users (user_id, guild_id, points)
-                    VALUES (?, ?, ?)
-                ''', (user.id, ctx.guild.id, amount))
-                await db.commit()
-                current_points = amount
-            except sqlite3.IntegrityError:
-                # User exists, update points
-                await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                               (amount, user.id, ctx.guild.id))
-                await db.commit()
-                
-                # Get updated points
-                async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', 
-                                    (user.id, ctx.guild.id)) as cursor:
-                    result = await cursor.fetchone()
-                    current_points = result[0] if result else amount
-            
-            embed = discord.Embed(
-                title="💰 Points Given!",
-                description=f"Given {amount} points to {user.mention}\nTheir new balance: {current_points} points",
-                color=discord.Color.green()
-            )
-            await ctx.send(embed=embed)
-            logger.info(f"Given {amount} points to {user.name} (ID: {user.id}) in guild {ctx.guild.name} (ID: {ctx.guild.id})")
-            
+        if amount >= 0:
+            current_points = await bot.points.credit(user.id, ctx.guild.id, amount, reason='admin')
+        else:
+            current_points = await bot.points.try_debit(user.id, ctx.guild.id, -amount, reason='admin')
+            if current_points is None:
+                await ctx.send(f"{user.name} doesn't have {-amount} points to take!")
+                return
+        
+        embed = discord.Embed(
+            title="💰 Points Given!",
+            description=f"Given {amount} points to {user.mention}\nTheir new balance: {current_points} points",
+            color=discord.Color.green()
+        )
+        await ctx.send(embed=embed)
+        logger.info(f"Given {amount} points to {user.name} (ID: {user.id}) in guild {ctx.guild.name} (ID: {ctx.guild.id})")
+        
     except Exception as e:
         error_msg = f"Error giving points: {str(e)}"
         logger.error(error_msg)
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger('bot.db')
+
+# Days of change log kept; older files are covered by backup snapshots
+KEEP_DAYS = 30
+
+
+class ChangeLog:
+    """Durable copy of every committed ledger entry, one JSON line each
+
+    Kept outside the database (point CHANGELOG_DIR at another disk if you
+    can) so a point-in-time restore can replay the changes made after the
+    last snapshot even when the database file itself is lost. Lines are
+    appended as transactions commit and fsynced by sync(), which the
+    ledger calls from its flush loop.
+    """
+
+    def __init__(self, directory="data/changelog", keep_days: int = KEEP_DAYS):
+        self.directory = Path(directory)
+        self.keep_days = keep_days
+        self._file = None
+        self._day: Optional[str] = None
+        self._dirty = False
+
+    def _path(self, day: str) -> Path:
+        return self.directory / f"ledger-{day}.jsonl"
+
+    def append(self, entries: List[tuple]):
+        """Record committed (id, user_id, guild_id, delta, reason, game, ref_id, created_at, settled) entries"""
+        if not entries:
+            return
+        day = time.strftime('%Y%m%d')
+        if day != self._day:
+            self._rotate(day)
+        committed_at = time.time()
+        self._file.write(''.join(json.dumps(list(entry) + [committed_at]) + '\n' for entry in entries))
+        self._dirty = True
+
+    def _rotate(self, day: str):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._path(day), 'a', encoding='utf-8')
+        self._day = day
+        cutoff = time.strftime('%Y%m%d', time.localtime(time.time() - self.keep_days * 86400))
+        for old in self.directory.glob('ledger-*.jsonl'):
+            if old.stem[len('ledger-'):] < cutoff:
+                old.unlink()
+
+    def sync(self):
+        """Flush and fsync everything appended so far (blocking)"""
+        if self._file is not None and self._dirty:
+            self._dirty = False
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+            self._day = None
+
+
+def read_changes(directory, after_id: int = 0, until: Optional[float] = None) -> Iterator[tuple]:
+    """Entries with id > after_id and created_at <= until, in id order
+
+    A line cut short by a crash is skipped.
+    """
+    entries = {}
+    for path in sorted(Path(directory).glob('ledger-*.jsonl')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping unreadable change log line in {path.name}")
+                    continue
+                entry_id, created_at = entry[0], entry[7]
+                if entry_id > after_id and (until is None or created_at <= until):
+                    entries[entry_id] = tuple(entry[:9])
+    for entry_id in sorted(entries):
+        yield entries[entry_id]
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+logger = logging.getLogger('bot.cluster')
+
+BOT_DIR = Path(__file__).parent.absolute()
+# A process that dies sooner than this after starting counts as a crash loop
+STABLE_AFTER = 60
+MAX_BACKOFF = 300
+
+
+def recommended_shards(token: str) -> int:
+    """The shard count Discord recommends for this bot"""
+    response = requests.get("https://discord.com/api/v10/gateway/bot",
+                            headers={'Authorization': f"Bot {token}"}, timeout=10)
+    response.raise_for_status()
+    return response.json()['shards']
+
+
+def shard_groups(shard_count: int, processes: int) -> List[List[int]]:
+    """Split shards into contiguous groups, one per process"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+class Supervised:
+    """A child process restarted with exponential backoff when it exits"""
+
+    def __init__(self, name: str, argv: List[str], env: Dict[str, str], restart: bool = True):
+        self.name = name
+        self.argv = argv
+        self.env = env
+        self.restart = restart
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.output = b''
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _spawn(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.argv, cwd=BOT_DIR, env=self.env,
+            stdout=None if self.restart else asyncio.subprocess.PIPE
+        )
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+
+    async def _supervise(self):
+        backoff = 1
+        while True:
+            started = time.monotonic()
+            if self.restart:
+                code = await self.process.wait()
+            else:
+                self.output, _ = await self.process.communicate()
+                code = self.process.returncode
+            if self._stopping or not self.restart:
+                logger.info(f"{self.name} exited with {code}")
+                return code
+            backoff = 1 if time.monotonic() - started > STABLE_AFTER else min(backoff * 2, MAX_BACKOFF)
+            logger.warning(f"{self.name} exited with {code}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            self.restarts += 1
+            await self._spawn()
+
+    async def start(self):
+        await self._spawn()
+        self._task = asyncio.create_task(self._supervise())
+
+    async def wait(self):
+        return await self._task
+
+    async def stop(self, timeout: float = 30):
+        self._stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{self.name} did not stop after {timeout}s, killing it")
+            self.process.kill()
+            await self.process.wait()
+
+
+async def wait_for_socket(path: Path, service: Supervised, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not path.exists():
+        if service.process.returncode is not None:
+            raise RuntimeError(f"Points service exited with {service.process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Points service did not open {path} within {timeout}s")
+        await asyncio.sleep(0.1)
+
+
+async def run(args) -> int:
+    socket_path = Path(args.socket).absolute()
+    env = dict(os.environ)
+    service = Supervised('points service', [
+        sys.executable, str(BOT_DIR / 'points_service.py'),
+        '--db', str(args.db), '--socket', str(socket_path),
+    ], env)
+    if socket_path.exists():
+        socket_path.unlink()
+    await service.start()
+    await wait_for_socket(socket_path, service)
+
+    groups = shard_groups(args.shards, args.processes)
+    workers = []
+    for cluster_id, shard_ids in enumerate(groups):
+        ids = ','.join(map(str, shard_ids))
+        if args.standin:
+            argv = [sys.executable, str(BOT_DIR / 'standin_gateway.py'), '--socket', str(socket_path),
+                    '--shard-ids', ids, '--shard-count', str(args.shards), '--seconds', str(args.seconds)]
+        else:
+            argv = [sys.executable, str(BOT_DIR / 'bot.py')]
+        worker_env = dict(env, SHARD_COUNT=str(args.shards), SHARD_IDS=ids,
+                          POINTS_SOCKET=str(socket_path), CLUSTER_ID=str(cluster_id))
+        workers.append(Supervised(f"cluster {cluster_id} (shards {ids})", argv, worker_env, restart=not args.standin))
+    logger.info(f"Launching {len(workers)} processes for {args.shards} shards")
+    for worker in workers:
+        await worker.start()
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+
+    status = 0
+    if args.standin:
+        finished = asyncio.ensure_future(asyncio.gather(*(worker.wait() for worker in workers)))
+        await asyncio.wait([finished, asyncio.ensure_future(stopped.wait())], return_when=asyncio.FIRST_COMPLETED)
+        status = check_standin(workers) if finished.done() else 1
+    else:
+        await stopped.wait()
+
+    # Bots first, so their last settlements and checkpoints reach the service
+    await asyncio.gather(*(worker.stop() for worker in workers))
+    await service.stop()
+    return status
+
+
+def check_standin(workers: List[Supervised]) -> int:
+    """Print the stand-in summaries and return 0 if every balance matched"""
+    results = []
+    for worker in workers:
+        lines = worker.output.decode().strip().splitlines()
+        try:
+            results.append(json.loads(lines[-1]))
+        except (IndexError, ValueError):
+            results.append({'shards': worker.name, 'ok': False, 'error': f"no summary (exit {worker.process.returncode})"})
+    keys = ('members', 'voice_events', 'voice_points', 'bets', 'bets_refused', 'transfers', 'settlements', 'errors')
+    totals = {key: sum(result.get(key, 0) for result in results) for key in keys}
+    requests_sent = sum(result.get('client', {}).get('requests', 0) for result in results)
+    writes = sum(result.get('client', {}).get('batches', 0) for result in results)
+    print(json.dumps({'ok': all(result['ok'] for result in results), 'processes': len(results),
+                      'requests': requests_sent, 'writes': writes, **totals}, indent=2))
+    for result in results:
+        if not result['ok']:
+            print(json.dumps(result), file=sys.stderr)
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run the bot as several processes sharing one points service")
+    parser.add_argument('--processes', type=int, default=2, help="bot processes (default: 2)")
+    parser.add_argument('--shards', default=os.getenv('SHARD_COUNT', 'auto'),
+                        help="total shard count, or 'auto' to ask Discord (default: SHARD_COUNT or auto)")
+    parser.add_argument('--socket', default="data/points.sock")
+    parser.add_argument('--db', default="data/channobot.db")
+    parser.add_argument('--standin', action='store_true',
+                        help="run simulated shard traffic instead of bot.py and check every balance afterwards")
+    parser.add_argument('--seconds', type=float, default=10, help="stand-in run time (default: 10)")
+    args = parser.parse_args()
+
+    log_dir = BOT_DIR / "data" / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(log_dir / 'cluster.log', maxBytes=1024 * 1024, backupCount=5)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s'))
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    logger.addHandler(logging.StreamHandler())
+
+    if args.shards == 'auto':
+        args.shards = args.processes if args.standin else recommended_shards(os.getenv('DISCORD_TOKEN'))
+    args.shards = int(args.shards)
+    sys.exit(asyncio.run(run(args)))
@@ -1,28 +1,32 @@
 import discord
 from discord.ext import commands
 import asyncio
+import logging
 from datetime import datetime, timedelta
 import requests
 from bs4 import BeautifulSoup
 import re
 import random
-import aiosqlite
+
+logger = logging.getLogger('bot')
 
 class Betting(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.active_bets = {}
+        # Debug events go to the in-memory flight recorder, dumped on errors or by !flightrec
+        self.debug = bot.flight.recorder('betting')
 
     @commands.command()
     async def custombet(self, ctx, player1: discord.Member, player2: discord.Member, amount: int, *, description: str):
         """Create a custom 1v1 bet between two players"""
-        print(f"[DEBUG] Custombet command triggered by {ctx.author.name}")
-        print(f"[DEBUG] Arguments: player1={player1.name}, player2={player2.name}, amount={amount}, description={description}")
+        self.debug(ctx.guild.id, "Custombet command triggered by %s", ctx.author.name)
+        self.debug(ctx.guild.id, "Arguments: player1=%s, player2=%s, amount=%s, description=%s", player1.name, player2.name, amount, description)
         try:
             await self._create_bet(ctx, player1, player2, amount, description, bet_type='custom')
-            print("[DEBUG] _create_bet called successfully")
+            self.debug(ctx.guild.id, "_create_bet called successfully")
         except Exception as e:
-            print(f"[DEBUG] Error in custombet: {str(e)}")
+            self.debug(ctx.guild.id, "Error in custombet: %s", str(e))
             await ctx.send(f"Error creating bet: {str(e)}")
 
     @commands.command()
@@ -105,35 +109,32 @@ class Betting(commands.Cog):
 
     async def _create_bet(self, ctx, player1, player2, amount, description, bet_type, is_test=False):
         """Common bet creation logic"""
-        print(f"[DEBUG] _create_bet called with type={bet_type}")
-        print(f"[DEBUG] Current active bets before creation: {list(self.active_bets.keys())}")
+        self.debug(ctx.guild.id, "_create_bet called with type=%s", bet_type)
+        self.debug(ctx.guild.id, "Current active bets before creation: %s", list(self.active_bets.keys()))
         
         if not is_test:
             if player1.bot or player2.bot:
-                print("[DEBUG] Rejected: Bot involved in bet")
+                self.debug(ctx.guild.id, "Rejected: Bot involved in bet")
                 await ctx.send("You cannot create bets involving bots!")
                 return None
 
             if player1 == player2:
-                print("[DEBUG] Rejected: Same player")
+                self.debug(ctx.guild.id, "Rejected: Same player")
                 await ctx.send("You cannot create a bet between the same player!")
                 return None
 
         if amount < 1:
-            print("[DEBUG] Rejected: Invalid amount")
+            self.debug(ctx.guild.id, "Rejected: Invalid amount")
             await ctx.send("Bet amount must be at least 1 point!")
             return None
 
         # Check if player1 has enough points
-        print(f"[DEBUG] Checking points for {player1.name}")
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', (player1.id, ctx.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                current_points = result[0] if result else 0
-                print(f"[DEBUG] Current points: {current_points}")
+        self.debug(ctx.guild.id, "Checking points for %s", player1.name)
+        current_points = await self.bot.points.balance(player1.id, ctx.guild.id)
+        self.debug(ctx.guild.id, "Current points: %s", current_points)
 
         if current_points < amount:
-            print(f"[DEBUG] Rejected: Not enough points ({current_points} < {amount})")
+            self.debug(ctx.guild.id, "Rejected: Not enough points (%s < %s)", current_points, amount)
             await ctx.send(f"You don't have enough points! You have {current_points} points but need {amount}.")
             return None
 
@@ -148,7 +149,7 @@ class Betting(commands.Cog):
         
         # Use message ID as bet ID
         bet_id = str(message.id)
-        print(f"[DEBUG] Generated bet ID (message ID): {bet_id}")
+        self.debug(ctx.guild.id, "Generated bet ID (message ID): %s", bet_id)
         
         bet_data = {
             'announcer': ctx.author.id,
@@ -164,9 +165,9 @@ class Betting(commands.Cog):
             'message_id': message.id
         }
         
-        print(f"[DEBUG] Created bet data: {bet_data}")
+        self.debug(ctx.guild.id, "Created bet data: %s", dict(bet_data))
         self.active_bets[bet_id] = bet_data
-        print(f"[DEBUG] Current active bets after creation: {list(self.active_bets.keys())}")
+        self.debug(ctx.guild.id, "Current active bets after creation: %s", list(self.active_bets.keys()))
         
         # Update the embed to include the bet ID
         embed.set_footer(text=f"Bet ID: {bet_id}")
@@ -180,17 +181,18 @@ class Betting(commands.Cog):
             # Format the summoner name for the URL
             formatted_name = summoner_name.replace(' ', '%20')
             url = f"https://www.op.gg/summoners/na/{formatted_name}"
-            print(f"Checking URL: {url}")  # Debug log
+            self.debug(None, "Checking URL: %s", url)
             
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
             
-            response = requests.get(url, headers=headers)
-            print(f"Response status: {response.status_code}")  # Debug log
+            # requests blocks; keep it off the event loop
+            response = await asyncio.to_thread(requests.get, url, headers=headers, timeout=10)
+            self.debug(None, "Response status: %s", response.status_code)
             
             if response.status_code != 200:
-                print(f"Error accessing op.gg: {response.status_code}")
+                logger.error(f"Error accessing op.gg: {response.status_code}")
                 return None
                 
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -210,7 +212,7 @@ class Betting(commands.Cog):
             for selector in selectors:
                 elements = soup.select(selector)
                 if elements:
-                    print(f"Found elements with selector {selector}: {elements}")  # Debug log
+                    self.debug(None, "Found elements with selector %s: %s", selector, [element.get_text() for element in elements])
                     for element in elements:
                         text = element.get_text().lower()
                         if 'victory' in text or 'win' in text:
@@ -218,76 +220,75 @@ class Betting(commands.Cog):
                         elif 'defeat' in text or 'lose' in text:
                             return False
             
-            # If we couldn't find a result, save the HTML for debugging
-            with open('debug_opgg.html', 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            print("Saved HTML to debug_opgg.html for inspection")
+            # If we couldn't find a result, keep the start of the page for the flight recorder
+            self.debug(None, "No game result found for %s; page starts: %s", summoner_name, response.text[:2000])
             
             return None
             
         except Exception as e:
-            print(f"Error checking League game: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Error checking League game: {str(e)}", exc_info=True)
             return None
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
         """Handle bet acceptance via reactions"""
-        print(f"[DEBUG] Reaction added: {reaction.emoji} by {user.name}")
+        guild_id = reaction.message.guild.id if reaction.message.guild else None
+        self.debug(guild_id, "Reaction added: %s by %s", reaction.emoji, user.name)
         
         if user.bot:
-            print("[DEBUG] Ignoring bot reaction")
+            self.debug(guild_id, "Ignoring bot reaction")
             return
             
         message = reaction.message
-        print(f"[DEBUG] Message ID: {message.id}")
+        self.debug(guild_id, "Message ID: %s", message.id)
         
         if str(reaction.emoji) != '👍':
-            print("[DEBUG] Not a thumbs up reaction")
+            self.debug(guild_id, "Not a thumbs up reaction")
             return
             
         # Find the bet associated with this message
         bet_id = str(message.id)
-        print(f"[DEBUG] Looking for bet with ID: {bet_id}")
-        print(f"[DEBUG] Active bets: {list(self.active_bets.keys())}")
+        self.debug(guild_id, "Looking for bet with ID: %s", bet_id)
+        self.debug(guild_id, "Active bets: %s", list(self.active_bets.keys()))
         
         if bet_id not in self.active_bets:
-            print("[DEBUG] No bet found with this ID")
+            self.debug(guild_id, "No bet found with this ID")
             return
             
         bet = self.active_bets[bet_id]
-        print(f"[DEBUG] Found bet: {bet}")
+        self.debug(guild_id, "Found bet: %s", dict(bet))
         
         if bet['status'] != 'pending_consent':
-            print(f"[DEBUG] Bet status is not pending_consent: {bet['status']}")
+            self.debug(guild_id, "Bet status is not pending_consent: %s", bet['status'])
             return
             
         if user.id in [bet['player1'], bet['player2']] or (bet.get('is_test') and user.id == bet['player1']):
-            print(f"[DEBUG] Valid player {user.name} reacted")
+            self.debug(guild_id, "Valid player %s reacted", user.name)
             bet['consented'].add(user.id)
-            print(f"[DEBUG] Current consents: {bet['consented']}")
+            self.debug(guild_id, "Current consents: %s", set(bet['consented']))
             
             # If both players have consented (or if it's a test bet and the real player consented)
             consent_needed = 2 if not bet.get('is_test') else 1
             if len(bet['consented']) >= consent_needed:
-                print("[DEBUG] All required consents received")
-                bet['status'] = 'active'
+                self.debug(guild_id, "All required consents received")
                 
                 # Deduct points from both players for flip bets
                 if bet['type'] == 'flip':
-                    print("[DEBUG] Processing flip bet deductions")
-                    async with aiosqlite.connect(self.bot.db_path) as db:
-                        await db.execute('UPDATE users SET points = points - ? WHERE user_id IN (?, ?) AND guild_id = ?', 
-                                       (bet['amount'], bet['player1'], bet['player2'], bet['guild_id']))
-                        await db.commit()
+                    self.debug(guild_id, "Processing flip bet deductions")
+                    debits = [(bet['player1'], bet['guild_id'], bet['amount']),
+                              (bet['player2'], bet['guild_id'], bet['amount'])]
                 else:
                     # Original deduction for other bet types
-                    print("[DEBUG] Processing standard bet deduction")
-                    async with aiosqlite.connect(self.bot.db_path) as db:
-                        await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                                       (bet['amount'], bet['player1'], bet['guild_id']))
-                        await db.commit()
+                    self.debug(guild_id, "Processing standard bet deduction")
+                    debits = [(bet['player1'], bet['guild_id'], bet['amount'])]
+
+                short = await self.bot.points.try_debit_all(debits, reason='bet', game=bet['type'], ref_id=bet_id)
+                if short:
+                    self.debug(guild_id, "Rejected: %s can no longer cover %s", short[0], bet['amount'])
+                    await message.channel.send(f"❌ <@{short[0]}> no longer has enough points for this bet!")
+                    del self.active_bets[bet_id]
+                    return
+                bet['status'] = 'active'
                 
                 embed = discord.Embed(
                     title="🎲 Bet Activated!",
@@ -298,11 +299,11 @@ class Betting(commands.Cog):
 
                 # Auto-resolve flip bets
                 if bet.get('auto_resolve'):
-                    print("[DEBUG] Auto-resolving flip bet")
+                    self.debug(guild_id, "Auto-resolving flip bet")
                     await asyncio.sleep(3)  # Add some suspense
                     await self.resolve_flip_bet(message.channel, bet_id)
         else:
-            print(f"[DEBUG] Invalid player {user.name} reacted")
+            self.debug(guild_id, "Invalid player %s reacted", user.name)
 
     async def resolve_flip_bet(self, channel, bet_id):
         """Automatically resolve a coin flip bet"""
@@ -326,10 +327,7 @@ class Betting(commands.Cog):
         winnings = bet['amount'] * 2
         
         # Award points to winner
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                           (winnings, winner.id, bet['guild_id']))
-            await db.commit()
+        await self.bot.points.credit(winner.id, bet['guild_id'], winnings, reason='payout', game=bet['type'], ref_id=bet_id)
 
         # Create results embed with coin flip animation
         flip_msg = await channel.send("Flipping coin...")
@@ -359,51 +357,48 @@ class Betting(commands.Cog):
     @commands.command()
     async def resolve(self, ctx, bet_id: str, winner: discord.Member = None):
         """Resolve a custom bet by declaring the winner"""
-        print(f"[DEBUG] Resolve command called for bet {bet_id}")
-        print(f"[DEBUG] Available bet IDs: {list(self.active_bets.keys())}")
-        print(f"[DEBUG] Winner: {winner.name if winner else 'None'}")
+        self.debug(ctx.guild.id, "Resolve command called for bet %s", bet_id)
+        self.debug(ctx.guild.id, "Available bet IDs: %s", list(self.active_bets.keys()))
+        self.debug(ctx.guild.id, "Winner: %s", winner.name if winner else 'None')
         
         if bet_id not in self.active_bets:
-            print(f"[DEBUG] Bet {bet_id} not found in active bets")
+            self.debug(ctx.guild.id, "Bet %s not found in active bets", bet_id)
             await ctx.send(f"This bet doesn't exist! Available bets: {', '.join(list(self.active_bets.keys()))}")
             return
             
         bet = self.active_bets[bet_id]
-        print(f"[DEBUG] Found bet: {bet}")
+        self.debug(ctx.guild.id, "Found bet: %s", dict(bet))
         
         # Only announcer can resolve
         if ctx.author.id != bet['announcer']:
-            print(f"[DEBUG] Unauthorized resolve attempt by {ctx.author.name}")
+            self.debug(ctx.guild.id, "Unauthorized resolve attempt by %s", ctx.author.name)
             await ctx.send("Only the bet announcer can resolve this bet!")
             return
             
         if bet['status'] != 'active':
-            print(f"[DEBUG] Invalid bet status: {bet['status']}")
+            self.debug(ctx.guild.id, "Invalid bet status: %s", bet['status'])
             await ctx.send("This bet isn't active yet!")
             return
             
         # For custom bets, winner must be specified
         if bet['type'] == 'custom' and winner is None:
-            print("[DEBUG] No winner specified for custom bet")
+            self.debug(ctx.guild.id, "No winner specified for custom bet")
             await ctx.send("You must specify a winner for custom bets!")
             return
             
         # Validate winner is part of the bet
         if winner.id not in [bet['player1'], bet['player2']]:
-            print(f"[DEBUG] Invalid winner {winner.name} - not part of bet")
+            self.debug(ctx.guild.id, "Invalid winner %s - not part of bet", winner.name)
             await ctx.send("The winner must be one of the players in the bet!")
             return
             
-        print(f"[DEBUG] Processing win for {winner.name}")
+        self.debug(ctx.guild.id, "Processing win for %s", winner.name)
         # Calculate winnings (winner gets their bet back plus the opponent's bet)
         winnings = bet['amount'] * 2
         
         # Award points to winner
-        print(f"[DEBUG] Awarding {winnings} points to {winner.name}")
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                           (winnings, winner.id, bet['guild_id']))
-            await db.commit()
+        self.debug(ctx.guild.id, "Awarding %s points to %s", winnings, winner.name)
+        await self.bot.points.credit(winner.id, bet['guild_id'], winnings, reason='payout', game=bet['type'], ref_id=bet_id)
 
         # Create results embed
         loser_id = bet['player1'] if winner.id == bet['player2'] else bet['player2']
@@ -416,7 +411,7 @@ class Betting(commands.Cog):
         )
         
         await ctx.send(embed=embed)
-        print(f"[DEBUG] Bet {bet_id} resolved successfully")
+        self.debug(ctx.guild.id, "Bet %s resolved successfully", bet_id)
         del self.active_bets[bet_id]
 
     @commands.command()
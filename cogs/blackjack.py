@@ -2,7 +2,6 @@ import discord
 from discord.ext import commands
 import random
 import asyncio
-import aiosqlite
 from datetime import datetime
 
 class Card:
@@ -61,6 +60,7 @@ class BlackjackCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.active_games = {}
+        self.debug = bot.flight.recorder('blackjack')
         self.deck = Deck()
 
     @commands.command(name="blackjack")
@@ -80,31 +80,20 @@ class BlackjackCog(commands.Cog):
             await ctx.send("You already have an active game!")
             return
             
-        # Check if player has enough points for potential double/split
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', 
-                               (ctx.author.id, ctx.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                current_points = result[0] if result else 0
-        
-        if current_points < bet:
+        # Deduct initial bet only if the player can cover it
+        if await self.bot.points.try_debit(ctx.author.id, ctx.guild.id, bet, reason='bet', game='blackjack') is None:
+            current_points = await self.bot.points.balance(ctx.author.id, ctx.guild.id)
             await ctx.send(f"You don't have enough points! You have {current_points} points but tried to bet {bet}.")
             return
-            
-        # Deduct initial bet
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                           (bet, ctx.author.id, ctx.guild.id))
-            await db.commit()
         
         # Initialize game
         player_hand = [self.deck.draw(), self.deck.draw()]
         dealer_hand = [self.deck.draw(), self.deck.draw()]
         
-        # Debug print initial hand
-        print(f"Initial hand: {[str(card) for card in player_hand]}")
-        print(f"Can split: {self.can_split(player_hand)}")
-        print(f"Card values: {[card.get_blackjack_value() for card in player_hand]}")
+        # Kept in the flight recorder in case the game breaks later
+        self.debug(ctx.guild.id, "Initial hand: %s", [str(card) for card in player_hand])
+        self.debug(ctx.guild.id, "Can split: %s", self.can_split(player_hand))
+        self.debug(ctx.guild.id, "Card values: %s", [card.get_blackjack_value() for card in player_hand])
         
         self.active_games[ctx.author.id] = {
             'deck': self.deck,
@@ -127,18 +116,12 @@ class BlackjackCog(commands.Cog):
         if player_value == 21:
             if dealer_value == 21:
                 # Push - return bet
-                async with aiosqlite.connect(self.bot.db_path) as db:
-                    await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                                   (bet, ctx.author.id, ctx.guild.id))
-                    await db.commit()
+                await self.add_points(ctx.author.id, bet, ctx.guild.id, reason='refund')
                 await ctx.send("🤝 Both have Blackjack! Push - your bet is returned.")
             else:
                 # Blackjack pays 3:2
                 winnings = int(bet * 2.5)
-                async with aiosqlite.connect(self.bot.db_path) as db:
-                    await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                                   (winnings, ctx.author.id, ctx.guild.id))
-                    await db.commit()
+                await self.add_points(ctx.author.id, winnings, ctx.guild.id)
                 await ctx.send(f"🎉 Blackjack! You won {winnings} points!")
             del self.active_games[ctx.author.id]
             return
@@ -252,10 +235,9 @@ class BlackjackCog(commands.Cog):
         current_bet = game['bets'][game['current_hand']]
         
         # Deduct additional bet
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                           (current_bet, ctx.author.id, ctx.guild.id))
-            await db.commit()
+        if await self.bot.points.try_debit(ctx.author.id, ctx.guild.id, current_bet, reason='bet', game='blackjack') is None:
+            await ctx.send(f"You don't have enough points to double down! You need another {current_bet} points.")
+            return
         game['bets'][game['current_hand']] *= 2
         
         # Draw one card
@@ -282,10 +264,9 @@ class BlackjackCog(commands.Cog):
         current_bet = game['bets'][game['current_hand']]
         
         # Deduct bet for the new hand
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                           (current_bet, ctx.author.id, ctx.guild.id))
-            await db.commit()
+        if await self.bot.points.try_debit(ctx.author.id, ctx.guild.id, current_bet, reason='bet', game='blackjack') is None:
+            await ctx.send(f"You don't have enough points to split! You need another {current_bet} points.")
+            return
         
         # Create new hand from split
         new_hand = [current_hand.pop()]
@@ -352,7 +333,7 @@ class BlackjackCog(commands.Cog):
                 elif hand_value < dealer_value:
                     result = f"Lost {bet} points"
                 else:
-                    await self.add_points(ctx.author.id, bet, ctx.guild.id)
+                    await self.add_points(ctx.author.id, bet, ctx.guild.id, reason='refund')
                     result = f"Push! {bet} points returned"
                 
                 embed.add_field(name=f"Hand {i+1}", value=f"{hand_str} ({hand_value}) - {result}", inline=False)
@@ -403,12 +384,9 @@ class BlackjackCog(commands.Cog):
         else:
             return 'push'
 
-    async def add_points(self, user_id, points, guild_id):
+    async def add_points(self, user_id, points, guild_id, reason='payout'):
         """Add points to the user's account"""
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                           (points, user_id, guild_id))
-            await db.commit()
+        await self.bot.points.credit(user_id, guild_id, points, reason=reason, game='blackjack')
 
     @commands.Cog.listener()
     async def on_message(self, message):
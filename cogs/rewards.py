@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 import asyncio
-import aiosqlite
 
 class Rewards(commands.Cog):
     def __init__(self, bot):
@@ -57,24 +56,14 @@ class Rewards(commands.Cog):
             await ctx.send(f"{member.name} is not in a voice channel!")
             return
 
-        # Check if user has enough points
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', (ctx.author.id, ctx.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                current_points = result[0] if result else 0
-
         cost = self.rewards[reward]['cost']
 
-        if current_points < cost:
+        # Deduct points only if the user can cover the cost
+        if await self.bot.points.try_debit(ctx.author.id, ctx.guild.id, cost, reason='purchase', game=reward) is None:
+            current_points = await self.bot.points.balance(ctx.author.id, ctx.guild.id)
             await ctx.send(f"You don't have enough points! You need {cost} points but have {current_points}.")
             return
 
-        # Deduct points
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                           (cost, ctx.author.id, ctx.guild.id))
-            await db.commit()
-
         # Apply the reward effect
         if reward == 'disconnect':
             await self.disconnect_user(ctx, member)
@@ -89,10 +78,7 @@ class Rewards(commands.Cog):
         else:
             await ctx.send(f"{member.name} is not in a voice channel!")
             # Refund points if action couldn't be completed
-            async with aiosqlite.connect(self.bot.db_path) as db:
-                await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                               (self.rewards['disconnect']['cost'], ctx.author.id, ctx.guild.id))
-                await db.commit()
+            await self.bot.points.credit(ctx.author.id, ctx.guild.id, self.rewards['disconnect']['cost'], reason='refund', game='disconnect')
 
     async def mute_user(self, ctx, member: discord.Member):
         """Temporarily mute a user"""
@@ -110,10 +96,7 @@ class Rewards(commands.Cog):
         else:
             await ctx.send(f"{member.name} is not in a voice channel!")
             # Refund points if action couldn't be completed
-            async with aiosqlite.connect(self.bot.db_path) as db:
-                await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                               (self.rewards['mute']['cost'], ctx.author.id, ctx.guild.id))
-                await db.commit()
+            await self.bot.points.credit(ctx.author.id, ctx.guild.id, self.rewards['mute']['cost'], reason='refund', game='mute')
 
 async def setup(bot):
     await bot.add_cog(Rewards(bot)) 
\ No newline at end of file
@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 import random
-import aiosqlite
 import asyncio
 
 class Slots(commands.Cog):
@@ -25,22 +24,11 @@ class Slots(commands.Cog):
             await ctx.send("Bet amount must be at least 1 point!")
             return
             
-        # Check if player has enough points
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            async with db.execute('SELECT points FROM users WHERE user_id = ? AND guild_id = ?', 
-                               (ctx.author.id, ctx.guild.id)) as cursor:
-                result = await cursor.fetchone()
-                current_points = result[0] if result else 0
-                
-        if current_points < bet:
+        # Deduct bet only if the player can cover it
+        if await self.bot.points.try_debit(ctx.author.id, ctx.guild.id, bet, reason='bet', game='slots') is None:
+            current_points = await self.bot.points.balance(ctx.author.id, ctx.guild.id)
             await ctx.send(f"You don't have enough points! You have {current_points} points but tried to bet {bet}.")
             return
-            
-        # Deduct bet
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            await db.execute('UPDATE users SET points = points - ? WHERE user_id = ? AND guild_id = ?', 
-                           (bet, ctx.author.id, ctx.guild.id))
-            await db.commit()
         
         # Create initial embed
         embed = discord.Embed(
@@ -79,10 +67,7 @@ class Slots(commands.Cog):
             
         # Award winnings if any
         if winnings > 0:
-            async with aiosqlite.connect(self.bot.db_path) as db:
-                await db.execute('UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?', 
-                               (winnings, ctx.author.id, ctx.guild.id))
-                await db.commit()
+            await self.bot.points.credit(ctx.author.id, ctx.guild.id, winnings, reason='payout', game='slots')
                 
         # Show final result
         embed = discord.Embed(
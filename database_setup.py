@@ -0,0 +1,80 @@
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from incremental_backup import snapshot_database_async
+from migrations import MigrationRunner
+
+logger = logging.getLogger('bot.db')
+
+# Seeded into an empty database
+DEFAULT_USERS = [(128712048790994945, 0, 1000)]
+
+
+async def open_database(pool, points, backup_dir) -> Optional[dict]:
+    """Snapshot, open, migrate and seed the database; returns the startup snapshot summary"""
+    last_backup = None
+    # Backup existing database if it exists
+    if Path(pool.db_path).exists():
+        last_backup = await snapshot_database_async(pool.db_path, backup_dir)
+        logger.info("Created database backup")
+
+    # Open the shared connection pool
+    await pool.start()
+
+    # Bring the schema up to date; large tables are migrated in chunks
+    await MigrationRunner(pool).run()
+
+    # Only initialize default points if the table is empty
+    count = await points.user_count()
+    if count == 0:
+        logger.info("New database detected, initializing with default points")
+        await points.create_users(DEFAULT_USERS)
+    else:
+        logger.info(f"Using existing database with {count} users")
+    return last_backup
+
+
+def stats_fields(pool, maintenance, points, last_backup=None) -> List[Tuple[str, str]]:
+    """(name, value) fields for !dbstats"""
+    fields = []
+    stats = maintenance.stats
+    last_run = datetime.fromtimestamp(stats['last_run_at']).strftime('%Y-%m-%d %H:%M:%S') if stats['last_run_at'] else 'never'
+    fields.append(("Profile", (
+        f"journal_mode: {pool.journal_mode}\n"
+        f"synchronous: {pool.profile.synchronous}\n"
+        f"cache: {pool.profile.cache_size_kib} KiB, mmap: {pool.profile.mmap_size // (1024 * 1024)} MiB\n"
+        f"busy_timeout: {pool.profile.busy_timeout_ms} ms"
+    )))
+    fields.append(("Maintenance", (
+        f"Runs: {stats['runs']} (skipped while busy: {stats['skipped_busy']}, errors: {stats['errors']})\n"
+        f"Checkpoints: {stats['checkpoints']} ({stats['truncating_checkpoints']} truncating, {stats['checkpoint_busy']} busy)\n"
+        f"WAL frames checkpointed: {stats['wal_frames_checkpointed']:,} (last WAL size: {stats['last_wal_frames']} frames)\n"
+        f"Optimize runs: {stats['optimize_runs']}, vacuum runs: {stats['vacuum_runs']} ({stats['pages_vacuumed']} pages)\n"
+        f"Last run: {last_run} ({stats['last_run_ms']:.1f} ms)"
+    )))
+    cache = points.cache.stats()
+    fields.append(("Balance Cache", (
+        f"Entries: {cache['entries']:,} / {points.cache.max_entries:,}\n"
+        f"Hits: {cache['hits']:,}, misses: {cache['misses']:,} ({cache['hit_rate']:.1%} hit rate)\n"
+        f"Evictions: {cache['evictions']:,}"
+    )))
+    if last_backup:
+        fields.append(("Last Backup", (
+            f"Snapshot {last_backup['id']}: {last_backup['changed_pages']:,} of {last_backup['page_count']:,} pages changed\n"
+            f"{last_backup['new_chunks']:,} new pages stored ({last_backup['bytes_written'] / 1024:,.0f} KiB) in {last_backup['duration_ms']:.0f} ms"
+        )))
+    timings = sorted(points.timings.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:6]
+    if timings:
+        fields.append(("Points Operations", "\n".join(
+            f"{operation}: {stats['calls']:,} calls, avg {stats['total_ms'] / stats['calls']:.2f} ms, max {stats['max_ms']:.1f} ms"
+            for operation, stats in timings
+        )))
+    ledger = points.ledger.stats
+    fields.append(("Ledger", (
+        f"Entries: {ledger['appended']:,} appended, {ledger['written']:,} written in {ledger['batches']:,} batches, {len(points.ledger)} queued\n"
+        f"Compactions: {ledger['compactions']} ({ledger['compacted_entries']:,} entries folded)\n"
+        f"Last compaction: {ledger['last_compaction_ms']:.1f} ms, checkpoint {ledger['last_checkpoint_id']}"
+    )))
+    return fields
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import aiosqlite
+
+from storage_profile import StorageProfile
+
+logger = logging.getLogger('bot.db')
+
+# Reader connections kept open next to the single writer
+DEFAULT_READERS = 3
+# Compiled statements kept per connection (sqlite3's LRU statement cache)
+DEFAULT_STATEMENT_CACHE = 256
+
+
+class DatabasePool:
+    """Long-lived aiosqlite connections shared by the bot and every cog
+
+    All writes go through one writer connection guarded by a lock, so
+    transactions never interleave. Reads are spread over a few reader
+    connections handed out from an idle queue.
+    """
+
+    def __init__(self, db_path, readers: int = DEFAULT_READERS,
+                 statement_cache_size: int = DEFAULT_STATEMENT_CACHE,
+                 profile: Optional[StorageProfile] = None):
+        self.db_path = Path(db_path)
+        self.reader_count = max(1, readers)
+        self.statement_cache_size = statement_cache_size
+        self.profile = profile or StorageProfile()
+        self.journal_mode: Optional[str] = None
+        self._last_write = time.monotonic()
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._after_commit: List[Callable[[], None]] = []
+        self._after_rollback: List[Callable[[], None]] = []
+        self._start_lock = asyncio.Lock()
+        self._timing_hooks: List[Callable[[str, float], None]] = []
+
+    @property
+    def started(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path, cached_statements=self.statement_cache_size)
+        await self.profile.apply_connection(conn)
+        return conn
+
+    async def start(self):
+        """Open the writer and reader connections (safe to call more than once)"""
+        async with self._start_lock:
+            if self.started:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = await self._connect()
+            self.journal_mode = await self.profile.apply_database(self._writer)
+            self._idle_readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                conn = await self._connect()
+                self._readers.append(conn)
+                self._idle_readers.put_nowait(conn)
+            logger.info(f"Database pool started at {self.db_path} "
+                        f"(1 writer, {self.reader_count} readers, journal_mode={self.journal_mode})")
+
+    async def close(self):
+        """Commit outstanding work and close every connection"""
+        async with self._start_lock:
+            if not self.started:
+                return
+            async with self._write_lock:
+                await self._writer.commit()
+                # Recommended on close so query planner statistics stay current
+                await self._writer.execute('PRAGMA optimize')
+                await self._writer.close()
+                self._writer = None
+            for conn in self._readers:
+                await conn.close()
+            self._readers.clear()
+            self._idle_readers = None
+            logger.info("Database pool closed")
+
+    @asynccontextmanager
+    async def read(self):
+        """Borrow a reader connection for the duration of the block"""
+        if not self.started:
+            raise RuntimeError("Database pool has not been started")
+        idle = self._idle_readers
+        if self._timing_hooks:
+            started = time.perf_counter()
+            conn = await idle.get()
+            self._report('read_wait', time.perf_counter() - started)
+        else:
+            conn = await idle.get()
+        try:
+            yield conn
+        finally:
+            idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Hold the writer for one transaction, committed on exit and rolled back on error"""
+        if not self.started:
+            raise RuntimeError("Database pool has not been started")
+        waiting = time.perf_counter()
+        async with self._write_lock:
+            started = time.perf_counter()
+            try:
+                yield self._writer
+            except BaseException:
+                callbacks, self._after_rollback = self._after_rollback, []
+                self._after_commit.clear()
+                await self._writer.rollback()
+                for callback in callbacks:
+                    callback()
+                raise
+            else:
+                await self._writer.commit()
+                callbacks, self._after_commit = self._after_commit, []
+                self._after_rollback.clear()
+                for callback in callbacks:
+                    callback()
+            finally:
+                self._last_write = time.monotonic()
+                if self._timing_hooks:
+                    self._report('write_wait', started - waiting)
+                    self._report('write', time.perf_counter() - started)
+
+    def add_timing_hook(self, hook: Callable[[str, float], None]):
+        """Call hook(kind, seconds) for the time spent waiting for a connection
+        ('read_wait', 'write_wait') and holding the writer ('write')"""
+        self._timing_hooks.append(hook)
+
+    def _report(self, kind: str, seconds: float):
+        for hook in self._timing_hooks:
+            try:
+                hook(kind, seconds)
+            except Exception as e:
+                logger.error(f"Database timing hook failed: {str(e)}")
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Run callback once the current write transaction commits, before the writer is released
+
+        Used to keep in-memory state in step with the database: the callback
+        is dropped if the transaction rolls back, and no other write can
+        slip in between the commit and the callback.
+        """
+        self._after_commit.append(callback)
+
+    def after_rollback(self, callback: Callable[[], None]):
+        """Run callback if the current write transaction is rolled back"""
+        self._after_rollback.append(callback)
+
+    def seconds_since_write(self) -> float:
+        """Time since the writer was last released, used to find quiet periods"""
+        if self._write_lock.locked():
+            return 0.0
+        return time.monotonic() - self._last_write
+
+    async def fetchone(self, sql: str, params=()):
+        """Run a read query and return its first row"""
+        async with self.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, params=()):
+        """Run a read query and return every row"""
+        async with self.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
@@ -0,0 +1,106 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger('bot')
+
+
+class DeadlineScheduler:
+    """Calls callback(key) once a key's deadline passes
+
+    Deadlines live in a min-heap. Rescheduling pushes a new entry and
+    leaves the old one in place to be skipped when it surfaces, so each
+    schedule() or cancel() costs O(log n) at most. A single task sleeps
+    until the earliest deadline and is only woken early when a sooner one
+    is scheduled, so nothing runs while no deadline is due.
+    """
+
+    def __init__(self, callback: Callable[[Hashable], None], clock: Callable[[], float] = time.monotonic):
+        self.callback = callback
+        self.clock = clock
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def deadline(self, key) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def schedule(self, key, deadline: float):
+        """Set (or move) the deadline for key"""
+        earliest = self._heap[0][0] if self._heap else None
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        # Superseded entries are dropped once they outnumber the live ones
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+        if self._wakeup is not None and (earliest is None or deadline < earliest):
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def _compact(self):
+        self._heap = [(deadline, seq, key) for deadline, seq, key in self._heap
+                      if self._deadlines.get(key) == deadline]
+        heapq.heapify(self._heap)
+
+    def run_due(self) -> int:
+        """Fire every deadline that has passed and return how many fired"""
+        now = self.clock()
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != deadline:
+                continue
+            del self._deadlines[key]
+            fired += 1
+            try:
+                self.callback(key)
+            except Exception as e:
+                logger.error(f"Deadline callback for {key} failed: {str(e)}")
+        self.fired += fired
+        return fired
+
+    def _next_delay(self) -> Optional[float]:
+        while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
+
+    async def _run(self):
+        while True:
+            self.run_due()
+            self._wakeup.clear()
+            delay = self._next_delay()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
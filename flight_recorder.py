@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('bot')
+
+# (wall time, cog, guild_id, format string, args)
+Event = Tuple[float, str, Optional[int], str, tuple]
+
+
+class CogRecorder:
+    """record() bound to one cog, so cogs can call self.debug(guild_id, "...", *args)"""
+
+    def __init__(self, recorder: "FlightRecorder", cog: str):
+        self.recorder = recorder
+        self.cog = cog
+
+    def __call__(self, guild_id: Optional[int], message: str, *args):
+        self.recorder.record(self.cog, guild_id, message, *args)
+
+
+class FlightRecorder:
+    """Recent debug events kept in memory, written out only when something breaks
+
+    Every event goes into a fixed-size ring for its guild and one for its
+    cog. Recording stores the format string and arguments without
+    formatting them, so an event costs two deque appends; messages are
+    only built when a ring is dumped. Pass copies of mutable state (a bet
+    dict, a hand) if the dump should show it as it was at the time.
+    """
+
+    def __init__(self, dump_dir, size: int = 500, max_guilds: int = 1000, min_dump_interval: float = 60):
+        self.dump_dir = Path(dump_dir)
+        self.size = size
+        self.max_guilds = max_guilds
+        self.min_dump_interval = min_dump_interval
+        self.guilds: "OrderedDict[int, Deque[Event]]" = OrderedDict()
+        self.cogs: Dict[str, Deque[Event]] = {}
+        self._last_dump: Dict[tuple, float] = {}
+        self.stats = {'events': 0, 'dumps': 0, 'dumps_skipped': 0}
+
+    def recorder(self, cog: str) -> CogRecorder:
+        return CogRecorder(self, cog)
+
+    @staticmethod
+    def cog_name(cog) -> str:
+        """'BlackjackCog' -> 'blackjack', the name cogs record under"""
+        name = cog.qualified_name.lower()
+        return name[:-3] if name.endswith('cog') and len(name) > 3 else name
+
+    def record(self, cog: str, guild_id: Optional[int], message: str, *args):
+        event = (time.time(), cog, guild_id, message, args)
+        self.stats['events'] += 1
+        ring = self.cogs.get(cog)
+        if ring is None:
+            ring = self.cogs[cog] = deque(maxlen=self.size)
+        ring.append(event)
+        if guild_id is None:
+            return
+        ring = self.guilds.get(guild_id)
+        if ring is None:
+            ring = self.guilds[guild_id] = deque(maxlen=self.size)
+            # Drop the guild that has been quiet the longest
+            if len(self.guilds) > self.max_guilds:
+                self.guilds.popitem(last=False)
+        else:
+            self.guilds.move_to_end(guild_id)
+        ring.append(event)
+
+    def events(self, guild_id: Optional[int] = None, cog: Optional[str] = None) -> List[Event]:
+        """Events for a guild and/or cog, oldest first; everything if neither is given"""
+        if guild_id is not None:
+            events = list(self.guilds.get(guild_id, ()))
+            if cog is not None:
+                events = [event for event in events if event[1] == cog]
+            return events
+        if cog is not None:
+            return list(self.cogs.get(cog, ()))
+        return sorted((event for ring in self.cogs.values() for event in ring), key=lambda event: event[0])
+
+    @staticmethod
+    def format_event(event: Event) -> str:
+        at, cog, guild_id, message, args = event
+        try:
+            text = message % args if args else message
+        except Exception:
+            text = f"{message} {args!r}"
+        stamp = datetime.fromtimestamp(at).strftime('%H:%M:%S.%f')[:-3]
+        return f"{stamp} [{cog}] guild={guild_id} {text}"
+
+    def _write(self, path: Path, header: str, lines: List[str]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(header + "\n")
+            f.write("\n".join(lines))
+            f.write("\n")
+
+    async def dump(self, reason: str, guild_id: Optional[int] = None, cog: Optional[str] = None,
+                   force: bool = False) -> Optional[Path]:
+        """Write the matching events to dump_dir and return the file
+
+        Automatic dumps of the same guild and cog are limited to one per
+        min_dump_interval seconds so an error loop cannot flood the disk;
+        force skips the limit.
+        """
+        key = (guild_id, cog)
+        now = time.monotonic()
+        if not force and now - self._last_dump.get(key, -self.min_dump_interval) < self.min_dump_interval:
+            self.stats['dumps_skipped'] += 1
+            return None
+        self._last_dump[key] = now
+        events = self.events(guild_id, cog)
+        # Formatting happens here, not when the events were recorded
+        lines = [self.format_event(event) for event in events]
+        scope = '-'.join(str(part) for part in (guild_id, cog) if part is not None) or 'all'
+        path = self.dump_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{scope}.log"
+        header = f"# {reason}\n# guild={guild_id} cog={cog} events={len(events)}"
+        await asyncio.to_thread(self._write, path, header, lines)
+        self.stats['dumps'] += 1
+        logger.info(f"Flight recorder dumped {len(events)} events to {path} ({reason})")
+        return path
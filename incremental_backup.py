@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from backup_db import backup_database
+from changelog import KEEP_DAYS
+
+logger = logging.getLogger('bot.backup')
+
+INDEX_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS chunks (
+        hash BLOB PRIMARY KEY,
+        pack INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        created_at REAL NOT NULL,
+        parent_id INTEGER,
+        page_size INTEGER NOT NULL,
+        page_count INTEGER NOT NULL,
+        changed_pages INTEGER NOT NULL,
+        new_chunks INTEGER NOT NULL,
+        bytes_written INTEGER NOT NULL,
+        duration_ms REAL NOT NULL
+    )
+    ''',
+    # Only the pages that differ from the parent snapshot are listed
+    '''
+    CREATE TABLE IF NOT EXISTS snapshot_pages (
+        snapshot_id INTEGER NOT NULL,
+        page_no INTEGER NOT NULL,
+        hash BLOB NOT NULL,
+        PRIMARY KEY (snapshot_id, page_no)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Snapshot reads retry while the bot keeps the WAL busy, then fall back to
+# reading an online backup copy
+SNAPSHOT_ATTEMPTS = 5
+COMPRESSION_LEVEL = 6
+# Snapshots are kept as long as the change log that replays on top of
+# them, and never fewer than this many
+KEEP_SNAPSHOTS = 7
+
+
+def page_hash(page: bytes) -> bytes:
+    return hashlib.blake2b(page, digest_size=16).digest()
+
+
+class PageStore:
+    """Content-addressed store of database pages with one manifest per snapshot
+
+    Every distinct page is zlib-compressed and appended once to a pack
+    file; a snapshot records only the page numbers whose content changed
+    since the previous snapshot. Disk usage and the bytes written per
+    backup therefore grow with the amount of change, not with the size of
+    the database. prune() drops expired snapshots and the pages and pack
+    files only they used.
+    """
+
+    def __init__(self, backup_dir="data/backups/pages"):
+        self.backup_dir = Path(backup_dir)
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        self.index = sqlite3.connect(self.backup_dir / "index.db")
+        for statement in INDEX_SCHEMA:
+            self.index.execute(statement)
+        self.index.commit()
+
+    def close(self):
+        self.index.close()
+
+    def _pack_path(self, pack: int) -> Path:
+        return self.backup_dir / f"{pack:06d}.pack"
+
+    def snapshots(self) -> List[tuple]:
+        """(id, created_at, page_count, changed_pages, bytes_written) for every snapshot, oldest first"""
+        return self.index.execute(
+            'SELECT id, created_at, page_count, changed_pages, bytes_written FROM snapshots ORDER BY id'
+        ).fetchall()
+
+    def manifest(self, snapshot_id: int) -> Dict[int, bytes]:
+        """Page number -> content hash for a complete snapshot"""
+        row = self.index.execute('SELECT page_count FROM snapshots WHERE id = ?', (snapshot_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"No snapshot {snapshot_id}")
+        page_count = row[0]
+        pages: Dict[int, bytes] = {}
+        # Older snapshots first, so later changes overwrite earlier ones
+        for page_no, digest in self.index.execute(
+            'SELECT page_no, hash FROM snapshot_pages WHERE snapshot_id <= ? ORDER BY snapshot_id', (snapshot_id,)
+        ):
+            if page_no <= page_count:
+                pages[page_no] = digest
+        return pages
+
+    def prune(self, keep_days: float = KEEP_DAYS, keep_min: int = KEEP_SNAPSHOTS) -> dict:
+        """Delete snapshots older than keep_days, keeping at least keep_min
+
+        Manifests only list changed pages, so the oldest kept snapshot is
+        first rewritten to list all of its pages. Chunks no kept snapshot
+        uses are then dropped from the index, and pack files left with no
+        chunks are deleted.
+        """
+        cutoff = time.time() - keep_days * 86400
+        ids = [row[0] for row in self.index.execute('SELECT id, created_at FROM snapshots ORDER BY id')
+               if row[1] < cutoff]
+        total = self.index.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+        expired = ids[:max(0, min(len(ids), total - keep_min))]
+        summary = {'snapshots': len(expired), 'chunks': 0, 'packs': 0, 'bytes_freed': 0}
+        if not expired:
+            return summary
+
+        oldest_kept = self.index.execute('SELECT MIN(id) FROM snapshots WHERE id > ?', (expired[-1],)).fetchone()[0]
+        # With keep_min=0 every snapshot may have expired, leaving none to rewrite
+        pages = self.manifest(oldest_kept) if oldest_kept is not None else {}
+        with self.index:
+            self.index.execute('DELETE FROM snapshot_pages WHERE snapshot_id <= ?', (oldest_kept or expired[-1],))
+            if oldest_kept is not None:
+                self.index.executemany('INSERT INTO snapshot_pages (snapshot_id, page_no, hash) VALUES (?, ?, ?)',
+                                       [(oldest_kept, page_no, digest) for page_no, digest in pages.items()])
+                self.index.execute('UPDATE snapshots SET parent_id = NULL WHERE id = ?', (oldest_kept,))
+            self.index.execute('DELETE FROM snapshots WHERE id <= ?', (expired[-1],))
+            dead = self.index.execute(
+                'SELECT hash, length FROM chunks WHERE hash NOT IN (SELECT hash FROM snapshot_pages)'
+            ).fetchall()
+            self.index.executemany('DELETE FROM chunks WHERE hash = ?', [(digest,) for digest, _ in dead])
+        summary['chunks'] = len(dead)
+
+        # Only after the index no longer points into them. A snapshot taken
+        # meanwhile writes to a pack numbered above every committed snapshot,
+        # which is at least the newest expired one when none are left
+        newest = self.index.execute('SELECT MAX(id) FROM snapshots').fetchone()[0] or expired[-1]
+        live_packs = {row[0] for row in self.index.execute('SELECT DISTINCT pack FROM chunks')}
+        for path in self.backup_dir.glob('*.pack'):
+            if path.stem.isdigit() and int(path.stem) <= newest and int(path.stem) not in live_packs:
+                summary['bytes_freed'] += path.stat().st_size
+                path.unlink()
+                summary['packs'] += 1
+        self.index.execute('VACUUM')
+        logger.info(f"Pruned {summary['snapshots']} snapshots: {summary['chunks']} pages and "
+                    f"{summary['packs']} pack files ({summary['bytes_freed'] / 1024:.0f} KiB) removed")
+        return summary
+
+    def snapshot(self, db_path) -> dict:
+        """Record the current contents of db_path and return a summary"""
+        started = time.perf_counter()
+        db_path = Path(db_path)
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            summary = self._snapshot_live(db_path)
+            if summary is not None:
+                break
+            time.sleep(0.2 * (attempt + 1))
+        else:
+            # The bot never let the WAL stay empty long enough; read an
+            # online backup copy instead
+            logger.info("WAL stayed busy, snapshotting from an online backup copy")
+            with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp:
+                copy = backup_database(db_path, tmp, keep=0)
+                with open(copy['path'], 'rb') as f:
+                    summary = self._store_pages(f, copy['pages'])
+        summary['duration_ms'] = (time.perf_counter() - started) * 1000
+        self.index.execute('UPDATE snapshots SET duration_ms = ? WHERE id = ?', (summary['duration_ms'], summary['id']))
+        self.index.commit()
+        logger.info(f"Snapshot {summary['id']}: {summary['changed_pages']}/{summary['page_count']} pages changed, "
+                    f"{summary['new_chunks']} new ({summary['bytes_written'] / 1024:.0f} KiB written) "
+                    f"in {summary['duration_ms']:.0f} ms")
+        return summary
+
+    def _snapshot_live(self, db_path: Path) -> Optional[dict]:
+        """Read pages straight from the database file, or None if the WAL was not empty"""
+        wal_path = Path(f"{db_path}-wal")
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if busy:
+                return None
+            # While this read transaction is open on an empty WAL, SQLite
+            # cannot checkpoint anything into the database file, so the
+            # file holds exactly this snapshot until it ends
+            conn.execute('BEGIN')
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            if wal_path.exists() and wal_path.stat().st_size:
+                return None
+            with open(db_path, 'rb') as f:
+                return self._store_pages(f, page_count)
+        finally:
+            conn.close()
+
+    def _store_pages(self, f, page_count: int) -> dict:
+        header = f.read(100)
+        page_size = int.from_bytes(header[16:18], 'big')
+        if page_size == 1:
+            page_size = 65536
+        f.seek(0)
+
+        parent = self.index.execute('SELECT MAX(id) FROM snapshots').fetchone()[0]
+        previous = self.manifest(parent) if parent is not None else {}
+        pack = (parent or 0) + 1
+        changed = []
+        new_chunks = bytes_written = 0
+        with open(self._pack_path(pack), 'ab') as out:
+            for page_no in range(1, page_count + 1):
+                page = f.read(page_size)
+                if len(page) != page_size:
+                    raise RuntimeError(f"Database file ended at page {page_no} of {page_count}")
+                digest = page_hash(page)
+                if previous.get(page_no) == digest:
+                    continue
+                changed.append((page_no, digest))
+                if self.index.execute('SELECT 1 FROM chunks WHERE hash = ?', (digest,)).fetchone():
+                    continue
+                data = zlib.compress(page, COMPRESSION_LEVEL)
+                offset = out.tell()
+                out.write(data)
+                self.index.execute('INSERT INTO chunks (hash, pack, offset, length) VALUES (?, ?, ?, ?)',
+                                   (digest, pack, offset, len(data)))
+                new_chunks += 1
+                bytes_written += len(data)
+            out.flush()
+            os.fsync(out.fileno())
+        if not new_chunks:
+            self._pack_path(pack).unlink()
+
+        cursor = self.index.execute(
+            'INSERT INTO snapshots (created_at, parent_id, page_size, page_count, changed_pages, new_chunks, bytes_written, duration_ms) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+            (time.time(), parent, page_size, page_count, len(changed), new_chunks, bytes_written)
+        )
+        snapshot_id = cursor.lastrowid
+        self.index.executemany('INSERT INTO snapshot_pages (snapshot_id, page_no, hash) VALUES (?, ?, ?)',
+                               [(snapshot_id, page_no, digest) for page_no, digest in changed])
+        self.index.commit()
+        return {
+            'id': snapshot_id,
+            'page_size': page_size,
+            'page_count': page_count,
+            'changed_pages': len(changed),
+            'new_chunks': new_chunks,
+            'bytes_written': bytes_written,
+        }
+
+    def restore(self, snapshot_id: int, dest) -> dict:
+        """Rebuild a snapshot into a new database file and quick_check it"""
+        started = time.perf_counter()
+        dest = Path(dest)
+        if dest.exists():
+            raise FileExistsError(f"{dest} already exists")
+        page_size, page_count = self.index.execute(
+            'SELECT page_size, page_count FROM snapshots WHERE id = ?', (snapshot_id,)
+        ).fetchone()
+        pages = self.manifest(snapshot_id)
+        locations = {}
+        for digest in set(pages.values()):
+            location = self.index.execute(
+                'SELECT pack, offset, length FROM chunks WHERE hash = ?', (digest,)
+            ).fetchone()
+            if location is None:
+                page_no = next(page_no for page_no, page_digest in pages.items() if page_digest == digest)
+                raise RuntimeError(f"Snapshot {snapshot_id} is damaged: chunk {digest.hex()} for page {page_no} "
+                                   f"is missing from the index")
+            locations[digest] = location
+
+        partial = dest.with_name(dest.name + '.partial')
+        packs = {}
+        try:
+            with open(partial, 'wb') as out:
+                for page_no in range(1, page_count + 1):
+                    pack, offset, length = locations[pages[page_no]]
+                    if pack not in packs:
+                        packs[pack] = open(self._pack_path(pack), 'rb')
+                    packs[pack].seek(offset)
+                    page = zlib.decompress(packs[pack].read(length))
+                    if len(page) != page_size or page_hash(page) != pages[page_no]:
+                        raise RuntimeError(f"Page {page_no} is corrupt in pack {pack}")
+                    out.write(page)
+        finally:
+            for f in packs.values():
+                f.close()
+
+        conn = sqlite3.connect(partial)
+        try:
+            # The snapshot was taken from a WAL database; make the copy standalone
+            conn.execute('PRAGMA journal_mode = DELETE')
+            check = conn.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            conn.close()
+        if check != 'ok':
+            partial.unlink()
+            raise RuntimeError(f"Restored snapshot {snapshot_id} failed quick_check: {check}")
+        partial.rename(dest)
+        return {
+            'id': snapshot_id,
+            'path': str(dest),
+            'page_count': page_count,
+            'duration_ms': (time.perf_counter() - started) * 1000,
+        }
+
+
+def snapshot_database(db_path="data/channobot.db", backup_dir="data/backups/pages") -> Optional[dict]:
+    """Take one incremental snapshot; None if there is no database yet"""
+    if not Path(db_path).exists():
+        logger.warning("No database file found to backup!")
+        return None
+    store = PageStore(backup_dir)
+    try:
+        return store.snapshot(db_path)
+    finally:
+        store.close()
+
+
+async def snapshot_database_async(*args, **kwargs) -> Optional[dict]:
+    """Run snapshot_database() in a worker thread so the event loop keeps running"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: snapshot_database(*args, **kwargs))
+
+
+def prune_snapshots(backup_dir="data/backups/pages", keep_days: float = KEEP_DAYS,
+                    keep_min: int = KEEP_SNAPSHOTS) -> dict:
+    store = PageStore(backup_dir)
+    try:
+        return store.prune(keep_days, keep_min)
+    finally:
+        store.close()
+
+
+async def prune_snapshots_async(*args, **kwargs) -> dict:
+    """Run prune_snapshots() in a worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: prune_snapshots(*args, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental page-level database backups")
+    parser.add_argument('--dir', default="data/backups/pages", help="backup directory (default: data/backups/pages)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot_parser = commands.add_parser('snapshot', help="record the database's current state")
+    snapshot_parser.add_argument('--db', default="data/channobot.db")
+    commands.add_parser('list', help="list snapshots")
+    prune_parser = commands.add_parser('prune', help="delete expired snapshots and the pages only they used")
+    prune_parser.add_argument('--keep-days', type=float, default=KEEP_DAYS, help=f"default: {KEEP_DAYS}")
+    prune_parser.add_argument('--keep-min', type=int, default=KEEP_SNAPSHOTS, help=f"default: {KEEP_SNAPSHOTS}")
+    restore_parser = commands.add_parser('restore', help="rebuild a snapshot into a new file")
+    restore_parser.add_argument('snapshot_id', type=int)
+    restore_parser.add_argument('dest')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'snapshot':
+        if snapshot_database(args.db, args.dir) is None:
+            sys.exit(1)
+    elif args.command == 'prune':
+        prune_snapshots(args.dir, args.keep_days, args.keep_min)
+    elif args.command == 'list':
+        store = PageStore(args.dir)
+        for snapshot_id, created_at, page_count, changed_pages, bytes_written in store.snapshots():
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))
+            print(f"{snapshot_id:5d}  {created}  {page_count:8,} pages  {changed_pages:8,} changed  {bytes_written / 1024:10,.0f} KiB")
+        store.close()
+    else:
+        store = PageStore(args.dir)
+        result = store.restore(args.snapshot_id, args.dest)
+        store.close()
+        print(f"Restored snapshot {result['id']} to {result['path']} ({result['page_count']:,} pages, {result['duration_ms']:.0f} ms)")
@@ -0,0 +1,118 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+# Settled balances plus unsettled ledger credits for one guild; both halves
+# are served by their guild indexes, so only the guild's rows are read
+SELECT_GUILD_POINTS = '''
+    SELECT user_id, SUM(points) FROM (
+        SELECT user_id, points FROM users WHERE guild_id = :guild_id
+        UNION ALL
+        SELECT user_id, delta FROM ledger WHERE guild_id = :guild_id AND settled = 0
+    )
+    GROUP BY user_id
+'''
+
+
+class GuildRanking:
+    """Every member's balance in one guild, kept sorted by points
+
+    Keys are (-points, user_id) so the richest user sorts first and ties
+    break by user id. Rank lookups are a single bisect.
+    """
+
+    def __init__(self, rows=()):
+        self._points: Dict[int, int] = {}
+        self._keys: List[Tuple[int, int]] = []
+        for user_id, points in rows:
+            self._points[user_id] = points
+            self._keys.append((-points, user_id))
+        self._keys.sort()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id: int, points: int):
+        old = self._points.get(user_id)
+        if old == points:
+            return
+        if old is not None:
+            index = bisect.bisect_left(self._keys, (-old, user_id))
+            del self._keys[index]
+        self._points[user_id] = points
+        bisect.insort(self._keys, (-points, user_id))
+
+    def adjust(self, user_id: int, delta: int):
+        self.update(user_id, self._points.get(user_id, 0) + delta)
+
+    def points(self, user_id: int) -> Optional[int]:
+        return self._points.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based position of a user, or None if they have no balance row"""
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return bisect.bisect_left(self._keys, (-points, user_id)) + 1
+
+    def page(self, offset: int, limit: int) -> List[Tuple[int, int]]:
+        """(user_id, points) pairs starting at a 0-based offset"""
+        return [(user_id, -neg_points) for neg_points, user_id in self._keys[offset:offset + limit]]
+
+
+class Leaderboard:
+    """Per-guild rankings loaded on first use and then updated by the points store"""
+
+    def __init__(self, pool, ledger=None):
+        self.pool = pool
+        self.ledger = ledger
+        self._guilds: Dict[int, GuildRanking] = {}
+
+    async def ranking(self, guild_id: int) -> GuildRanking:
+        ranking = self._guilds.get(guild_id)
+        if ranking is None:
+            # Load under the writer so no balance can change between the
+            # snapshot and the ranking going live
+            async with self.pool.write() as db:
+                ranking = self._guilds.get(guild_id)
+                if ranking is None:
+                    if self.ledger is not None:
+                        await self.ledger.write_pending(db)
+                    async with db.execute(SELECT_GUILD_POINTS, {'guild_id': guild_id}) as cursor:
+                        ranking = GuildRanking(await cursor.fetchall())
+                    if self.ledger is not None:
+                        # Credits queued while the query ran are not in its result
+                        for user_id, delta in self.ledger.unwritten(guild_id).items():
+                            ranking.adjust(user_id, delta)
+                    self._guilds[guild_id] = ranking
+                    self.pool.after_rollback(lambda: self.invalidate_guild(guild_id))
+        return ranking
+
+    def record(self, user_id: int, guild_id: int, points: int):
+        """Apply a committed balance; guilds that were never loaded are ignored"""
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            ranking.update(user_id, points)
+
+    def adjust(self, user_id: int, guild_id: int, delta: int):
+        """Apply a committed delta"""
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            ranking.adjust(user_id, delta)
+
+    def invalidate_guild(self, guild_id: int):
+        """Drop a guild's ranking so it is reloaded on next use"""
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        self._guilds.clear()
+
+    async def rank(self, user_id: int, guild_id: int) -> Tuple[Optional[int], int]:
+        """(rank, number of ranked users) for a user in a guild"""
+        ranking = await self.ranking(guild_id)
+        return ranking.rank(user_id), len(ranking)
+
+    async def page(self, guild_id: int, page: int, per_page: int = 10) -> Tuple[List[Tuple[int, int]], int]:
+        """One page of the leaderboard (1-based) and the total number of pages"""
+        ranking = await self.ranking(guild_id)
+        pages = max(1, -(-len(ranking) // per_page))
+        return ranking.page((page - 1) * per_page, per_page), pages
@@ -1,105 +1,232 @@
-from riotwatcher import LolWatcher
-import os
-from typing import Optional, Tuple
+import asyncio
+import logging
+import random
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+from match_cache import MatchCache
+from riot_ratelimit import PRIORITY_USER, RiotScheduler
+
+logger = logging.getLogger('bot')
+
+# Match v5 is served per continent rather than per platform
+MATCH_REGIONS = {
+    "na1": "americas", "br1": "americas", "la1": "americas", "la2": "americas",
+    "euw1": "europe", "eun1": "europe", "tr1": "europe", "ru": "europe",
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RiotAPIError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"Riot API returned {status} for {url}")
+        self.status = status
+        self.url = url
+
 
 class LeagueAPI:
-    def __init__(self, api_key: str):
-        self.watcher = LolWatcher(api_key)
+    """Riot API client on a shared aiohttp session
+
+    Connections are pooled and kept alive between calls, every request has
+    a timeout, and 429s, 5xx responses and network errors are retried with
+    exponential backoff. Requests wait their turn in a RiotScheduler, which
+    keeps them under the key's rate limits and lets user-facing calls
+    (PRIORITY_USER) go ahead of background ones; a 429 blocks the limit it
+    was for until Retry-After. With a MatchCache, finished matches are
+    only fetched once. The session is created on first use; call close()
+    when done with the client.
+    """
+
+    def __init__(self, api_key: str, retries: int = 3, timeout: float = 10, backoff: float = 0.5,
+                 max_connections: int = 10, scheduler: Optional[RiotScheduler] = None,
+                 cache: Optional[MatchCache] = None):
+        self.api_key = api_key
+        self.scheduler = scheduler or RiotScheduler()
+        self.cache = cache
+        # Match fetches in flight, so concurrent lookups of one match share a request
+        self._match_fetches: Dict[str, asyncio.Task] = {}
         self.region = "na1"  # Default region
-        
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=5)
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+
     def set_region(self, region: str):
         """Set the region for API calls"""
         self.region = region.lower()
-        
-    def get_summoner_by_name(self, summoner_name: str):
+
+    @property
+    def match_region(self) -> str:
+        return MATCH_REGIONS.get(self.region, "asia")
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={'X-Riot-Token': self.api_key, 'Accept': 'application/json'},
+                raise_for_status=False,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        await self.scheduler.close()
+        if self.cache is not None:
+            await self.cache.close()
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter, so concurrent callers don't retry in step
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def _get(self, host: str, method: str, path: str, params: Optional[dict] = None,
+                   priority: int = PRIORITY_USER):
+        """GET a Riot endpoint; the decoded JSON, or None for 404
+
+        method names the endpoint for its rate limit, e.g. 'match-v5.by-id'
+        """
+        url = f"https://{host}.api.riotgames.com{path}"
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            await self.scheduler.acquire(host, method, priority)
+            try:
+                async with session.get(url, params=params) as response:
+                    self.scheduler.update(host, method, response.headers)
+                    if response.status == 404:
+                        return None
+                    if response.status == 200:
+                        return await response.json()
+                    if response.status == 429:
+                        # The scheduler holds the next acquire() until Retry-After,
+                        # for every caller, whether or not this one retries
+                        self.scheduler.rate_limited(host, method, response.headers)
+                    if response.status not in RETRY_STATUSES or last_attempt:
+                        raise RiotAPIError(response.status, url)
+                    if response.status == 429:
+                        continue
+                    delay = self._delay(attempt)
+                    logger.warning(f"Riot API {response.status} for {path}, retrying in {delay:.1f}s")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                delay = self._delay(attempt)
+                logger.warning(f"Riot API request to {path} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def get_summoner_by_name(self, summoner_name: str, priority: int = PRIORITY_USER):
         """Get summoner info by name"""
         try:
-            return self.watcher.summoner.by_name(self.region, summoner_name)
+            return await self._get(self.region, 'summoner-v4.by-name',
+                                   f"/lol/summoner/v4/summoners/by-name/{quote(summoner_name, safe='')}", priority=priority)
         except Exception as e:
-            print(f"Error getting summoner: {e}")
+            logger.error(f"Error getting summoner: {str(e)}")
             return None
-            
-    def get_match_history(self, puuid: str, count: int = 20) -> list:
+
+    async def get_match_history(self, puuid: str, count: int = 20, priority: int = PRIORITY_USER) -> list:
         """Get recent matches for a summoner"""
         try:
-            # Match v5 API uses different region format
-            region = "americas" if self.region in ["na1", "br1", "la1", "la2"] else "europe" if self.region in ["euw1", "eun1", "tr1", "ru"] else "asia"
-            return self.watcher.match.matchlist_by_puuid(region, puuid, count=count)
+            matches = await self._get(self.match_region, 'match-v5.ids-by-puuid',
+                                      f"/lol/match/v5/matches/by-puuid/{puuid}/ids", {'count': count}, priority)
+            return matches or []
         except Exception as e:
-            print(f"Error getting match history: {e}")
+            logger.error(f"Error getting match history: {str(e)}")
             return []
-            
-    def get_match_details(self, match_id: str) -> Optional[dict]:
-        """Get details for a specific match"""
+
+    async def _fetch_match(self, match_id: str, priority: int) -> Optional[dict]:
+        if self.cache is not None:
+            cached = await self.cache.get(match_id)
+            if cached is not None:
+                return cached
+        match = await self._get(self.match_region, 'match-v5.by-id', f"/lol/match/v5/matches/{match_id}", priority=priority)
+        if match is not None and self.cache is not None:
+            match = await self.cache.put(match_id, match)
+        return match
+
+    async def get_match_details(self, match_id: str, priority: int = PRIORITY_USER) -> Optional[dict]:
+        """Get details for a specific match
+
+        With a cache this is the match's summary (see match_cache.summarize),
+        which has the same shape but only the fields the bot reads
+        """
         try:
-            # Match v5 API uses different region format
-            region = "americas" if self.region in ["na1", "br1", "la1", "la2"] else "europe" if self.region in ["euw1", "eun1", "tr1", "ru"] else "asia"
-            return self.watcher.match.by_id(region, match_id)
+            fetch = self._match_fetches.get(match_id)
+            if fetch is None:
+                fetch = self._match_fetches[match_id] = asyncio.create_task(self._fetch_match(match_id, priority))
+                fetch.add_done_callback(lambda _: self._match_fetches.pop(match_id, None))
+            # One caller giving up must not cancel the fetch for the others
+            return await asyncio.shield(fetch)
         except Exception as e:
-            print(f"Error getting match details: {e}")
+            logger.error(f"Error getting match details: {str(e)}")
             return None
-            
-    def verify_match_result(self, match_id: str, summoner_name: str) -> Optional[bool]:
+
+    async def verify_match_result(self, match_id: str, summoner_name: str,
+                                  priority: int = PRIORITY_USER) -> Optional[bool]:
         """Verify if a summoner won a specific match
         Returns:
             bool: True if won, False if lost, None if error or match not found
         """
         try:
-            # Get match details
-            match_details = self.get_match_details(match_id)
-            if not match_details:
+            # Both lookups at once
+            match_details, summoner = await asyncio.gather(
+                self.get_match_details(match_id, priority), self.get_summoner_by_name(summoner_name, priority)
+            )
+            if not match_details or not summoner:
                 return None
-                
-            # Find the participant info for the summoner
-            summoner = self.get_summoner_by_name(summoner_name)
-            if not summoner:
-                return None
-                
+
             # Find participant in match
             for participant in match_details["info"]["participants"]:
                 if participant["summonerId"] == summoner["id"]:
                     return participant["win"]
-                    
+
             return None
         except Exception as e:
-            print(f"Error verifying match result: {e}")
+            logger.error(f"Error verifying match result: {str(e)}")
             return None
-            
-    def verify_recent_match_between_players(self, summoner1: str, summoner2: str, max_matches_to_check: int = 20) -> Tuple[Optional[str], Optional[bool]]:
+
+    async def verify_recent_match_between_players(self, summoner1: str, summoner2: str, max_matches_to_check: int = 20,
+                                                  priority: int = PRIORITY_USER) -> Tuple[Optional[str], Optional[bool]]:
         """Find and verify the most recent match between two players
         Returns:
             Tuple[str, bool]: (match_id, summoner1_won) or (None, None) if no match found
         """
         try:
-            # Get summoner info
-            summoner1_info = self.get_summoner_by_name(summoner1)
-            summoner2_info = self.get_summoner_by_name(summoner2)
+            summoner1_info, summoner2_info = await asyncio.gather(
+                self.get_summoner_by_name(summoner1, priority), self.get_summoner_by_name(summoner2, priority)
+            )
             if not summoner1_info or not summoner2_info:
                 return None, None
-                
-            # Get recent matches for summoner1
-            matches = self.get_match_history(summoner1_info["puuid"], count=max_matches_to_check)
-            
-            # Check each match for both players
-            for match_id in matches:
-                match_detail = self.get_match_details(match_id)
+
+            # Get recent matches for summoner1, then fetch their details concurrently
+            matches = await self.get_match_history(summoner1_info["puuid"], count=max_matches_to_check, priority=priority)
+            details = await asyncio.gather(*(self.get_match_details(match_id, priority) for match_id in matches))
+
+            # Newest first, as the match list is ordered
+            for match_id, match_detail in zip(matches, details):
                 if not match_detail:
                     continue
-                    
+
                 summoner1_result = None
                 summoner2_found = False
-                
+
                 # Look for both players in the match
                 for participant in match_detail["info"]["participants"]:
                     if participant["summonerId"] == summoner1_info["id"]:
                         summoner1_result = participant["win"]
                     elif participant["summonerId"] == summoner2_info["id"]:
                         summoner2_found = True
-                        
+
                     if summoner1_result is not None and summoner2_found:
                         return match_id, summoner1_result
-                        
+
             return None, None
         except Exception as e:
-            print(f"Error verifying match between players: {e}")
-            return None, None 
\ No newline at end of file
+            logger.error(f"Error verifying match between players: {str(e)}")
+            return None, None
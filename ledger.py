@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger('bot.db')
+
+# The ledger tables are created by migrations.py
+
+INSERT_ENTRY = '''
+    INSERT INTO ledger (user_id, guild_id, delta, reason, game, ref_id, created_at, settled)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Sum of credits not yet folded into users.points
+UNSETTLED_SUM = 'SELECT COALESCE(SUM(delta), 0) FROM ledger WHERE user_id = :user_id AND guild_id = :guild_id AND settled = 0'
+
+FOLD_UNSETTLED = '''
+    INSERT INTO users (user_id, guild_id, points)
+    SELECT user_id, guild_id, SUM(delta) FROM ledger
+    WHERE settled = 0 AND id <= ?
+    GROUP BY user_id, guild_id
+    ON CONFLICT (user_id, guild_id) DO UPDATE SET points = points + excluded.points
+'''
+
+Entry = Tuple[int, int, int, str, Optional[str], Optional[str], float, int]
+
+
+class Ledger:
+    """Append-only history of every point change
+
+    Credits are only appended: their deltas stay unsettled until compact()
+    folds them into users.points in one pass, so a busy balance is no
+    longer rewritten on every spin. Debits still update users directly
+    (the overdraw check needs it) and are appended already settled.
+
+    Credits are queued in memory and written in batches, either by the
+    flush loop or as part of the next write transaction that needs them.
+    Entries that belong to a larger transaction go through record() instead.
+    """
+
+    def __init__(self, pool, flush_interval: float = 5, compact_interval: float = 300,
+                 max_queue: int = 500, changelog=None):
+        self.pool = pool
+        # Optional ChangeLog that receives every committed entry with its id
+        self.changelog = changelog
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.max_queue = max_queue
+        self._queue: List[Entry] = []
+        self._in_flight = 0
+        # Ids of the in-flight entries, when a change log needs them
+        self._in_flight_ids: List[int] = []
+        self._queued_totals: Dict[Tuple[int, int], int] = {}
+        # Bumped whenever queued entries become visible in the database
+        self.generation = 0
+        self._task: Optional[asyncio.Task] = None
+        self._flush_scheduled = False
+        # Flushes started by append() when the queue fills; the loop only
+        # holds tasks weakly
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.stats = {
+            'appended': 0,
+            'written': 0,
+            'batches': 0,
+            'compactions': 0,
+            'compacted_entries': 0,
+            'last_compaction_ms': 0.0,
+            'last_checkpoint_id': None,
+        }
+
+    def __len__(self):
+        return len(self._queue)
+
+    def append(self, user_id: int, guild_id: int, delta: int, reason: str,
+               game: Optional[str] = None, ref_id=None, settled: bool = False):
+        """Queue an entry; unsettled deltas count towards the balance immediately"""
+        self._queue.append((user_id, guild_id, delta, reason, game,
+                            None if ref_id is None else str(ref_id), time.time(), int(settled)))
+        if not settled:
+            key = (user_id, guild_id)
+            self._queued_totals[key] = self._queued_totals.get(key, 0) + delta
+        self.stats['appended'] += 1
+        if len(self._queue) >= self.max_queue and not self._flush_scheduled:
+            self._flush_scheduled = True
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task):
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # The entries stay queued for the flush loop to retry
+            logger.error(f"Ledger flush failed: {str(task.exception())}", exc_info=task.exception())
+
+    async def record(self, db, user_id: int, guild_id: int, delta: int, reason: str,
+                     game: Optional[str] = None, ref_id=None, settled: bool = False):
+        """Write an entry as part of the caller's transaction, so it rolls back with it"""
+        entry = (user_id, guild_id, delta, reason, game,
+                 None if ref_id is None else str(ref_id), time.time(), int(settled))
+        cursor = await db.execute(INSERT_ENTRY, entry)
+        if self.changelog is not None:
+            entry_id = cursor.lastrowid
+            self.pool.after_commit(lambda: self.changelog.append([(entry_id,) + entry]))
+        self.stats['appended'] += 1
+        self.stats['written'] += 1
+
+    def queued(self, user_id: int, guild_id: int) -> int:
+        """Unsettled delta still waiting in memory for a user"""
+        return self._queued_totals.get((user_id, guild_id), 0)
+
+    def unwritten(self, guild_id: int) -> Dict[int, int]:
+        """Unsettled deltas per user in a guild that no transaction has written yet"""
+        totals: Dict[int, int] = {}
+        for user_id, entry_guild, delta, _, _, _, _, settled in self._queue[self._in_flight:]:
+            if entry_guild == guild_id and not settled:
+                totals[user_id] = totals.get(user_id, 0) + delta
+        return totals
+
+    async def write_pending(self, db):
+        """Write queued entries inside the caller's write transaction
+
+        They leave the queue only once that transaction commits; a rollback
+        leaves them queued for the next attempt.
+        """
+        batch = self._queue[self._in_flight:]
+        if not batch:
+            return
+        if self._in_flight == 0:
+            self.pool.after_commit(self._committed)
+            self.pool.after_rollback(self._rolled_back)
+        await db.executemany(INSERT_ENTRY, batch)
+        if self.changelog is not None:
+            # Single writer, so the batch got consecutive ids ending at the last rowid
+            async with db.execute('SELECT last_insert_rowid()') as cursor:
+                last_id = (await cursor.fetchone())[0]
+            self._in_flight_ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+        self._in_flight += len(batch)
+
+    def _committed(self):
+        written, self._queue = self._queue[:self._in_flight], self._queue[self._in_flight:]
+        self._in_flight = 0
+        if self.changelog is not None:
+            self.changelog.append([(entry_id,) + entry for entry_id, entry in zip(self._in_flight_ids, written)])
+            self._in_flight_ids = []
+        for user_id, guild_id, delta, _, _, _, _, settled in written:
+            if not settled:
+                key = (user_id, guild_id)
+                remaining = self._queued_totals[key] - delta
+                if remaining:
+                    self._queued_totals[key] = remaining
+                else:
+                    del self._queued_totals[key]
+        self.generation += 1
+        self.stats['written'] += len(written)
+        self.stats['batches'] += 1
+
+    def _rolled_back(self):
+        self._in_flight = 0
+        self._in_flight_ids = []
+
+    async def flush(self):
+        """Write every queued entry in one transaction"""
+        self._flush_scheduled = False
+        if not self._queue:
+            return
+        async with self.pool.write() as db:
+            await self.write_pending(db)
+
+    async def compact(self) -> int:
+        """Fold unsettled credits into users.points and record a checkpoint
+
+        Returns the number of ledger entries folded.
+        """
+        started = time.perf_counter()
+        async with self.pool.write() as db:
+            await self.write_pending(db)
+            async with db.execute('SELECT MAX(id) FROM ledger WHERE settled = 0') as cursor:
+                high_water = (await cursor.fetchone())[0]
+            if high_water is None:
+                return 0
+            await db.execute(FOLD_UNSETTLED, (high_water,))
+            cursor = await db.execute('UPDATE ledger SET settled = 1 WHERE settled = 0 AND id <= ?', (high_water,))
+            entries = cursor.rowcount
+            async with db.execute('SELECT COUNT(*), COALESCE(SUM(points), 0) FROM users') as cursor:
+                users, total_points = await cursor.fetchone()
+            cursor = await db.execute(
+                'INSERT INTO ledger_checkpoints (ledger_id, created_at, entries, users, total_points) VALUES (?, ?, ?, ?, ?)',
+                (high_water, time.time(), entries, users, total_points)
+            )
+            checkpoint_id = cursor.lastrowid
+        self.stats['compactions'] += 1
+        self.stats['compacted_entries'] += entries
+        self.stats['last_compaction_ms'] = (time.perf_counter() - started) * 1000
+        self.stats['last_checkpoint_id'] = checkpoint_id
+        logger.info(f"Compacted {entries} ledger entries into balances (checkpoint {checkpoint_id})")
+        return entries
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background loop and write whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+        if self.changelog is not None:
+            self.changelog.close()
+
+    async def _run(self):
+        last_compaction = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if time.monotonic() - last_compaction >= self.compact_interval:
+                    await self.compact()
+                    last_compaction = time.monotonic()
+                else:
+                    await self.flush()
+                if self.changelog is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self.changelog.sync)
+            except Exception as e:
+                logger.error(f"Ledger flush/compaction failed: {str(e)}")
@@ -0,0 +1,176 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# Attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# category: (fraction of records kept, records per second allowed through)
+# Warnings and errors are never sampled or rate limited
+DEFAULT_LIMITS = {
+    'message': (0.01, 5.0),
+    'voice': (1.0, 20.0),
+    'command': (1.0, 20.0),
+}
+QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields alongside the message"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'src': f"{record.filename}:{record.lineno}",
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Per-category sampling and token-bucket rate limits
+
+    Records are tagged with extra={'category': ...}; untagged records pass.
+    Dropped records are counted, and the next record of the category that
+    gets through carries the count as 'dropped'.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]]):
+        super().__init__()
+        self.limits = limits
+        self._tokens: Dict[str, float] = {}
+        self._refilled: Dict[str, float] = {}
+        self._dropped: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _allow(self, category: str) -> bool:
+        sample, rate = self.limits[category]
+        if sample < 1.0 and random.random() >= sample:
+            return False
+        if rate <= 0:
+            return True
+        now = time.monotonic()
+        tokens = self._tokens.get(category, rate)
+        tokens = min(rate, tokens + (now - self._refilled.get(category, now)) * rate)
+        self._refilled[category] = now
+        if tokens < 1:
+            self._tokens[category] = tokens
+            return False
+        self._tokens[category] = tokens - 1
+        return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, 'category', None)
+        if category is None or category not in self.limits or record.levelno >= logging.WARNING:
+            return True
+        stats = self.stats.setdefault(category, {'kept': 0, 'dropped': 0})
+        if not self._allow(category):
+            stats['dropped'] += 1
+            self._dropped[category] = self._dropped.get(category, 0) + 1
+            return False
+        stats['kept'] += 1
+        dropped = self._dropped.pop(category, 0)
+        if dropped:
+            record.dropped = dropped
+        return True
+
+
+def parse_limits(value: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """'message=0.01/5,voice=1/20' -> {'message': (0.01, 5.0), 'voice': (1.0, 20.0)}"""
+    limits = dict(DEFAULT_LIMITS)
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        category, spec = item.split('=', 1)
+        sample, _, rate = spec.partition('/')
+        limits[category.strip()] = (float(sample), float(rate) if rate else 0.0)
+    return limits
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.lost = 0
+        self._exceptions = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments into the message but keep the traceback separate"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self._exceptions.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # The disk cannot keep up; losing a line beats stalling the loop
+            self.lost += 1
+
+
+class LogPipeline:
+    """Logging that never touches the disk on the event loop
+
+    Loggers put records on a queue through a QueueHandler; a QueueListener
+    thread formats them as JSON and writes the rotating log file. Sampling
+    and rate limits run before a record is queued.
+    """
+
+    def __init__(self, path, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.sampling = SamplingFilter(limits if limits is not None else parse_limits(os.getenv('LOG_SAMPLING')))
+        self.queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+        self.file_handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backup_count)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.sampling)
+        self.listener = QueueListener(self.queue, self.file_handler, respect_handler_level=True)
+
+    def attach(self, logger: logging.Logger, level: int = logging.INFO):
+        logger.setLevel(level)
+        logger.addHandler(self.handler)
+
+    def start(self):
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Write out everything still queued"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.file_handler.close()
+
+    def stats(self) -> dict:
+        return {'queued': self.queue.qsize(), 'lost': self.handler.lost, 'categories': self.sampling.stats}
+
+
+def setup_logging(logger_name: str, path, **kwargs) -> LogPipeline:
+    """Send logger_name (and its children) through a background JSON log writer"""
+    pipeline = LogPipeline(path, **kwargs)
+    pipeline.attach(logging.getLogger(logger_name))
+    pipeline.start()
+    return pipeline
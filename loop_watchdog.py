@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from pathlib import Path
+from typing import Deque, Optional
+
+logger = logging.getLogger('bot')
+
+PROJECT_DIR = str(Path(__file__).parent.absolute())
+
+
+def sd_notify(state: str) -> bool:
+    """Send a state line to systemd's notify socket; False when not run by systemd"""
+    address = os.getenv('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Abstract namespace socket
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as e:
+        logger.error(f"systemd notify failed: {str(e)}")
+        return False
+
+
+def watchdog_interval() -> Optional[float]:
+    """Seconds between WATCHDOG=1 pings if systemd's watchdog is on for this process"""
+    usec = os.getenv('WATCHDOG_USEC')
+    pid = os.getenv('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    # Ping at twice the rate systemd requires
+    return int(usec) / 2 / 1_000_000
+
+
+def blocking_site(stack: traceback.StackSummary) -> str:
+    """The innermost frame in the bot's own code, which is usually the one to fix"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(PROJECT_DIR):
+            return f"{Path(frame.filename).name}:{frame.lineno} {frame.name}"
+    frame = stack[-1] if stack else None
+    return f"{Path(frame.filename).name}:{frame.lineno} {frame.name}" if frame else 'unknown'
+
+
+class Stall:
+    __slots__ = ('started_at', 'seconds', 'task', 'site', 'stack')
+
+    def __init__(self, started_at: float, task: str, site: str, stack: str):
+        self.started_at = started_at
+        self.seconds = 0.0
+        self.task = task
+        self.site = site
+        self.stack = stack
+
+
+class LoopWatchdog:
+    """Finds what blocks the event loop
+
+    A task on the loop records a heartbeat every interval and measures how
+    late it woke up, which is the loop lag. A separate thread checks the
+    heartbeat; once it is more than threshold seconds old, the loop is
+    stuck in synchronous code, and the thread captures the loop thread's
+    stack with sys._current_frames() while it is still blocked. When the
+    loop comes back the stall is timed, logged with its stack and counted
+    by the line that blocked.
+
+    Under systemd with WatchdogSec set, the heartbeat task also sends
+    WATCHDOG=1, so a loop that stays blocked gets the process restarted.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1,
+                 lag_histogram=None, stall_histogram=None, stall_counter=None, keep: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag_histogram = lag_histogram
+        self.stall_histogram = stall_histogram
+        self.stall_counter = stall_counter
+        self.stalls: Deque[Stall] = deque(maxlen=keep)
+        self.sites: Counter = Counter()
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._pending: Optional[Stall] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._watchdog_every = watchdog_interval()
+        self._last_ping = 0.0
+
+    def _snapshot(self, beat: float):
+        """Runs on the watchdog thread while the loop is blocked"""
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        task = asyncio.current_task(self._loop)
+        name = task.get_name() if task is not None else 'callback'
+        # Only publish if the loop is still in the same stall
+        if self._beat == beat:
+            self._pending = Stall(beat, name, blocking_site(stack), "".join(stack.format()))
+
+    def _watch(self):
+        # Poll often enough to catch stalls only just over the threshold
+        while not self._stopped.wait(min(self.interval, self.threshold / 4)):
+            beat = self._beat
+            # The heartbeat is due every interval; anything past that is lag
+            if time.monotonic() - beat <= self.interval + self.threshold:
+                continue
+            if self._pending is None or self._pending.started_at != beat:
+                self._snapshot(beat)
+
+    def _finish_stall(self, started: float, lag: float):
+        stall = self._pending
+        self._pending = None
+        if stall is None or stall.started_at != started:
+            # Over before the watchdog thread looked; no stack
+            stall = Stall(started, 'unknown', 'not captured', '')
+        stall.seconds = lag
+        self.stalls.append(stall)
+        self.sites[stall.site] += 1
+        if self.stall_histogram is not None:
+            self.stall_histogram.observe(lag)
+        if self.stall_counter is not None:
+            self.stall_counter.inc(stall.site)
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms in {stall.site} (task {stall.task})\n{stall.stack}",
+                       extra={'category': 'stall', 'stall_ms': round(lag * 1000), 'site': stall.site, 'task': stall.task})
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            if self._watchdog_every is not None and started - self._last_ping >= self._watchdog_every:
+                self._last_ping = started
+                sd_notify("WATCHDOG=1")
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(lag)
+            if lag > self.threshold:
+                self._finish_stall(started, lag)
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        if self._watchdog_every is not None:
+            sd_notify("READY=1")
+            logger.info(f"Pinging the systemd watchdog every {self._watchdog_every:.0f}s")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import aiosqlite
+
+logger = logging.getLogger('bot')
+
+# What the bot reads from a match; the rest of match-v5's ~100 KB is dropped
+INFO_FIELDS = ('gameCreation', 'gameEndTimestamp', 'gameDuration', 'gameMode', 'queueId')
+PARTICIPANT_FIELDS = ('puuid', 'summonerId', 'summonerName', 'riotIdGameName', 'riotIdTagline',
+                      'teamId', 'championName', 'win')
+
+
+def summarize(match: dict) -> dict:
+    """The parts of a match-v5 response the bot uses, in the same shape"""
+    info = match.get("info", {})
+    return {
+        "metadata": {"matchId": match.get("metadata", {}).get("matchId")},
+        "info": {
+            **{field: info.get(field) for field in INFO_FIELDS},
+            "participants": [
+                {field: participant.get(field) for field in PARTICIPANT_FIELDS}
+                for participant in info.get("participants", [])
+            ],
+        },
+    }
+
+
+class MatchCache:
+    """Finished matches, in memory and in a compressed SQLite table
+
+    A finished match never changes, so once fetched it never needs to be
+    fetched again. Summaries are kept in an LRU of memory_entries and
+    written zlib-compressed to match_cache.db, which holds at most
+    max_bytes of them; the least recently read go first when it is full.
+    A cache that fails to open or read is treated as empty rather than
+    failing the Riot call.
+    """
+
+    def __init__(self, path, memory_entries: int = 512, max_bytes: int = 50 * 1024 * 1024):
+        self.path = Path(path)
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def _connection(self) -> aiosqlite.Connection:
+        async with self._open_lock:
+            if self._conn is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = await aiosqlite.connect(self.path)
+                await conn.execute('PRAGMA journal_mode = WAL')
+                await conn.execute('PRAGMA synchronous = NORMAL')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS match_cache (
+                        match_id TEXT PRIMARY KEY,
+                        data BLOB NOT NULL,
+                        size INTEGER NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                ''')
+                await conn.execute('CREATE INDEX IF NOT EXISTS idx_match_cache_last_used ON match_cache(last_used)')
+                await conn.commit()
+                async with conn.execute('SELECT COALESCE(SUM(size), 0) FROM match_cache') as cursor:
+                    self.disk_bytes = (await cursor.fetchone())[0]
+                self._conn = conn
+                logger.info(f"Match cache opened at {self.path} ({self.disk_bytes / 1024:.0f} KB)")
+        return self._conn
+
+    def _remember(self, match_id: str, summary: dict):
+        self._memory[match_id] = summary
+        self._memory.move_to_end(match_id)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, match_id: str) -> Optional[dict]:
+        summary = self._memory.get(match_id)
+        if summary is not None:
+            self._memory.move_to_end(match_id)
+            self.memory_hits += 1
+            return summary
+        try:
+            conn = await self._connection()
+            async with conn.execute('SELECT data FROM match_cache WHERE match_id = ?', (match_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            summary = json.loads(zlib.decompress(row[0]))
+            await conn.execute('UPDATE match_cache SET last_used = ? WHERE match_id = ?', (time.time(), match_id))
+            await conn.commit()
+        except Exception as e:
+            logger.error(f"Match cache read failed for {match_id}: {str(e)}")
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(match_id, summary)
+        return summary
+
+    async def put(self, match_id: str, match: dict) -> dict:
+        """Cache a finished match; returns the summary that was stored"""
+        summary = summarize(match)
+        self._remember(match_id, summary)
+        data = zlib.compress(json.dumps(summary, separators=(',', ':')).encode(), 6)
+        try:
+            conn = await self._connection()
+            async with conn.execute('SELECT size FROM match_cache WHERE match_id = ?', (match_id,)) as cursor:
+                row = await cursor.fetchone()
+            await conn.execute(
+                'INSERT OR REPLACE INTO match_cache (match_id, data, size, last_used) VALUES (?, ?, ?, ?)',
+                (match_id, data, len(data), time.time())
+            )
+            self.disk_bytes += len(data) - (row[0] if row else 0)
+            if self.disk_bytes > self.max_bytes:
+                await self._evict(conn)
+            await conn.commit()
+        except Exception as e:
+            logger.error(f"Match cache write failed for {match_id}: {str(e)}")
+        return summary
+
+    async def _evict(self, conn: aiosqlite.Connection):
+        """Drop the least recently read matches until the table is at 90% of max_bytes"""
+        target = self.max_bytes * 0.9
+        doomed = []
+        async with conn.execute('SELECT match_id, size FROM match_cache ORDER BY last_used') as cursor:
+            async for match_id, size in cursor:
+                if self.disk_bytes <= target:
+                    break
+                doomed.append((match_id,))
+                self.disk_bytes -= size
+        await conn.executemany('DELETE FROM match_cache WHERE match_id = ?', doomed)
+        self.evictions += len(doomed)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            'memory_entries': len(self._memory),
+            'disk_bytes': self.disk_bytes,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,199 @@
+import bisect
+import logging
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger('bot')
+
+# Seconds; from a cached balance read up to a slow Riot API call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+Labels = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names: Tuple[str, ...], values: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.labels, labels)} {value}" for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A value read when the endpoint is scraped
+
+    collect() returns {label values: value}, so nothing is tracked between
+    scrapes.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]], labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Metrics gauge {self.name} failed: {str(e)}")
+            return []
+        return [f"{self.name}{_label_text(self.labels, labels)} {value}" for labels, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket], sum
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, labels, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, collect, labels: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, collect, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+# Snowflakes and tokens in REST paths, so each route is one label value
+ROUTE_IDS = re.compile(r'/(\d{15,21}|[A-Za-z0-9_\-]{60,})(?=/|$)')
+
+
+def rest_route(url) -> str:
+    path = url.path
+    if path.startswith('/api/v'):
+        path = path.split('/', 3)[-1]
+    return ROUTE_IDS.sub('/:id', '/' + path.lstrip('/'))
+
+
+def rest_trace(requests_total: Counter, rate_limited: Counter, latency: Histogram) -> aiohttp.TraceConfig:
+    """aiohttp trace hooks counting Discord REST calls, their status and 429s"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        route = rest_route(params.url)
+        status = params.response.status
+        requests_total.inc(params.method, route, str(status))
+        latency.observe(time.perf_counter() - context.started, params.method, route)
+        if status == 429:
+            scope = params.response.headers.get('X-RateLimit-Scope', 'unknown')
+            rate_limited.inc(route, scope)
+
+    async def on_request_exception(session, context, params):
+        requests_total.inc(params.method, rest_route(params.url), 'error')
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+class MetricsServer:
+    """Serves a registry at /metrics in the Prometheus text format"""
+
+    def __init__(self, registry: Registry, port: int, host: str = '127.0.0.1'):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'Cache-Control': 'no-store'})
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,56 +1,55 @@
-import sqlite3
-import os
+import argparse
+import asyncio
+import logging
 import sys
 from pathlib import Path
 
-def migrate_database():
-    # Ensure data directory exists
-    data_dir = Path("data")
-    data_dir.mkdir(exist_ok=True)
-
-    # Set database path
-    db_path = data_dir / "channobot.db"
-
-    # Remove existing database if it exists
-    if db_path.exists():
-        try:
-            os.remove(db_path)
-            print(f"Removed existing database at {db_path}")
-        except Exception as e:
-            print(f"Error removing existing database: {e}")
-            return False
-
-    print(f"Creating new database at {db_path}")
-    
+from db_pool import DatabasePool
+from migrations import DEFAULT_CHUNK_SIZE, MigrationRunner
+
+
+async def migrate_database(db_path, chunk_size, status_only):
+    pool = DatabasePool(db_path, readers=1)
+    await pool.start()
     try:
-        # Create new database with updated schema
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Create users table with guild_id support
-        cursor.execute('''
-            CREATE TABLE users (
-                user_id INTEGER,
-                guild_id INTEGER,
-                username TEXT,
-                points INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
-
-        conn.commit()
-        print("Database schema created successfully!")
+        runner = MigrationRunner(pool, chunk_size=chunk_size)
+        if status_only:
+            for version, name, applied_at, duration_ms in await runner.applied():
+                print(f"✓ {version}: {name} ({duration_ms:.1f} ms)")
+            for migration in await runner.pending():
+                print(f"  {migration.version}: {migration.name} (pending)")
+            return True
+
+        reports = await runner.run()
+        if not reports:
+            print(f"Database is up to date (version {await runner.current_version()})")
+            return True
+        for report in reports:
+            if report['skipped']:
+                detail = "already up to date"
+            else:
+                detail = f"{report['rows']} rows in {report['chunks']} chunks"
+            print(f"✓ {report['version']}: {report['migration']} / {report['step']}: {detail} ({report['duration_ms']:.1f} ms)")
+        print(f"Database migrated to version {await runner.current_version()}")
         return True
 
     except Exception as e:
-        print(f"Error creating database: {e}")
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        print(f"Error migrating database: {e}")
         return False
 
     finally:
-        conn.close()
+        await pool.close()
+
 
 if __name__ == "__main__":
-    success = migrate_database()
-    sys.exit(0 if success else 1) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations (safe while the bot is running)")
+    parser.add_argument('--db', default=Path(__file__).parent.absolute() / "data" / "channobot.db",
+                        help="database file (default: data/channobot.db)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows copied per transaction when a table is rebuilt")
+    parser.add_argument('--status', action='store_true', help="list applied and pending migrations without applying them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    success = asyncio.run(migrate_database(args.db, args.chunk_size, args.status))
+    sys.exit(0 if success else 1)
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger('bot.db')
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at REAL NOT NULL,
+        duration_ms REAL NOT NULL
+    )
+'''
+
+# Rows copied per write transaction when a table is rebuilt online
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class ExecuteSQL:
+    """Step that runs a few idempotent statements in one transaction"""
+
+    def __init__(self, name: str, statements: Sequence[str]):
+        self.name = name
+        self.statements = list(statements)
+
+    async def run(self, runner) -> Dict[str, int]:
+        async with runner.pool.write() as db:
+            for statement in self.statements:
+                await db.execute(statement)
+        return {'rows': 0, 'chunks': 1}
+
+
+class RebuildTable:
+    """Step that rebuilds a table into a new definition while the bot keeps writing to it
+
+    Rows are copied into a shadow table in rowid ranges of chunk_size, one
+    short write transaction per chunk, so other writers only ever wait for
+    a single chunk. Triggers on the old table mirror every change made
+    during the copy into the shadow table; the final swap (drop, rename,
+    recreate indexes) is one transaction.
+
+    columns are (name, expression, fallback) triples. The expression reads
+    the old row through {row}, and fallback is used when the old table has
+    no column of that name. The step is skipped when the old table already
+    has exactly the wanted columns and types.
+    """
+
+    def __init__(self, name: str, table: str, definition: str,
+                 columns: Sequence[Tuple[str, str, Optional[str]]], key: Sequence[str],
+                 types: Dict[str, str], indexes: Sequence[str] = ()):
+        self.name = name
+        self.table = table
+        self.shadow = f'{table}_rebuild'
+        self.definition = definition
+        self.columns = list(columns)
+        self.key = list(key)
+        self.types = types
+        self.indexes = list(indexes)
+
+    def _triggers(self) -> List[str]:
+        return [f'{self.shadow}_{event}' for event in ('insert', 'update', 'delete')]
+
+    def _values(self, existing, row: str) -> List[str]:
+        values = []
+        for name, expression, fallback in self.columns:
+            values.append(expression.format(row=row) if name in existing else fallback)
+        return values
+
+    def _key_match(self, existing, row: str) -> str:
+        values = dict(zip([name for name, _, _ in self.columns], self._values(existing, row)))
+        return ' AND '.join(f'{name} = {values[name]}' for name in self.key)
+
+    async def _existing_columns(self, db) -> Dict[str, str]:
+        async with db.execute(f'PRAGMA table_info({self.table})') as cursor:
+            return {row[1]: row[2].upper() for row in await cursor.fetchall()}
+
+    async def _drop_shadow(self, db):
+        for trigger in self._triggers():
+            await db.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        await db.execute(f'DROP TABLE IF EXISTS {self.shadow}')
+
+    async def run(self, runner) -> Dict[str, int]:
+        names = ', '.join(name for name, _, _ in self.columns)
+        async with runner.pool.write() as db:
+            existing = await self._existing_columns(db)
+            if existing == self.types:
+                for index in self.indexes:
+                    await db.execute(index)
+                return {'rows': 0, 'chunks': 0, 'skipped': 1}
+            # A shadow table left by an interrupted run is rebuilt from scratch
+            await self._drop_shadow(db)
+            await db.execute(self.definition.format(table=self.shadow))
+            insert, update, delete = self._triggers()
+            await db.execute(f'''
+                CREATE TRIGGER {insert} AFTER INSERT ON {self.table} BEGIN
+                    INSERT OR REPLACE INTO {self.shadow} ({names}) VALUES ({', '.join(self._values(existing, 'NEW.'))});
+                END
+            ''')
+            await db.execute(f'''
+                CREATE TRIGGER {update} AFTER UPDATE ON {self.table} BEGIN
+                    DELETE FROM {self.shadow} WHERE {self._key_match(existing, 'OLD.')};
+                    INSERT OR REPLACE INTO {self.shadow} ({names}) VALUES ({', '.join(self._values(existing, 'NEW.'))});
+                END
+            ''')
+            await db.execute(f'''
+                CREATE TRIGGER {delete} AFTER DELETE ON {self.table} BEGIN
+                    DELETE FROM {self.shadow} WHERE {self._key_match(existing, 'OLD.')};
+                END
+            ''')
+            async with db.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {self.table}') as cursor:
+                max_rowid = (await cursor.fetchone())[0]
+
+        # Rows a trigger already mirrored are newer than the old table's
+        # copy, hence INSERT OR IGNORE; rows added after max_rowid was read
+        # only ever arrive through the triggers
+        copy = (f'INSERT OR IGNORE INTO {self.shadow} ({names}) '
+                f'SELECT {", ".join(self._values(existing, ""))} FROM {self.table} '
+                f'WHERE rowid > ? AND rowid <= ?')
+        rows = chunks = 0
+        for low in range(0, max_rowid, runner.chunk_size):
+            async with runner.pool.write() as db:
+                cursor = await db.execute(copy, (low, low + runner.chunk_size))
+                rows += max(cursor.rowcount, 0)
+            chunks += 1
+            # Let queued writers in between chunks
+            await asyncio.sleep(runner.pause)
+
+        async with runner.pool.write() as db:
+            for trigger in self._triggers():
+                await db.execute(f'DROP TRIGGER {trigger}')
+            await db.execute(f'DROP TABLE {self.table}')
+            await db.execute(f'ALTER TABLE {self.shadow} RENAME TO {self.table}')
+            for index in self.indexes:
+                await db.execute(index)
+        return {'rows': rows, 'chunks': chunks}
+
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: Sequence):
+        self.version = version
+        self.name = name
+        self.steps = list(steps)
+
+
+USERS_DEFINITION = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        user_id INTEGER NOT NULL,
+        guild_id INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, guild_id)
+    )
+'''
+
+# Steps are never edited once released; later changes get a new version
+MIGRATIONS = [
+    Migration(1, 'create users', [
+        ExecuteSQL('users table', [USERS_DEFINITION.format(table='users')]),
+    ]),
+    Migration(2, 'integer user and guild ids', [
+        # Older databases were created with TEXT ids (betting.py), a username
+        # column, or without guild_id at all (reset_points.py); all of them
+        # are rebuilt into the one schema the bot uses
+        RebuildTable(
+            'rebuild users',
+            'users',
+            USERS_DEFINITION,
+            columns=[
+                ('user_id', 'CAST({row}user_id AS INTEGER)', None),
+                ('guild_id', 'CAST({row}guild_id AS INTEGER)', '0'),
+                ('points', 'COALESCE({row}points, 0)', '0'),
+            ],
+            key=['user_id', 'guild_id'],
+            types={'user_id': 'INTEGER', 'guild_id': 'INTEGER', 'points': 'INTEGER'},
+            indexes=[
+                # Lets leaderboards read one guild's rows already in points order
+                'CREATE INDEX IF NOT EXISTS idx_users_guild_points ON users (guild_id, points DESC)',
+            ],
+        ),
+    ]),
+    Migration(3, 'points ledger', [
+        ExecuteSQL('ledger tables', [
+            '''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                delta INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                game TEXT,
+                ref_id TEXT,
+                created_at REAL NOT NULL,
+                settled INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            # Only unsettled credits are ever summed (per user or per guild), so keep that index small
+            'CREATE INDEX IF NOT EXISTS idx_ledger_unsettled ON ledger (guild_id, user_id) WHERE settled = 0',
+            'CREATE INDEX IF NOT EXISTS idx_ledger_created ON ledger (created_at)',
+            '''
+            CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+                id INTEGER PRIMARY KEY,
+                ledger_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                entries INTEGER NOT NULL,
+                users INTEGER NOT NULL,
+                total_points INTEGER NOT NULL
+            )
+            ''',
+        ]),
+    ]),
+    Migration(4, 'voice sessions', [
+        ExecuteSQL('voice_sessions table', [
+            # One row per member in voice, rewritten by each checkpoint. Times
+            # are Unix timestamps; seconds is earned time not yet worth a point
+            '''
+            CREATE TABLE IF NOT EXISTS voice_sessions (
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                earning INTEGER NOT NULL,
+                active INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                awarded INTEGER NOT NULL,
+                last_activity REAL NOT NULL,
+                checkpoint_at REAL NOT NULL,
+                PRIMARY KEY (user_id, guild_id)
+            ) WITHOUT ROWID
+            ''',
+        ]),
+    ]),
+]
+
+
+class MigrationRunner:
+    """Applies pending migrations in version order and records them in schema_version
+
+    Each migration is recorded only after all of its steps finished, and
+    every step is written to be safe to run again, so an interrupted run
+    simply resumes at the first unrecorded version.
+    """
+
+    def __init__(self, pool, migrations: Sequence[Migration] = MIGRATIONS,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, pause: float = 0.01):
+        self.pool = pool
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+    async def applied(self) -> List[Tuple[int, str, float, float]]:
+        """(version, name, applied_at, duration_ms) for every recorded migration"""
+        async with self.pool.write() as db:
+            await db.execute(SCHEMA_VERSION_TABLE)
+            async with db.execute('SELECT version, name, applied_at, duration_ms FROM schema_version ORDER BY version') as cursor:
+                return await cursor.fetchall()
+
+    async def current_version(self) -> int:
+        applied = await self.applied()
+        return applied[-1][0] if applied else 0
+
+    async def pending(self) -> List[Migration]:
+        done = {row[0] for row in await self.applied()}
+        return [migration for migration in self.migrations if migration.version not in done]
+
+    async def run(self) -> List[dict]:
+        """Apply every pending migration and return one report per step"""
+        reports = []
+        for migration in await self.pending():
+            started = time.perf_counter()
+            logger.info(f"Applying migration {migration.version}: {migration.name}")
+            for step in migration.steps:
+                step_started = time.perf_counter()
+                result = await step.run(self)
+                report = {
+                    'version': migration.version,
+                    'migration': migration.name,
+                    'step': step.name,
+                    'rows': result.get('rows', 0),
+                    'chunks': result.get('chunks', 0),
+                    'skipped': bool(result.get('skipped')),
+                    'duration_ms': (time.perf_counter() - step_started) * 1000,
+                }
+                reports.append(report)
+                if report['skipped']:
+                    logger.info(f"  {step.name}: already up to date ({report['duration_ms']:.1f} ms)")
+                else:
+                    logger.info(f"  {step.name}: {report['rows']} rows in {report['chunks']} chunks ({report['duration_ms']:.1f} ms)")
+            duration_ms = (time.perf_counter() - started) * 1000
+            async with self.pool.write() as db:
+                await db.execute(
+                    'INSERT INTO schema_version (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)',
+                    (migration.version, migration.name, time.time(), duration_ms)
+                )
+            logger.info(f"Migration {migration.version} applied in {duration_ms:.1f} ms")
+        return reports
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from points_store import UPSERT_POINTS
+
+logger = logging.getLogger('bot.db')
+
+
+class PointsBuffer:
+    """Write-behind accumulator for point awards
+
+    Awards are summed in memory per (user_id, guild_id). flush() hands them
+    to the points store's ledger as one batch of entries written in a
+    single transaction.
+    """
+
+    def __init__(self, pool, store=None, reason: str = 'voice'):
+        self.pool = pool
+        self.store = store
+        self.reason = reason
+        self._pending: Dict[Tuple[int, int], int] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id: int, guild_id: int, points: int):
+        """Queue points for a user; nothing touches the database until flush()"""
+        key = (user_id, guild_id)
+        self._pending[key] = self._pending.get(key, 0) + points
+
+    def pending(self, user_id: int, guild_id: int) -> int:
+        """Points queued for a user but not yet written"""
+        return self._pending.get((user_id, guild_id), 0)
+
+    def drain(self) -> Dict[Tuple[int, int], int]:
+        """Remove and return everything queued, for another buffer to take over"""
+        batch, self._pending = self._pending, {}
+        return batch
+
+    async def flush(self) -> int:
+        """Write every queued award in one transaction and return the number of rows touched"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            rows = [(user_id, guild_id, points) for (user_id, guild_id), points in batch.items()]
+            if self.store is not None:
+                # Once in the ledger queue the awards count towards balances,
+                # and a failed write stays queued there for the next flush
+                self.store.credit_many(rows, reason=self.reason)
+                await self.store.ledger.flush()
+                return len(rows)
+            try:
+                async with self.pool.write() as db:
+                    await db.executemany(UPSERT_POINTS, rows)
+            except Exception:
+                # Put the batch back so the next flush retries it
+                for (user_id, guild_id), points in batch.items():
+                    self.add(user_id, guild_id, points)
+                raise
+            return len(rows)
@@ -0,0 +1,307 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from points_protocol import decode_reply, encode_request, split_frames
+from voice_points import VoiceSessionStore
+
+logger = logging.getLogger('bot.db')
+
+Key = Tuple[int, int]
+
+READ_SIZE = 256 * 1024
+# Request ids are u32 and 0 means "no reply"
+MAX_REQUEST_ID = 2 ** 32 - 1
+
+
+class RemoteLedger:
+    """The part of Ledger that PointsBuffer uses"""
+
+    def __init__(self, client: "PointsClient"):
+        self.client = client
+
+    async def flush(self):
+        """Return once the service has written every credit sent before this call"""
+        await self.client._call('flush')
+
+
+class RemoteLeaderboard:
+    def __init__(self, client: "PointsClient"):
+        self.client = client
+
+    async def page(self, guild_id: int, page: int, per_page: int = 10) -> Tuple[List[Tuple[int, int]], int]:
+        pages, results = await self.client._call('leaderboard_page', int(guild_id), page, per_page)
+        return results, pages
+
+    async def rank(self, user_id: int, guild_id: int) -> Tuple[Optional[int], int]:
+        found, position, total = await self.client._call('rank', int(user_id), int(guild_id))
+        return (position if found else None), total
+
+
+class PointsClient:
+    """PointsStore's interface, served by a PointsService in another process
+
+    Requests made in the same event loop iteration are sent together in one
+    write, and credit_many() does not wait for a reply at all. Replies are
+    matched to requests by id. The connection is opened lazily and
+    reopened after it drops; requests in flight when it drops fail with
+    ConnectionError.
+    """
+
+    def __init__(self, socket_path, timeout: float = 10.0):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self.ledger = RemoteLedger(self)
+        self.leaderboard = RemoteLeaderboard(self)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self._outgoing: List[Tuple[int, bytes]] = []
+        self._write_scheduled = False
+        self._write_tasks: Set[asyncio.Task] = set()
+        self._closed = False
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._timing_hooks: List[Callable[[str, float], None]] = []
+        self.stats = {'requests': 0, 'batches': 0, 'largest_batch': 0, 'bytes_sent': 0, 'reconnects': 0}
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def add_timing_hook(self, hook: Callable[[str, float], None]):
+        """Call hook(operation, seconds) with the round trip of every request"""
+        self._timing_hooks.append(hook)
+
+    def _record_timing(self, operation: str, seconds: float):
+        stats = self.timings.get(operation)
+        if stats is None:
+            stats = self.timings[operation] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        ms = seconds * 1000
+        stats['calls'] += 1
+        stats['total_ms'] += ms
+        if ms > stats['max_ms']:
+            stats['max_ms'] = ms
+        for hook in self._timing_hooks:
+            try:
+                hook(operation, seconds)
+            except Exception as e:
+                logger.error(f"Points timing hook failed: {str(e)}")
+
+    async def connect(self, attempts: int = 1, delay: float = 0.5):
+        """Open the connection, retrying while the service starts up"""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            for attempt in range(attempts):
+                try:
+                    self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if attempt == attempts - 1:
+                        raise
+                    await asyncio.sleep(delay)
+            if self._read_task is not None:
+                self.stats['reconnects'] += 1
+            self._read_task = asyncio.create_task(self._read_loop(self._reader))
+            logger.info(f"Connected to points service at {self.socket_path}")
+        self._schedule_write()
+
+    async def close(self):
+        self._closed = True
+        if self._write_tasks:
+            await asyncio.gather(*self._write_tasks, return_exceptions=True)
+        await self._write_now()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+
+    def _next_id(self) -> int:
+        request_id = next(self._ids)
+        if request_id > MAX_REQUEST_ID:
+            self._ids = itertools.count(2)
+            request_id = 1
+        return request_id
+
+    def _send(self, op: str, values, reply: bool = True) -> Optional[asyncio.Future]:
+        request_id = self._next_id() if reply else 0
+        future = None
+        if reply:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = (op, future)
+        self._outgoing.append((request_id, encode_request(request_id, op, values)))
+        self.stats['requests'] += 1
+        self._schedule_write()
+        return future
+
+    def _schedule_write(self):
+        if self._write_scheduled or not self._outgoing:
+            return
+        self._write_scheduled = True
+        # Everything sent during this loop iteration goes out in one write
+        asyncio.get_running_loop().call_soon(self._start_write)
+
+    def _start_write(self):
+        # The loop only holds tasks weakly
+        task = asyncio.create_task(self._write_now())
+        self._write_tasks.add(task)
+        task.add_done_callback(self._write_done)
+
+    def _write_done(self, task: asyncio.Task):
+        self._write_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Points service write failed: {str(task.exception())}", exc_info=task.exception())
+            self._lost(task.exception())
+
+    async def _write_now(self):
+        self._write_scheduled = False
+        if not self._outgoing:
+            return
+        if not self.connected:
+            if self._closed:
+                return
+            try:
+                await self.connect(attempts=3)
+            except OSError as e:
+                logger.error(f"Points service unavailable: {str(e)}")
+                # Callers waiting for a reply are told it failed, so those
+                # requests must never be sent; credits stay queued
+                self._outgoing = [frame for frame in self._outgoing if frame[0] == 0]
+                self._fail_pending(ConnectionError(f"Points service unavailable: {e}"))
+                return
+        batch, self._outgoing = self._outgoing, []
+        data = b''.join(frame for _, frame in batch)
+        self.stats['batches'] += 1
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+        self.stats['bytes_sent'] += len(data)
+        self._writer.write(data)
+        try:
+            await self._writer.drain()
+        except (ConnectionError, BrokenPipeError) as e:
+            self._lost(e)
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                for request_id, status, body in split_frames(buffer):
+                    op, future = self._pending.pop(request_id, (None, None))
+                    if future is None or future.done():
+                        continue
+                    try:
+                        future.set_result(decode_reply(op, status, body))
+                    except Exception as e:
+                        future.set_exception(e)
+        except Exception as e:
+            # Anything from a bad frame on must fail the waiting requests,
+            # not leave them to time out behind a dead read loop
+            self._lost(e)
+            return
+        self._lost(ConnectionError("Points service closed the connection"))
+
+    def _lost(self, error: Exception):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(error if isinstance(error, ConnectionError) else ConnectionError(str(error)))
+        if not self._closed:
+            logger.warning(f"Lost connection to points service: {str(error)}")
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        for _, future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _call(self, op: str, *values):
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._send(op, values), self.timeout)
+        finally:
+            self._record_timing(op, time.perf_counter() - started)
+
+    # The PointsStore interface
+
+    async def balance(self, user_id: int, guild_id: int) -> int:
+        (balances,) = await self._call('balances', [(int(user_id), int(guild_id))])
+        return balances[0]
+
+    async def balances(self, keys: Iterable[Tuple[int, int]]) -> Dict[Key, int]:
+        keys = [(int(user_id), int(guild_id)) for user_id, guild_id in keys]
+        (balances,) = await self._call('balances', keys)
+        return dict(zip(keys, balances))
+
+    async def try_debit(self, user_id: int, guild_id: int, amount: int, reason: str = 'debit',
+                        game: Optional[str] = None, ref_id=None) -> Optional[int]:
+        ok, balance = await self._call('try_debit', int(user_id), int(guild_id), amount, reason, game, ref_id)
+        return balance if ok else None
+
+    async def try_debit_all(self, debits: Iterable[Tuple[int, int, int]], reason: str = 'debit',
+                            game: Optional[str] = None, ref_id=None) -> Optional[Tuple[int, int, int]]:
+        debits = [(int(user_id), int(guild_id), amount) for user_id, guild_id, amount in debits]
+        ok, *short = await self._call('try_debit_all', reason, game, ref_id, debits)
+        return None if ok else tuple(short)
+
+    async def credit(self, user_id: int, guild_id: int, amount: int, reason: str = 'credit',
+                     game: Optional[str] = None, ref_id=None) -> int:
+        (balance,) = await self._call('credit', int(user_id), int(guild_id), amount, reason, game, ref_id)
+        return balance
+
+    def credit_many(self, credits: Iterable[Tuple[int, int, int]], reason: str = 'credit',
+                    game: Optional[str] = None):
+        """Send several credits without waiting; ledger.flush() confirms they were written"""
+        credits = [(int(user_id), int(guild_id), amount) for user_id, guild_id, amount in credits]
+        if credits:
+            self._send('credit_many', (reason, game, credits), reply=False)
+
+    async def transfer(self, from_user: int, to_user: int, guild_id: int, amount: int,
+                       reason: str = 'transfer', game: Optional[str] = None, ref_id=None) -> bool:
+        return await self.transfer_all([(from_user, to_user, guild_id, amount)], reason, game, ref_id) is None
+
+    async def transfer_all(self, transfers: Iterable[Tuple[int, int, int, int]], reason: str = 'transfer',
+                           game: Optional[str] = None, ref_id=None) -> Optional[Tuple[int, int, int]]:
+        transfers = [(int(from_user), int(to_user), int(guild_id), amount)
+                     for from_user, to_user, guild_id, amount in transfers]
+        ok, *short = await self._call('transfer_all', reason, game, ref_id, transfers)
+        return None if ok else tuple(short)
+
+    async def adjust_all_guilds(self, user_id: int, delta: int, reason: str = 'admin') -> int:
+        (count,) = await self._call('adjust_all_guilds', int(user_id), delta, reason)
+        return count
+
+    async def stats_fields(self) -> List[Tuple[str, str]]:
+        """The service's !dbstats fields"""
+        (fields,) = await self._call('stats')
+        return [tuple(field) for field in json.loads(fields)]
+
+
+class RemoteVoiceSessionStore(VoiceSessionStore):
+    """VoiceSessionStore whose table is written by the points service"""
+
+    def __init__(self, client: PointsClient):
+        super().__init__(None)
+        self.client = client
+
+    async def load(self) -> List[tuple]:
+        (rows,) = await self.client._call('load_voice_sessions')
+        return rows
+
+    async def write(self, rows: List[tuple], closed: List[Key]):
+        await self.client._call('checkpoint_voice_sessions', rows, closed)
@@ -0,0 +1,170 @@
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+# Every frame is: payload length (u32), request id (u32), op or status (u8),
+# then the fields. Request id 0 asks for no reply.
+HEADER = struct.Struct('!IIB')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Field codes: Q unsigned id, q signed amount, I count/position, d float,
+# ? flag, s optional UTF-8 string, [...] a repeated group with a u32 count
+SCALARS = {'Q': struct.Struct('!Q'), 'q': struct.Struct('!q'), 'I': struct.Struct('!I'),
+           'd': struct.Struct('!d'), '?': struct.Struct('!?')}
+STRING_LENGTH = struct.Struct('!H')
+NO_STRING = 0xFFFF
+
+# name: (op code, request fields, reply fields)
+OPS = {
+    'balances': (1, '[QQ]', '[q]'),
+    'credit': (2, 'QQqsss', 'q'),
+    'credit_many': (3, 'ss[QQq]', ''),
+    'try_debit': (4, 'QQqsss', '?q'),
+    'try_debit_all': (5, 'sss[QQq]', '?QQq'),
+    'transfer_all': (6, 'sss[QQQq]', '?QQq'),
+    'adjust_all_guilds': (7, 'Qqs', 'I'),
+    'flush': (8, '', ''),
+    'leaderboard_page': (9, 'QII', 'I[Qq]'),
+    'rank': (10, 'QQ', '?II'),
+    'stats': (11, '', 's'),
+    'load_voice_sessions': (12, '', '[QQ??dqdd]'),
+    'checkpoint_voice_sessions': (13, '[QQ??dqdd][QQ]', 'I'),
+}
+OP_NAMES = {code: name for name, (code, _, _) in OPS.items()}
+
+
+class ProtocolError(Exception):
+    """Raised for a frame that cannot be decoded"""
+
+
+class RemoteError(Exception):
+    """An operation failed inside the points service"""
+
+
+def _parse(fields: str) -> list:
+    """'QQ[Qq]s' -> ['Q', 'Q', ['Q', 'q'], 's']"""
+    parsed, stack = [], []
+    for code in re.findall(r'\[|\]|[QqId?s]', fields):
+        if code == '[':
+            stack.append(parsed)
+            parsed = []
+        elif code == ']':
+            group, parsed = parsed, stack.pop()
+            parsed.append(group)
+        else:
+            parsed.append(code)
+    return parsed
+
+
+_LAYOUTS: Dict[str, list] = {}
+
+
+def layout(fields: str) -> list:
+    if fields not in _LAYOUTS:
+        _LAYOUTS[fields] = _parse(fields)
+    return _LAYOUTS[fields]
+
+
+def _encode(layout_: list, values, out: List[bytes]):
+    if len(values) != len(layout_):
+        raise ProtocolError(f"Expected {len(layout_)} fields, got {len(values)}")
+    for code, value in zip(layout_, values):
+        if isinstance(code, list):
+            out.append(SCALARS['I'].pack(len(value)))
+            for item in value:
+                _encode(code, item if len(code) > 1 else (item,), out)
+        elif code == 's':
+            if value is None:
+                out.append(STRING_LENGTH.pack(NO_STRING))
+            else:
+                data = str(value).encode('utf-8')[:NO_STRING - 1]
+                out.append(STRING_LENGTH.pack(len(data)))
+                out.append(data)
+        else:
+            out.append(SCALARS[code].pack(value))
+
+
+def _decode(layout_: list, data: bytes, offset: int) -> Tuple[list, int]:
+    values = []
+    for code in layout_:
+        if isinstance(code, list):
+            (count,) = SCALARS['I'].unpack_from(data, offset)
+            offset += 4
+            items = []
+            for _ in range(count):
+                item, offset = _decode(code, data, offset)
+                items.append(tuple(item) if len(code) > 1 else item[0])
+            values.append(items)
+        elif code == 's':
+            (length,) = STRING_LENGTH.unpack_from(data, offset)
+            offset += 2
+            if length == NO_STRING:
+                values.append(None)
+            else:
+                values.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+        else:
+            scalar = SCALARS[code]
+            values.append(scalar.unpack_from(data, offset)[0])
+            offset += scalar.size
+    return values, offset
+
+
+def encode_frame(request_id: int, code: int, fields: str, values) -> bytes:
+    out = [b'']
+    _encode(layout(fields), values, out)
+    body = b''.join(out)
+    return HEADER.pack(HEADER.size - 4 + len(body), request_id, code) + body
+
+
+def encode_request(request_id: int, op: str, values) -> bytes:
+    code, fields, _ = OPS[op]
+    return encode_frame(request_id, code, fields, values)
+
+
+def encode_reply(request_id: int, op: str, values) -> bytes:
+    return encode_frame(request_id, STATUS_OK, OPS[op][2], values)
+
+
+def encode_error(request_id: int, message: str) -> bytes:
+    return encode_frame(request_id, STATUS_ERROR, 's', [message])
+
+
+def split_frames(buffer: bytearray) -> List[Tuple[int, int, bytes]]:
+    """Remove every complete frame from buffer as (request_id, code, body)"""
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        length, request_id, code = HEADER.unpack_from(buffer, offset)
+        end = offset + 4 + length
+        if length < HEADER.size - 4:
+            raise ProtocolError(f"Bad frame length {length}")
+        if end > len(buffer):
+            break
+        frames.append((request_id, code, bytes(buffer[offset + HEADER.size:end])))
+        offset = end
+    del buffer[:offset]
+    return frames
+
+
+def decode_request(code: int, body: bytes) -> Tuple[str, list]:
+    op = OP_NAMES.get(code)
+    if op is None:
+        raise ProtocolError(f"Unknown op {code}")
+    try:
+        values, _ = _decode(layout(OPS[op][1]), body, 0)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Malformed {op} request: {e}") from e
+    return op, values
+
+
+def decode_reply(op: str, status: int, body: bytes) -> Optional[list]:
+    if status == STATUS_ERROR:
+        raise RemoteError(_decode(layout('s'), body, 0)[0][0])
+    try:
+        values, _ = _decode(layout(OPS[op][2]), body, 0)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Malformed {op} reply: {e}") from e
+    return values
@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from changelog import ChangeLog
+from database_setup import open_database, stats_fields
+from db_pool import DatabasePool
+from incremental_backup import prune_snapshots_async, snapshot_database_async
+from ledger import Ledger
+from log_pipeline import setup_logging
+from points_protocol import (ProtocolError, decode_request, encode_error, encode_reply,
+                             split_frames)
+from points_store import PointsStore
+from storage_profile import StorageMaintenance
+from voice_points import VoiceSessionStore
+
+logger = logging.getLogger('bot.db')
+
+READ_SIZE = 256 * 1024
+
+
+class PointsService:
+    """The one process that writes the database when the bot runs as a cluster
+
+    Bot processes connect over a Unix socket and send points operations in
+    the binary format from points_protocol. Frames that arrive together are
+    handled as one batch: their replies go back in a single write, and runs
+    of fire-and-forget credits are merged into one ledger append. Frames
+    from one connection are handled in order, so a process always reads its
+    own writes.
+    """
+
+    def __init__(self, db_path, socket_path, changelog_dir=None, backup_dir=None):
+        self.db_path = Path(db_path)
+        self.socket_path = Path(socket_path)
+        self.backup_dir = Path(backup_dir) if backup_dir else self.db_path.parent / "backups" / "pages"
+        self.db = DatabasePool(self.db_path)
+        self.changelog = ChangeLog(changelog_dir or self.db_path.parent / "changelog")
+        self.points = PointsStore(self.db, ledger=Ledger(self.db, changelog=self.changelog))
+        self.voice_sessions = VoiceSessionStore(self.db)
+        self.maintenance = StorageMaintenance(self.db)
+        self.last_backup = None
+        self._server = None
+        self._tasks: List[asyncio.Task] = []
+        self._connections = set()
+        self.stats = {'connections': 0, 'requests': 0, 'batches': 0, 'merged_credits': 0, 'errors': 0}
+        self.handlers = {
+            'balances': self._balances,
+            'credit': self._credit,
+            'try_debit': self._try_debit,
+            'try_debit_all': self._try_debit_all,
+            'transfer_all': self._transfer_all,
+            'adjust_all_guilds': self._adjust_all_guilds,
+            'flush': self._flush,
+            'leaderboard_page': self._leaderboard_page,
+            'rank': self._rank,
+            'stats': self._stats,
+            'load_voice_sessions': self._load_voice_sessions,
+            'checkpoint_voice_sessions': self._checkpoint_voice_sessions,
+        }
+
+    async def start(self):
+        self.last_backup = await open_database(self.db, self.points, self.backup_dir)
+        self.points.ledger.start()
+        self.maintenance.start()
+        self._tasks = [asyncio.create_task(self._backup_loop()), asyncio.create_task(self._evict_loop())]
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._serve, path=str(self.socket_path))
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Points service listening on {self.socket_path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.maintenance.stop()
+        await self.points.ledger.stop()
+        await self.db.close()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        logger.info("Points service stopped")
+
+    async def _backup_loop(self):
+        while True:
+            await asyncio.sleep(24 * 60 * 60)
+            try:
+                self.last_backup = await snapshot_database_async(self.db_path, self.backup_dir)
+                logger.info("Daily database backup created")
+                await prune_snapshots_async(self.backup_dir)
+            except Exception as e:
+                logger.error(f"Error creating database backup: {str(e)}")
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            self.points.cache.evict_idle()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats['connections'] += 1
+        self._connections.add(writer)
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                replies = await self.handle_batch(split_frames(buffer))
+                if replies:
+                    writer.write(b''.join(replies))
+                    await writer.drain()
+        except ProtocolError as e:
+            logger.error(f"Closing points connection after a bad frame: {str(e)}")
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def handle_batch(self, frames) -> List[bytes]:
+        """Run a batch of frames in order and return the encoded replies"""
+        if not frames:
+            return []
+        self.stats['batches'] += 1
+        replies = []
+        credits: Dict[Tuple[Optional[str], Optional[str]], list] = {}
+
+        def apply_credits():
+            for (reason, game), rows in credits.items():
+                self.points.credit_many(rows, reason=reason or 'credit', game=game)
+            credits.clear()
+
+        for request_id, code, body in frames:
+            self.stats['requests'] += 1
+            try:
+                op, values = decode_request(code, body)
+            except ProtocolError as e:
+                # Frames are length-prefixed, so the rest of the batch is still readable
+                self.stats['errors'] += 1
+                logger.error(f"Points service got a bad frame (op {code}): {str(e)}")
+                if request_id:
+                    apply_credits()
+                    replies.append(encode_error(request_id, f"ProtocolError: {e}"))
+                continue
+            if op == 'credit_many':
+                # Appending to the ledger queue is synchronous, so a run of
+                # these can be merged without changing what later ops see
+                reason, game, rows = values
+                if credits:
+                    self.stats['merged_credits'] += 1
+                credits.setdefault((reason, game), []).extend(rows)
+                if request_id:
+                    apply_credits()
+                    replies.append(encode_reply(request_id, op, []))
+                continue
+            apply_credits()
+            try:
+                result = await self.handlers[op](*values)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Points service {op} failed: {str(e)}")
+                if request_id:
+                    replies.append(encode_error(request_id, f"{type(e).__name__}: {e}"))
+                continue
+            if request_id:
+                replies.append(encode_reply(request_id, op, result))
+        apply_credits()
+        return replies
+
+    async def _balances(self, keys):
+        balances = await self.points.balances(keys)
+        return [[balances[(user_id, guild_id)] for user_id, guild_id in keys]]
+
+    async def _credit(self, user_id, guild_id, amount, reason, game, ref_id):
+        return [await self.points.credit(user_id, guild_id, amount, reason or 'credit', game, ref_id)]
+
+    async def _try_debit(self, user_id, guild_id, amount, reason, game, ref_id):
+        balance = await self.points.try_debit(user_id, guild_id, amount, reason or 'debit', game, ref_id)
+        return [balance is not None, balance or 0]
+
+    async def _try_debit_all(self, reason, game, ref_id, debits):
+        short = await self.points.try_debit_all(debits, reason or 'debit', game, ref_id)
+        return [short is None] + list(short or (0, 0, 0))
+
+    async def _transfer_all(self, reason, game, ref_id, transfers):
+        short = await self.points.transfer_all(transfers, reason or 'transfer', game, ref_id)
+        return [short is None] + list(short or (0, 0, 0))
+
+    async def _adjust_all_guilds(self, user_id, delta, reason):
+        return [await self.points.adjust_all_guilds(user_id, delta, reason or 'admin')]
+
+    async def _flush(self):
+        await self.points.ledger.flush()
+        return []
+
+    async def _leaderboard_page(self, guild_id, page, per_page):
+        results, pages = await self.points.leaderboard.page(guild_id, page, per_page)
+        return [pages, results]
+
+    async def _rank(self, user_id, guild_id):
+        position, total = await self.points.leaderboard.rank(user_id, guild_id)
+        return [position is not None, position or 0, total]
+
+    async def _stats(self):
+        fields = stats_fields(self.db, self.maintenance, self.points, self.last_backup)
+        fields.append(("Points Service", (
+            f"Connections: {len(self._connections)} open, {self.stats['connections']} total\n"
+            f"Requests: {self.stats['requests']:,} in {self.stats['batches']:,} batches "
+            f"({self.stats['merged_credits']:,} credit batches merged, {self.stats['errors']} errors)"
+        )))
+        return [json.dumps(fields)]
+
+    async def _load_voice_sessions(self):
+        return [await self.voice_sessions.load()]
+
+    async def _checkpoint_voice_sessions(self, rows, closed):
+        await self.voice_sessions.write(rows, closed)
+        return [len(rows) + len(closed)]
+
+
+async def main(args):
+    service = PointsService(args.db, args.socket, args.changelog, args.backups)
+    await service.start()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+    await stopped.wait()
+    await service.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single-writer points service for a bot cluster")
+    parser.add_argument('--db', default="data/channobot.db")
+    parser.add_argument('--socket', default="data/points.sock")
+    parser.add_argument('--changelog', default=os.getenv('CHANGELOG_DIR'), help="change log directory (default: next to the database)")
+    parser.add_argument('--backups', help="snapshot directory (default: next to the database)")
+    args = parser.parse_args()
+
+    setup_logging('bot', Path(args.db).parent / "logs" / 'points-service.log')
+    asyncio.run(main(args))
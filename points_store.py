@@ -0,0 +1,381 @@
+import functools
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from balance_cache import BalanceCache
+from leaderboard import Leaderboard
+from ledger import UNSETTLED_SUM, Ledger
+
+logger = logging.getLogger('bot.db')
+
+# UPDATE/INSERT ... RETURNING needs SQLite 3.35; older builds fall back to a
+# follow-up SELECT inside the same transaction
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Every statement is a fixed string so each connection's statement cache
+# compiles it once; user and guild ids are always bound as integers so the
+# primary key and (guild_id, points) indexes are used
+
+SELECT_POINTS = 'SELECT points FROM users WHERE user_id = ? AND guild_id = ?'
+
+# Settled balance plus credits the ledger has not folded in yet
+SELECT_BALANCE = f'''
+    SELECT COALESCE((SELECT points FROM users WHERE user_id = :user_id AND guild_id = :guild_id), 0)
+        + ({UNSETTLED_SUM})
+'''
+
+# Adds to an existing balance or creates the row in a single statement
+UPSERT_POINTS = '''
+    INSERT INTO users (user_id, guild_id, points)
+    VALUES (?, ?, ?)
+    ON CONFLICT (user_id, guild_id) DO UPDATE SET points = points + excluded.points
+'''
+
+# Deducts only when the balance, including unsettled credits, covers the
+# amount; no row is touched otherwise
+DEBIT_POINTS = f'''
+    UPDATE users SET points = points - :amount
+    WHERE user_id = :user_id AND guild_id = :guild_id
+      AND points + ({UNSETTLED_SUM}) >= :amount
+'''
+DEBIT_POINTS_RETURNING = DEBIT_POINTS + f' RETURNING points + ({UNSETTLED_SUM})'
+
+# Creates a user row without touching an existing one
+CREATE_USER = '''
+    INSERT INTO users (user_id, guild_id, points)
+    VALUES (?, ?, ?)
+    ON CONFLICT (user_id, guild_id) DO NOTHING
+'''
+
+# Settled adjustment applied straight to users.points
+ADJUST_POINTS = 'UPDATE users SET points = points + ? WHERE user_id = ? AND guild_id = ?'
+
+SELECT_USER_GUILDS = 'SELECT guild_id FROM users WHERE user_id = ?'
+COUNT_USERS = 'SELECT COUNT(*) FROM users'
+
+Key = Tuple[int, int]
+
+
+def timed(operation: str):
+    """Report how long each call of an async store method takes"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                self._record_timing(operation, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class InsufficientPoints(Exception):
+    """Raised inside a batch debit so the whole transaction rolls back"""
+
+    def __init__(self, user_id: int, guild_id: int, amount: int):
+        super().__init__(f"User {user_id} cannot cover {amount} points in guild {guild_id}")
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.amount = amount
+
+
+class PointsStore:
+    """The one place balances are read and changed
+
+    Every change is recorded in the ledger. Credits are only appended there
+    and folded into users.points by the ledger's compactor, so a balance is
+    users.points plus the user's unsettled ledger entries. Each debit checks
+    and deducts in one conditional UPDATE on the writer connection against
+    that full balance, so concurrent commands can never overdraw it. Every
+    balance change is written through to the cache and the leaderboard, so
+    balance() and rank lookups are usually answered from memory.
+
+    Every operation has a batch variant, and each call is timed: see
+    timings and add_timing_hook().
+    """
+
+    def __init__(self, pool, cache: Optional[BalanceCache] = None,
+                 leaderboard: Optional[Leaderboard] = None, ledger: Optional[Ledger] = None):
+        self.pool = pool
+        # Both define __len__, so an empty one passed in would be falsy
+        self.ledger = ledger if ledger is not None else Ledger(pool)
+        self.cache = cache if cache is not None else BalanceCache()
+        self.leaderboard = leaderboard if leaderboard is not None else Leaderboard(pool, self.ledger)
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._timing_hooks: List[Callable[[str, float], None]] = []
+
+    def add_timing_hook(self, hook: Callable[[str, float], None]):
+        """Call hook(operation, seconds) after every store operation"""
+        self._timing_hooks.append(hook)
+
+    def _record_timing(self, operation: str, seconds: float):
+        stats = self.timings.get(operation)
+        if stats is None:
+            stats = self.timings[operation] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        ms = seconds * 1000
+        stats['calls'] += 1
+        stats['total_ms'] += ms
+        if ms > stats['max_ms']:
+            stats['max_ms'] = ms
+        for hook in self._timing_hooks:
+            try:
+                hook(operation, seconds)
+            except Exception as e:
+                logger.error(f"Points timing hook failed: {str(e)}")
+
+    @staticmethod
+    def _key(user_id, guild_id) -> Key:
+        # Ids kept as strings (bet dicts, message content) are normalised here
+        return int(user_id), int(guild_id)
+
+    async def _read_balances(self, keys: List[Key]) -> Dict[Key, int]:
+        while True:
+            # Retry if queued entries were committed while reading, or they
+            # would be counted twice
+            generation = self.ledger.generation
+            balances = {}
+            async with self.pool.read() as db:
+                for user_id, guild_id in keys:
+                    async with db.execute(SELECT_BALANCE, {'user_id': user_id, 'guild_id': guild_id}) as cursor:
+                        balances[(user_id, guild_id)] = (await cursor.fetchone())[0]
+            if generation == self.ledger.generation:
+                break
+        for key in balances:
+            balances[key] += self.ledger.queued(*key)
+        return balances
+
+    @timed('balance')
+    async def balance(self, user_id: int, guild_id: int) -> int:
+        """Current balance, 0 for users without a row"""
+        user_id, guild_id = self._key(user_id, guild_id)
+        cached = self.cache.get(user_id, guild_id)
+        if cached is not None:
+            return cached
+        epoch = self.cache.epoch
+        balance = (await self._read_balances([(user_id, guild_id)]))[(user_id, guild_id)]
+        self.cache.fill(user_id, guild_id, balance, epoch)
+        return balance
+
+    @timed('balances')
+    async def balances(self, keys: Iterable[Tuple[int, int]]) -> Dict[Key, int]:
+        """Balances for several (user_id, guild_id) pairs, read on one connection"""
+        result = {}
+        missing = []
+        for key in keys:
+            key = self._key(*key)
+            cached = self.cache.get(*key)
+            if cached is None:
+                missing.append(key)
+            else:
+                result[key] = cached
+        if missing:
+            epoch = self.cache.epoch
+            for key, balance in (await self._read_balances(missing)).items():
+                self.cache.fill(key[0], key[1], balance, epoch)
+                result[key] = balance
+        return result
+
+    def _publish_after_commit(self, user_id: int, guild_id: int, balance: int):
+        # balance includes everything written in this transaction; credits
+        # queued since then are added once they are known
+        def publish():
+            self._publish(user_id, guild_id, balance + self.ledger.queued(user_id, guild_id))
+        self.pool.after_commit(publish)
+
+    def _publish(self, user_id: int, guild_id: int, balance: int):
+        self.cache.set(user_id, guild_id, balance)
+        self.leaderboard.record(user_id, guild_id, balance)
+
+    def apply_deltas(self, rows: Iterable[Tuple[int, int, int]]):
+        """Mirror committed (user_id, guild_id, delta) changes in the cache and leaderboard"""
+        for user_id, guild_id, delta in rows:
+            self.cache.adjust(user_id, guild_id, delta)
+            self.leaderboard.adjust(user_id, guild_id, delta)
+
+    def invalidate(self, user_id: int, guild_id: int):
+        """Forget in-memory state for one balance"""
+        self.cache.invalidate(user_id, guild_id)
+        self.leaderboard.invalidate_guild(guild_id)
+
+    def invalidate_user(self, user_id: int):
+        """Forget a user's balances in every guild"""
+        self.cache.invalidate_user(user_id)
+        self.leaderboard.clear()
+
+    async def _run_debit(self, db, params: dict) -> Optional[int]:
+        if HAS_RETURNING:
+            async with db.execute(DEBIT_POINTS_RETURNING, params) as cursor:
+                row = await cursor.fetchone()
+            return None if row is None else row[0]
+        cursor = await db.execute(DEBIT_POINTS, params)
+        if cursor.rowcount == 0:
+            return None
+        async with db.execute(SELECT_BALANCE, params) as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def _debit(self, db, user_id: int, guild_id: int, amount: int, reason: str,
+                     game: Optional[str] = None, ref_id=None) -> Optional[int]:
+        # Queued credits must be in the table before the balance check sees it
+        await self.ledger.write_pending(db)
+        params = {'amount': amount, 'user_id': user_id, 'guild_id': guild_id}
+        balance = await self._run_debit(db, params)
+        if balance is None:
+            # Without a row the balance is just the unsettled credits; only
+            # create the row if they cover the debit, so a rejected debit
+            # writes nothing
+            async with db.execute(UNSETTLED_SUM, params) as cursor:
+                unsettled = (await cursor.fetchone())[0]
+            if unsettled < amount:
+                return None
+            cursor = await db.execute(CREATE_USER, (user_id, guild_id, 0))
+            if cursor.rowcount == 0:
+                return None
+            balance = await self._run_debit(db, params)
+            if balance is None:
+                return None
+        await self.ledger.record(db, user_id, guild_id, -amount, reason, game, ref_id, settled=True)
+        self._publish_after_commit(user_id, guild_id, balance)
+        return balance
+
+    @timed('try_debit')
+    async def try_debit(self, user_id: int, guild_id: int, amount: int, reason: str = 'debit',
+                        game: Optional[str] = None, ref_id=None) -> Optional[int]:
+        """Deduct amount if the user can cover it
+
+        Returns the new balance, or None when the balance was too low (in
+        which case nothing was deducted).
+        """
+        user_id, guild_id = self._key(user_id, guild_id)
+        if amount < 0:
+            raise ValueError("Debit amount must not be negative")
+        async with self.pool.write() as db:
+            balance = await self._debit(db, user_id, guild_id, amount, reason, game, ref_id)
+        if balance is None:
+            return None
+        return balance + self.ledger.queued(user_id, guild_id)
+
+    @timed('try_debit_all')
+    async def try_debit_all(self, debits: Iterable[Tuple[int, int, int]], reason: str = 'debit',
+                            game: Optional[str] = None, ref_id=None) -> Optional[Tuple[int, int, int]]:
+        """Deduct several (user_id, guild_id, amount) debits all-or-nothing
+
+        Returns None on success, or the first debit that could not be
+        covered, in which case no balance was changed.
+        """
+        debits = [self._key(user_id, guild_id) + (amount,) for user_id, guild_id, amount in debits]
+        if any(amount < 0 for _, _, amount in debits):
+            raise ValueError("Debit amount must not be negative")
+        try:
+            async with self.pool.write() as db:
+                for user_id, guild_id, amount in debits:
+                    if await self._debit(db, user_id, guild_id, amount, reason, game, ref_id) is None:
+                        raise InsufficientPoints(user_id, guild_id, amount)
+        except InsufficientPoints as e:
+            return (e.user_id, e.guild_id, e.amount)
+        return None
+
+    def _append_credit(self, user_id: int, guild_id: int, amount: int, reason: str,
+                       game: Optional[str] = None, ref_id=None):
+        self.ledger.append(user_id, guild_id, amount, reason, game, ref_id)
+        # Queued credits already count towards the balance, so mirror them now
+        self.cache.adjust(user_id, guild_id, amount)
+        self.leaderboard.adjust(user_id, guild_id, amount)
+
+    @timed('credit')
+    async def credit(self, user_id: int, guild_id: int, amount: int, reason: str = 'credit',
+                     game: Optional[str] = None, ref_id=None) -> int:
+        """Add amount to a balance and return the new balance
+
+        The credit is appended to the ledger and written with the next batch.
+        """
+        user_id, guild_id = self._key(user_id, guild_id)
+        if amount < 0:
+            raise ValueError("Credit amount must not be negative")
+        if amount:
+            self._append_credit(user_id, guild_id, amount, reason, game, ref_id)
+        return await self.balance(user_id, guild_id)
+
+    def credit_many(self, credits: Iterable[Tuple[int, int, int]], reason: str = 'credit',
+                    game: Optional[str] = None):
+        """Append several (user_id, guild_id, amount) credits without waiting for a balance"""
+        started = time.perf_counter()
+        credits = [self._key(user_id, guild_id) + (amount,) for user_id, guild_id, amount in credits]
+        if any(amount < 0 for _, _, amount in credits):
+            raise ValueError("Credit amount must not be negative")
+        for user_id, guild_id, amount in credits:
+            if amount:
+                self._append_credit(user_id, guild_id, amount, reason, game)
+        self._record_timing('credit_many', time.perf_counter() - started)
+
+    async def _transfer(self, db, from_user: int, to_user: int, guild_id: int, amount: int,
+                        reason: str, game: Optional[str], ref_id):
+        if await self._debit(db, from_user, guild_id, amount, reason, game, ref_id) is None:
+            raise InsufficientPoints(from_user, guild_id, amount)
+        # Written in the same transaction as the debit
+        await self.ledger.record(db, to_user, guild_id, amount, reason, game, ref_id)
+        self.pool.after_commit(lambda: self.apply_deltas([(to_user, guild_id, amount)]))
+
+    @timed('transfer')
+    async def transfer(self, from_user: int, to_user: int, guild_id: int, amount: int,
+                       reason: str = 'transfer', game: Optional[str] = None, ref_id=None) -> bool:
+        """Move amount between two users in one transaction; False if the sender is short"""
+        return await self.transfer_all([(from_user, to_user, guild_id, amount)], reason, game, ref_id) is None
+
+    @timed('transfer_all')
+    async def transfer_all(self, transfers: Iterable[Tuple[int, int, int, int]], reason: str = 'transfer',
+                           game: Optional[str] = None, ref_id=None) -> Optional[Tuple[int, int, int]]:
+        """Apply several (from_user, to_user, guild_id, amount) transfers all-or-nothing
+
+        Returns None on success, or (user_id, guild_id, amount) for the first
+        sender who was short, in which case nothing was moved.
+        """
+        transfers = [(int(from_user), int(to_user), int(guild_id), amount)
+                     for from_user, to_user, guild_id, amount in transfers]
+        if any(amount < 0 for *_, amount in transfers):
+            raise ValueError("Transfer amount must not be negative")
+        try:
+            async with self.pool.write() as db:
+                for from_user, to_user, guild_id, amount in transfers:
+                    await self._transfer(db, from_user, to_user, guild_id, amount, reason, game, ref_id)
+        except InsufficientPoints as e:
+            return (e.user_id, e.guild_id, e.amount)
+        return None
+
+    @timed('adjust_all_guilds')
+    async def adjust_all_guilds(self, user_id: int, delta: int, reason: str = 'admin') -> int:
+        """Add delta (possibly negative) to a user's balance in every guild they have one
+
+        Not bounded by the balance, so only for owner commands. Returns the
+        number of guilds changed.
+        """
+        user_id = int(user_id)
+        async with self.pool.write() as db:
+            async with db.execute(SELECT_USER_GUILDS, (user_id,)) as cursor:
+                guild_ids = [row[0] for row in await cursor.fetchall()]
+            await db.executemany(ADJUST_POINTS, [(delta, user_id, guild_id) for guild_id in guild_ids])
+            for guild_id in guild_ids:
+                await self.ledger.record(db, user_id, guild_id, delta, reason, settled=True)
+            self.pool.after_commit(lambda: self.apply_deltas([(user_id, guild_id, delta) for guild_id in guild_ids]))
+        return len(guild_ids)
+
+    @timed('create_users')
+    async def create_users(self, users: Iterable[Tuple[int, int, int]]) -> int:
+        """Create (user_id, guild_id, starting_points) rows that do not exist yet; returns how many were new"""
+        created = []
+        async with self.pool.write() as db:
+            for user_id, guild_id, points in users:
+                user_id, guild_id = self._key(user_id, guild_id)
+                cursor = await db.execute(CREATE_USER, (user_id, guild_id, points))
+                if cursor.rowcount:
+                    created.append((user_id, guild_id, points))
+                    if points:
+                        await self.ledger.record(db, user_id, guild_id, points, 'seed', settled=True)
+            self.pool.after_commit(lambda: self.apply_deltas(created))
+        return len(created)
+
+    async def user_count(self) -> int:
+        row = await self.pool.fetchone(COUNT_USERS)
+        return row[0]
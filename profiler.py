@@ -0,0 +1,135 @@
+import asyncio
+import cProfile
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger('bot')
+
+# The loop waiting for events; reported as idle rather than as a hotspot
+IDLE_FRAMES = {('selectors.py', 'select'), ('base_events.py', '_run_once')}
+
+
+def frame_name(code) -> str:
+    return f"{Path(code.co_filename).name}:{code.co_name}"
+
+
+class LiveProfiler:
+    """Profiles the running bot's event loop on demand
+
+    A sampling thread records the loop thread's stack every few
+    milliseconds; that is wall-clock time, including time spent blocked,
+    and is written as collapsed stacks for flamegraph.pl or speedscope.
+    With exact=True cProfile also runs on the loop thread for exact call
+    counts, written as a .pstats file; its per-call overhead slows the
+    loop, so the sampled hotspots are skewed towards call-heavy code.
+    """
+
+    def __init__(self, out_dir, sample_interval: float = 0.005):
+        self.out_dir = Path(out_dir)
+        self.sample_interval = sample_interval
+        self.started_at: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.leaves: Counter = Counter()
+        self.samples = 0
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: Optional[int] = None
+        self._timer: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            leaf = frame
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            names.reverse()
+            self.stacks[';'.join(names)] += 1
+            code = leaf.f_code
+            self.leaves[(Path(code.co_filename).name, leaf.f_lineno, code.co_name)] += 1
+            self.samples += 1
+
+    def start(self, seconds: Optional[float] = None, on_timeout=None, exact: bool = False):
+        """Start profiling; after seconds, stop and pass the result to on_timeout"""
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        self.stacks.clear()
+        self.leaves.clear()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        if exact:
+            # Called on the loop thread, so cProfile sees the loop's work
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if seconds:
+            self._timer = asyncio.create_task(self._stop_after(seconds, on_timeout))
+        logger.info(f"Profiler started ({seconds or 'until stopped'} s{', with cProfile' if exact else ''})")
+
+    async def _stop_after(self, seconds: float, on_timeout):
+        await asyncio.sleep(seconds)
+        self._timer = None
+        result = await self.stop()
+        if on_timeout is not None:
+            await on_timeout(result)
+
+    def hotspots(self, limit: int = 20) -> Tuple[List[Tuple[float, str]], float]:
+        """(share of busy samples, 'file:line function') for the top lines, and the idle share"""
+        idle = sum(count for (filename, _, function), count in self.leaves.items() if (filename, function) in IDLE_FRAMES)
+        busy = self.samples - idle
+        top = [
+            (count / busy if busy else 0.0, f"{filename}:{line} {function}")
+            for (filename, line, function), count in self.leaves.most_common()
+            if (filename, function) not in IDLE_FRAMES
+        ][:limit]
+        return top, (idle / self.samples if self.samples else 0.0)
+
+    def _write(self, stem: Path, stats: Optional[cProfile.Profile]) -> Tuple[Optional[Path], Path]:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        pstats_path = None
+        if stats is not None:
+            pstats_path = stem.with_suffix('.pstats')
+            stats.dump_stats(pstats_path)
+        collapsed_path = stem.with_suffix('.collapsed')
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return pstats_path, collapsed_path
+
+    async def stop(self) -> dict:
+        """Stop profiling, write the files and return a summary; 'pstats' is None without exact"""
+        if not self.running:
+            raise RuntimeError("Profiler is not running")
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._stopped.set()
+        self._thread.join(timeout=1)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        seconds = time.monotonic() - self.started_at
+        self.started_at = None
+        stem = self.out_dir / datetime.now().strftime('%Y%m%d-%H%M%S')
+        pstats_path, collapsed_path = await asyncio.to_thread(self._write, stem, self._cprofile)
+        self._cprofile = None
+        top, idle = self.hotspots()
+        logger.info(f"Profiler stopped after {seconds:.1f}s: {self.samples} samples written to {collapsed_path}")
+        return {'seconds': seconds, 'samples': self.samples, 'idle': idle, 'top': top,
+                'pstats': pstats_path, 'collapsed': collapsed_path}
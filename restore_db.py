@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from changelog import read_changes
+from db_pool import DatabasePool
+from incremental_backup import PageStore
+from migrations import MigrationRunner
+from points_store import ADJUST_POINTS, CREATE_USER
+
+INSERT_REPLAYED = '''
+    INSERT OR IGNORE INTO ledger (id, user_id, guild_id, delta, reason, game, ref_id, created_at, settled)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+REPLAY_BATCH = 1000
+
+
+def parse_time(value: str) -> float:
+    """Unix timestamp or local 'YYYY-MM-DD HH:MM[:SS]'"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def pick_snapshot(store: PageStore, target: float):
+    """Newest snapshot taken at or before target"""
+    chosen = None
+    for snapshot in store.snapshots():
+        if snapshot[1] <= target:
+            chosen = snapshot
+    return chosen
+
+
+async def integrity_check(pool) -> str:
+    rows = await pool.fetchall('PRAGMA integrity_check')
+    return '; '.join(row[0] for row in rows)
+
+
+async def replay(pool, changelog_dir, target: float) -> dict:
+    """Apply logged ledger entries newer than the restored snapshot, up to target"""
+    row = await pool.fetchone('SELECT COALESCE(MAX(id), 0) FROM ledger')
+    after_id = row[0]
+    replayed = settled = 0
+    batch = []
+
+    async def write(batch):
+        async with pool.write() as db:
+            await db.executemany(INSERT_REPLAYED, batch)
+            # Settled entries were applied to users.points when they were made;
+            # unsettled ones are summed by the points store and folded by compaction
+            applied = [(entry[3], entry[1], entry[2]) for entry in batch if entry[8]]
+            await db.executemany(CREATE_USER, [(user_id, guild_id, 0) for _, user_id, guild_id in applied])
+            await db.executemany(ADJUST_POINTS, applied)
+        return len(applied)
+
+    for entry in read_changes(changelog_dir, after_id, target):
+        batch.append(entry)
+        if len(batch) >= REPLAY_BATCH:
+            settled += await write(batch)
+            replayed += len(batch)
+            batch = []
+    if batch:
+        settled += await write(batch)
+        replayed += len(batch)
+    skipped = sum(1 for _ in read_changes(changelog_dir, after_id)) - replayed
+    return {'after_id': after_id, 'replayed': replayed, 'settled': settled, 'later': skipped}
+
+
+async def restore(target: float, out: Path, backup_dir, changelog_dir) -> bool:
+    timings = {}
+    started = time.perf_counter()
+    store = PageStore(backup_dir)
+    try:
+        snapshot = pick_snapshot(store, target)
+        if snapshot is None:
+            print(f"! No snapshot taken at or before {datetime.fromtimestamp(target)}")
+            return False
+        snapshot_id, created_at = snapshot[0], snapshot[1]
+        print(f"Using snapshot {snapshot_id} from {datetime.fromtimestamp(created_at):%Y-%m-%d %H:%M:%S}")
+        timings['select snapshot'] = time.perf_counter() - started
+
+        phase = time.perf_counter()
+        store.restore(snapshot_id, out)
+        timings['rebuild pages'] = time.perf_counter() - phase
+    finally:
+        store.close()
+
+    pool = DatabasePool(out, readers=1)
+    await pool.start()
+    try:
+        phase = time.perf_counter()
+        check = await integrity_check(pool)
+        timings['integrity check'] = time.perf_counter() - phase
+        if check != 'ok':
+            print(f"! Snapshot {snapshot_id} failed integrity_check: {check}")
+            return False
+        print("✓ Snapshot passed integrity_check")
+
+        phase = time.perf_counter()
+        # Snapshots taken before the ledger existed need its tables to replay into
+        await MigrationRunner(pool).run()
+        timings['migrate'] = time.perf_counter() - phase
+
+        phase = time.perf_counter()
+        result = await replay(pool, changelog_dir, target)
+        timings['replay changes'] = time.perf_counter() - phase
+        print(f"✓ Replayed {result['replayed']} ledger entries after id {result['after_id']} "
+              f"({result['settled']} applied to balances)")
+        if result['later']:
+            print(f"  {result['later']} logged entries are newer than the restore point and were not replayed")
+
+        phase = time.perf_counter()
+        check = await integrity_check(pool)
+        timings['final check'] = time.perf_counter() - phase
+        if check != 'ok':
+            print(f"! Restored database failed integrity_check: {check}")
+            return False
+    finally:
+        await pool.close()
+
+    total = time.perf_counter() - started
+    print(f"\nRestored to {out} as of {datetime.fromtimestamp(target):%Y-%m-%d %H:%M:%S}")
+    for name, seconds in timings.items():
+        print(f"  {name:<16} {seconds * 1000:9.1f} ms")
+    print(f"  {'total':<16} {total * 1000:9.1f} ms")
+    return True
+
+
+async def verify(backup_dir) -> bool:
+    """Rebuild every snapshot into a scratch file and run integrity_check on it"""
+    store = PageStore(backup_dir)
+    snapshots = store.snapshots()
+    ok = True
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for snapshot_id, created_at, *_ in snapshots:
+                path = Path(tmp) / f"{snapshot_id}.db"
+                phase = time.perf_counter()
+                try:
+                    store.restore(snapshot_id, path)
+                    pool = DatabasePool(path, readers=1)
+                    await pool.start()
+                    try:
+                        check = await integrity_check(pool)
+                    finally:
+                        await pool.close()
+                except Exception as e:
+                    check = str(e)
+                status = '✓' if check == 'ok' else '!'
+                ok = ok and check == 'ok'
+                print(f"{status} snapshot {snapshot_id} ({datetime.fromtimestamp(created_at):%Y-%m-%d %H:%M:%S}): "
+                      f"{check} ({(time.perf_counter() - phase) * 1000:.0f} ms)")
+                path.unlink(missing_ok=True)
+    finally:
+        store.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore the points database to a point in time, or verify backups")
+    parser.add_argument('--at', help="restore point: Unix time or 'YYYY-MM-DD HH:MM[:SS]' local time (default: now)")
+    parser.add_argument('--out', help="file to restore into (must not exist)")
+    parser.add_argument('--backups', default="data/backups/pages", help="snapshot directory (default: data/backups/pages)")
+    parser.add_argument('--changelog', default="data/changelog", help="change log directory (default: data/changelog)")
+    parser.add_argument('--verify', action='store_true', help="check that every snapshot restores and passes integrity_check")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.verify:
+        success = asyncio.run(verify(args.backups))
+    elif not args.out:
+        parser.error("--out is required unless --verify is given")
+    else:
+        out = Path(args.out)
+        if out.exists():
+            parser.error(f"{out} already exists")
+        target = parse_time(args.at) if args.at else time.time()
+        success = asyncio.run(restore(target, out, args.backups, args.changelog))
+    sys.exit(0 if success else 1)
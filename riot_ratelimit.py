@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('bot')
+
+# Lower runs first
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 10
+
+# Development key limits, used until the first response says otherwise
+DEFAULT_APP_LIMITS = "20:1,100:120"
+
+# Riot counts requests when they arrive, so leave room for network jitter
+WINDOW_MARGIN = 0.1
+
+
+def parse_limits(header: Optional[str]) -> List[Tuple[int, float]]:
+    """'20:1,100:120' -> [(20, 1.0), (100, 120.0)]; also used for the -Count headers"""
+    limits = []
+    for part in (header or '').split(','):
+        count, _, seconds = part.strip().partition(':')
+        if count and seconds:
+            limits.append((int(count), float(seconds)))
+    return limits
+
+
+class TokenBucket:
+    """limit tokens, each of which comes back window seconds after it is spent
+
+    Riot enforces fixed windows that start with the first request, so a
+    bucket that refills continuously could send more than limit requests
+    in one of them. Tracking when each token was spent cannot.
+    """
+    __slots__ = ('limit', 'window', 'spent')
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window + WINDOW_MARGIN
+        self.spent: Deque[float] = deque()
+
+    def _expire(self, now: float):
+        while self.spent and now - self.spent[0] >= self.window:
+            self.spent.popleft()
+
+    def delay(self, now: float) -> float:
+        self._expire(now)
+        if len(self.spent) < self.limit:
+            return 0.0
+        return self.spent[0] + self.window - now
+
+    def take(self, now: float):
+        self.spent.append(now)
+
+    def sync(self, count: int, now: float):
+        """Account for requests Riot has seen that this bucket has not, e.g. from another process"""
+        self._expire(now)
+        for _ in range(min(count, self.limit) - len(self.spent)):
+            self.spent.append(now)
+
+
+class RateLimit:
+    """All of one X-*-Rate-Limit header's buckets, plus any Retry-After block"""
+
+    def __init__(self, limits: str = ''):
+        self.limits = parse_limits(limits)
+        self.buckets = [TokenBucket(limit, window) for limit, window in self.limits]
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        return max([self.blocked_until - now] + [bucket.delay(now) for bucket in self.buckets])
+
+    def take(self, now: float):
+        for bucket in self.buckets:
+            bucket.take(now)
+
+    def update(self, limits: Optional[str], counts: Optional[str], now: float):
+        parsed = parse_limits(limits)
+        if parsed and parsed != self.limits:
+            # The key's limits changed (or were learned); start from Riot's counts
+            self.limits = parsed
+            self.buckets = [TokenBucket(limit, window) for limit, window in parsed]
+        windows = dict((window, count) for count, window in parse_limits(counts))
+        for bucket, (_, window) in zip(self.buckets, self.limits):
+            if window in windows:
+                bucket.sync(windows[window], now)
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class RegionQueue:
+    """Requests waiting for one routing value (na1, americas, ...), each with its own app limits"""
+
+    def __init__(self, region: str, app_limits: str):
+        self.region = region
+        self.app = RateLimit(app_limits)
+        self.methods: Dict[str, RateLimit] = {}
+        # (priority, order, method, future)
+        self.waiting: List[Tuple[int, int, str, asyncio.Future]] = []
+        self.blocked_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def method(self, method: str) -> RateLimit:
+        limit = self.methods.get(method)
+        if limit is None:
+            # No limits until Riot reports them; the app limits are always lower
+            limit = self.methods[method] = RateLimit()
+        return limit
+
+    def _next(self, now: float) -> Tuple[Optional[tuple], float]:
+        """The first request in priority order that may go now, else how long until one can"""
+        wait = max(self.app.delay(now), self.blocked_until - now)
+        if wait > 0:
+            return None, wait
+        wait = float('inf')
+        for entry in sorted(self.waiting):
+            delay = self.method(entry[2]).delay(now)
+            if delay <= 0:
+                return entry, 0.0
+            wait = min(wait, delay)
+        return None, wait
+
+    async def run(self):
+        while True:
+            if any(entry[3].done() for entry in self.waiting):
+                # Callers that gave up waiting
+                self.waiting = [entry for entry in self.waiting if not entry[3].done()]
+                heapq.heapify(self.waiting)
+            if not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            now = time.monotonic()
+            entry, wait = self._next(now)
+            if entry is not None:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.app.take(now)
+                self.method(entry[2]).take(now)
+                entry[3].set_result(now)
+                continue
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+class RiotScheduler:
+    """Spaces Riot API calls out to stay under the app and method rate limits
+
+    Riot limits every key per routing value (na1, americas, ...) with app
+    limits covering all calls and method limits for each endpoint, and
+    sends both, with the current counts, on every response. Each routing
+    value gets its own queue and a worker that hands out permits in
+    priority order as soon as all the relevant buckets have a token, so a
+    bet being verified goes ahead of background fetches. A 429 blocks the
+    limit it names until Retry-After has passed.
+    """
+
+    def __init__(self, app_limits: str = DEFAULT_APP_LIMITS):
+        self.app_limits = app_limits
+        self.regions: Dict[str, RegionQueue] = {}
+        self._order = itertools.count()
+        self.stats = {'requests': 0, 'waited_seconds': 0.0, 'rate_limited': Counter()}
+
+    def _region(self, region: str) -> RegionQueue:
+        queue = self.regions.get(region)
+        if queue is None:
+            queue = self.regions[region] = RegionQueue(region, self.app_limits)
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(queue.run(), name=f'riot-{region}')
+        return queue
+
+    async def acquire(self, region: str, method: str, priority: int = PRIORITY_USER):
+        """Wait until a request to method in region may be sent"""
+        queue = self._region(region)
+        future = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        heapq.heappush(queue.waiting, (priority, next(self._order), method, future))
+        queue.wakeup.set()
+        sent_at = await future
+        self.stats['requests'] += 1
+        self.stats['waited_seconds'] += sent_at - started
+
+    def update(self, region: str, method: str, headers):
+        """Learn limits and counts from a response's headers"""
+        queue = self.regions.get(region)
+        if queue is None:
+            return
+        now = time.monotonic()
+        queue.app.update(headers.get('X-App-Rate-Limit'), headers.get('X-App-Rate-Limit-Count'), now)
+        queue.method(method).update(headers.get('X-Method-Rate-Limit'), headers.get('X-Method-Rate-Limit-Count'), now)
+
+    def rate_limited(self, region: str, method: str, headers) -> float:
+        """Block whatever a 429 was for until Retry-After; returns the wait"""
+        try:
+            retry_after = float(headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1.0
+        kind = headers.get('X-Rate-Limit-Type', 'service')
+        self.stats['rate_limited'][kind] += 1
+        queue = self.regions.get(region)
+        if queue is None:
+            return retry_after
+        until = time.monotonic() + retry_after
+        if kind == 'application':
+            queue.app.block(until)
+        elif kind == 'method':
+            queue.method(method).block(until)
+        else:
+            # The service itself is overloaded; back off the whole region
+            queue.blocked_until = max(queue.blocked_until, until)
+        queue.wakeup.set()
+        logger.warning(f"Riot API {kind} rate limit hit for {region} {method}, waiting {retry_after:.0f}s")
+        return retry_after
+
+    def queued(self) -> Dict[str, int]:
+        return {region: sum(1 for entry in queue.waiting if not entry[3].done()) for region, queue in self.regions.items()}
+
+    async def close(self):
+        for queue in self.regions.values():
+            if queue.task is not None:
+                queue.task.cancel()
+                try:
+                    await queue.task
+                except asyncio.CancelledError:
+                    pass
+                queue.task = None
+            for entry in queue.waiting:
+                entry[3].cancel()
+            queue.waiting.clear()
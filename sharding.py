@@ -0,0 +1,64 @@
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+def shard_config() -> Tuple[bool, Optional[int], Optional[List[int]]]:
+    """(sharded, shard_count, shard_ids) from SHARD_COUNT and SHARD_IDS
+
+    SHARD_COUNT unset or 1 runs a single gateway connection; 'auto' lets
+    Discord pick the count. SHARD_IDS (comma separated) limits this process
+    to some of the shards.
+    """
+    count = os.getenv('SHARD_COUNT', '').strip().lower()
+    if not count or count == '1':
+        return False, None, None
+    shard_count = None if count == 'auto' else int(count)
+    ids = os.getenv('SHARD_IDS', '').strip()
+    shard_ids = [int(shard_id) for shard_id in ids.split(',') if shard_id.strip()] if ids else None
+    return True, shard_count, shard_ids
+
+
+def shard_for(guild_id: int, shard_count: Optional[int]) -> int:
+    """The shard Discord routes a guild's events to"""
+    return (guild_id >> 22) % shard_count if shard_count else 0
+
+
+class ShardStats:
+    """Per-shard event counts and connection history
+
+    Rates are counted in one-minute buckets, so recording an event is a
+    dictionary increment.
+    """
+
+    def __init__(self):
+        self.events: Dict[int, Counter] = {}
+        self.connects: Counter = Counter()
+        self.disconnects: Counter = Counter()
+        self.resumes: Counter = Counter()
+        self.ready_at: Dict[int, float] = {}
+        self._minute: Dict[int, int] = {}
+        self._current: Counter = Counter()
+        self._previous: Counter = Counter()
+
+    def _roll(self, shard_id: int, minute: int):
+        last = self._minute.get(shard_id)
+        if last != minute:
+            self._previous[shard_id] = self._current[shard_id] if last == minute - 1 else 0
+            self._current[shard_id] = 0
+            self._minute[shard_id] = minute
+
+    def record(self, shard_id: int, event: str):
+        self.events.setdefault(shard_id, Counter())[event] += 1
+        self._roll(shard_id, int(time.time() // 60))
+        self._current[shard_id] += 1
+
+    def per_minute(self, shard_id: int) -> int:
+        """Events handled in the last complete minute"""
+        self._roll(shard_id, int(time.time() // 60))
+        return self._previous[shard_id]
+
+    def ready(self, shard_id: int):
+        self.connects[shard_id] += 1
+        self.ready_at[shard_id] = time.time()
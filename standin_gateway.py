@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from points_buffer import PointsBuffer
+from points_client import PointsClient, RemoteVoiceSessionStore
+from voice_points import VoiceAccounting, VoiceShards
+
+Key = Tuple[int, int]
+
+# Voice time is sped up so a short run exercises settlements and inactivity
+POINTS_PER_MINUTE = 6000
+INACTIVE_AFTER = 2.0
+STARTING_POINTS = 1000
+
+
+def guild_ids(shard_id: int, shard_count: int, guilds: int) -> List[int]:
+    """Guild ids Discord would route to shard_id"""
+    return [((1000 + i) * shard_count + shard_id) << 22 | random.getrandbits(22) for i in range(guilds)]
+
+
+class ExpectedAwards(PointsBuffer):
+    """PointsBuffer that also keeps the total each member should have been credited"""
+
+    def __init__(self, store, expected: Dict[Key, int]):
+        super().__init__(None, store)
+        self.expected = expected
+
+    def add(self, user_id: int, guild_id: int, points: int):
+        super().add(user_id, guild_id, points)
+        self.expected[(user_id, guild_id)] = self.expected.get((user_id, guild_id), 0) + points
+
+
+class StandinShards:
+    """Plays the Discord side of a bot process for a group of shards
+
+    Each shard gets its own guilds and members; voice joins, leaves and
+    mutes drive the same VoiceShards the bot uses, and bets and transfers
+    go through the same PointsStore calls the games make. Every guild
+    belongs to exactly one shard, so this process is the only writer of its
+    members' balances and can check them against what it expects.
+    """
+
+    def __init__(self, client: PointsClient, shard_ids: List[int], shard_count: int,
+                 guilds: int = 4, members: int = 25):
+        self.client = client
+        self.expected: Dict[Key, int] = {}
+        self.voice = VoiceShards(
+            lambda shard_id: VoiceAccounting(ExpectedAwards(client, self.expected), POINTS_PER_MINUTE, INACTIVE_AFTER),
+            shard_ids, shard_count
+        )
+        self.sessions = RemoteVoiceSessionStore(client)
+        self.members: Dict[int, List[int]] = {}
+        for shard_id in shard_ids:
+            for guild_id in guild_ids(shard_id, shard_count, guilds):
+                self.members[guild_id] = [random.getrandbits(60) for _ in range(members)]
+        self.in_voice: Dict[Key, bool] = {}
+        self.stats = {'voice_events': 0, 'bets': 0, 'bets_refused': 0, 'transfers': 0,
+                      'transfers_refused': 0, 'settlements': 0, 'checkpoints': 0, 'errors': 0}
+
+    def _credit_expected(self, key: Key, amount: int):
+        self.expected[key] = self.expected.get(key, 0) + amount
+
+    async def fund(self):
+        """Give every member a starting balance"""
+        credits = [(user_id, guild_id, STARTING_POINTS) for guild_id, users in self.members.items() for user_id in users]
+        self.client.credit_many(credits, reason='seed')
+        await self.client.ledger.flush()
+        for user_id, guild_id, amount in credits:
+            self._credit_expected((user_id, guild_id), amount)
+
+    def voice_event(self):
+        guild_id = random.choice(list(self.members))
+        user_id = random.choice(self.members[guild_id])
+        key = (user_id, guild_id)
+        self.stats['voice_events'] += 1
+        if key in self.in_voice and random.random() < 0.3:
+            del self.in_voice[key]
+            self.voice.leave(user_id, guild_id)
+        else:
+            earning = random.random() < 0.8
+            self.in_voice[key] = earning
+            self.voice.update(user_id, guild_id, earning)
+
+    async def bet(self):
+        guild_id = random.choice(list(self.members))
+        first, second = random.sample(self.members[guild_id], 2)
+        amount = random.randint(1, 400)
+        short = await self.client.try_debit_all([(first, guild_id, amount), (second, guild_id, amount)],
+                                                reason='bet', game='standin')
+        if short is not None:
+            self.stats['bets_refused'] += 1
+            return
+        self._credit_expected((first, guild_id), -amount)
+        self._credit_expected((second, guild_id), -amount)
+        winner = random.choice((first, second))
+        await self.client.credit(winner, guild_id, amount * 2, reason='payout', game='standin')
+        self._credit_expected((winner, guild_id), amount * 2)
+        self.stats['bets'] += 1
+
+    async def transfer(self):
+        guild_id = random.choice(list(self.members))
+        sender, receiver = random.sample(self.members[guild_id], 2)
+        amount = random.randint(1, 300)
+        if await self.client.transfer(sender, receiver, guild_id, amount, game='standin'):
+            self._credit_expected((sender, guild_id), -amount)
+            self._credit_expected((receiver, guild_id), amount)
+            self.stats['transfers'] += 1
+        else:
+            self.stats['transfers_refused'] += 1
+
+    async def settle(self):
+        self.voice.settle()
+        await self.voice.flush()
+        await self.sessions.checkpoint(self.voice)
+        self.stats['settlements'] += 1
+        self.stats['checkpoints'] = self.sessions.stats['checkpoints']
+
+    async def run(self, seconds: float, rate: float):
+        await self.fund()
+        self.voice.restore(await self.sessions.load(), {})
+        self.voice.start()
+        deadline = time.monotonic() + seconds
+        next_settle = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            # A burst of events per tick, the way gateway dispatches arrive
+            games = []
+            for _ in range(max(1, int(rate / 20))):
+                roll = random.random()
+                if roll < 0.6:
+                    self.voice_event()
+                elif roll < 0.85:
+                    games.append(self.bet())
+                else:
+                    games.append(self.transfer())
+            for result in await asyncio.gather(*games, return_exceptions=True):
+                if isinstance(result, Exception):
+                    self.stats['errors'] += 1
+                    print(f"Stand-in operation failed: {result!r}", file=sys.stderr)
+            if time.monotonic() >= next_settle:
+                await self.settle()
+                next_settle += 1
+            await asyncio.sleep(0.05)
+        # Shut down the way the bot does: close every session, then flush
+        for user_id, guild_id in list(self.in_voice):
+            self.voice.leave(user_id, guild_id)
+        self.in_voice.clear()
+        await self.voice.stop()
+        await self.settle()
+
+    async def verify(self) -> List[dict]:
+        """Compare every member's balance in the database with what this process expects"""
+        balances = await self.client.balances(list(self.expected))
+        mismatches = [
+            {'user_id': key[0], 'guild_id': key[1], 'expected': expected, 'actual': balances[key]}
+            for key, expected in self.expected.items() if balances[key] != expected
+        ]
+        guilds = set(self.members)
+        left_open = [row for row in await self.sessions.load() if row[1] in guilds]
+        if left_open:
+            mismatches.append({'voice_sessions_left_open': len(left_open)})
+        return mismatches
+
+
+async def main(args):
+    shard_ids = [int(shard_id) for shard_id in args.shard_ids.split(',')]
+    client = PointsClient(args.socket)
+    await client.connect(attempts=60)
+    standin = StandinShards(client, shard_ids, args.shard_count, args.guilds, args.members)
+    started = time.perf_counter()
+    await standin.run(args.seconds, args.rate)
+    mismatches = await standin.verify()
+    await client.close()
+    print(json.dumps({
+        'shards': shard_ids,
+        'members': len(standin.expected),
+        'ok': not mismatches and not standin.stats['errors'],
+        'mismatches': mismatches[:10],
+        'seconds': round(time.perf_counter() - started, 2),
+        'voice_points': sum(shard.stats['points'] for shard in standin.voice.shards.values()),
+        **standin.stats,
+        'client': client.stats,
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated shard traffic for testing a cluster against the points service")
+    parser.add_argument('--socket', default="data/points.sock")
+    parser.add_argument('--shard-ids', default="0")
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=400, help="events per second")
+    parser.add_argument('--guilds', type=int, default=4, help="guilds per shard")
+    parser.add_argument('--members', type=int, default=25, help="members per guild")
+    asyncio.run(main(parser.parse_args()))
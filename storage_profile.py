@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger('bot.db')
+
+
+class StorageProfile:
+    """SQLite settings applied to every pooled connection
+
+    journal_mode and auto_vacuum are properties of the database file and
+    are set once through the writer; the rest are per-connection and are
+    applied each time a connection is opened.
+    """
+
+    def __init__(self, journal_mode: str = 'WAL', synchronous: str = 'NORMAL',
+                 mmap_size: int = 64 * 1024 * 1024, cache_size_kib: int = 8192,
+                 busy_timeout_ms: int = 5000, wal_autocheckpoint: int = 1000,
+                 auto_vacuum: str = 'INCREMENTAL', temp_store: str = 'MEMORY'):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.busy_timeout_ms = busy_timeout_ms
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.auto_vacuum = auto_vacuum
+        self.temp_store = temp_store
+
+    async def apply_database(self, db):
+        """Apply the file-level settings; returns the journal mode SQLite actually chose
+
+        Must run while db is the only open connection: converting an existing
+        file to incremental auto_vacuum needs a VACUUM outside WAL mode.
+        """
+        await db.execute(f'PRAGMA auto_vacuum = {self.auto_vacuum}')
+        async with db.execute('PRAGMA auto_vacuum') as cursor:
+            current = (await cursor.fetchone())[0]
+        if self.auto_vacuum.upper() == 'INCREMENTAL' and current != 2:
+            await self._convert_auto_vacuum(db)
+        async with db.execute(f'PRAGMA journal_mode = {self.journal_mode}') as cursor:
+            mode = (await cursor.fetchone())[0]
+        if mode.upper() != self.journal_mode.upper():
+            logger.warning(f"Requested journal_mode {self.journal_mode} but SQLite kept {mode}")
+        return mode
+
+    async def _convert_auto_vacuum(self, db):
+        """One-off VACUUM for files created before incremental auto_vacuum was enabled"""
+        started = time.perf_counter()
+        async with db.execute('PRAGMA journal_mode = DELETE') as cursor:
+            if (await cursor.fetchone())[0].upper() != 'DELETE':
+                logger.warning("Could not leave WAL mode; skipping auto_vacuum conversion")
+                return
+        await db.execute('VACUUM')
+        logger.info(f"Converted database to incremental auto_vacuum in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def apply_connection(self, db):
+        """Apply the per-connection settings"""
+        await db.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        await db.execute(f'PRAGMA synchronous = {self.synchronous}')
+        await db.execute(f'PRAGMA cache_size = {-int(self.cache_size_kib)}')
+        await db.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        await db.execute(f'PRAGMA temp_store = {self.temp_store}')
+        await db.execute(f'PRAGMA wal_autocheckpoint = {int(self.wal_autocheckpoint)}')
+
+
+class StorageMaintenance:
+    """Background WAL checkpoints, PRAGMA optimize and incremental vacuum
+
+    A passive checkpoint runs every interval. The heavier jobs (truncating
+    checkpoint, optimize, vacuum) wait until the writer has been idle for
+    quiet_seconds so they never compete with voice awards or games.
+    """
+
+    def __init__(self, pool, interval: float = 300, quiet_seconds: float = 30,
+                 optimize_every: float = 6 * 3600, vacuum_min_free_pages: int = 256,
+                 vacuum_pages_per_run: int = 512):
+        self.pool = pool
+        self.interval = interval
+        self.quiet_seconds = quiet_seconds
+        self.optimize_every = optimize_every
+        self.vacuum_min_free_pages = vacuum_min_free_pages
+        self.vacuum_pages_per_run = vacuum_pages_per_run
+        self._task: Optional[asyncio.Task] = None
+        self._last_optimize: Optional[float] = None
+        self.stats = {
+            'runs': 0,
+            'checkpoints': 0,
+            'truncating_checkpoints': 0,
+            'checkpoint_busy': 0,
+            'wal_frames_checkpointed': 0,
+            'last_wal_frames': 0,
+            'optimize_runs': 0,
+            'vacuum_runs': 0,
+            'pages_vacuumed': 0,
+            'skipped_busy': 0,
+            'errors': 0,
+            'last_run_ms': 0.0,
+            'last_run_at': None,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Storage maintenance failed: {str(e)}")
+
+    async def checkpoint(self):
+        """Fold the WAL back into the main file, e.g. before copying it"""
+        async with self.pool.write() as db:
+            await db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.stats['truncating_checkpoints'] += 1
+
+    def is_quiet(self) -> bool:
+        return self.pool.seconds_since_write() >= self.quiet_seconds
+
+    async def run_once(self, force: bool = False):
+        """Run one maintenance pass; force skips the quiet-time check"""
+        started = time.perf_counter()
+        quiet = force or self.is_quiet()
+        async with self.pool.write() as db:
+            async with db.execute('PRAGMA wal_checkpoint(PASSIVE)') as cursor:
+                busy, log_frames, checkpointed = await cursor.fetchone()
+            self.stats['checkpoints'] += 1
+            if busy:
+                self.stats['checkpoint_busy'] += 1
+            if checkpointed > 0:
+                self.stats['wal_frames_checkpointed'] += checkpointed
+            self.stats['last_wal_frames'] = max(log_frames, 0)
+
+            if quiet:
+                # Reset the WAL file so it stops growing on the SD card
+                await db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                self.stats['truncating_checkpoints'] += 1
+
+                if self._last_optimize is None or time.monotonic() - self._last_optimize >= self.optimize_every:
+                    await db.execute('PRAGMA analysis_limit = 400')
+                    await db.execute('PRAGMA optimize')
+                    self._last_optimize = time.monotonic()
+                    self.stats['optimize_runs'] += 1
+
+                async with db.execute('PRAGMA freelist_count') as cursor:
+                    free_pages = (await cursor.fetchone())[0]
+                if free_pages >= self.vacuum_min_free_pages:
+                    # The pragma frees one page per step and execute() only
+                    # steps it once; executescript() runs it to completion.
+                    # Only pragmas ran above, so there is no transaction for
+                    # it to commit early
+                    await db.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages_per_run)});')
+                    async with db.execute('PRAGMA freelist_count') as cursor:
+                        remaining = (await cursor.fetchone())[0]
+                    self.stats['vacuum_runs'] += 1
+                    self.stats['pages_vacuumed'] += free_pages - remaining
+            else:
+                self.stats['skipped_busy'] += 1
+
+        self.stats['runs'] += 1
+        self.stats['last_run_ms'] = (time.perf_counter() - started) * 1000
+        self.stats['last_run_at'] = time.time()
@@ -0,0 +1,456 @@
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from deadlines import DeadlineScheduler
+from sharding import shard_for
+
+logger = logging.getLogger('bot')
+
+Key = Tuple[int, int]
+
+SELECT_SESSIONS = '''
+    SELECT user_id, guild_id, earning, active, seconds, awarded, last_activity, checkpoint_at
+    FROM voice_sessions
+'''
+UPSERT_SESSION = '''
+    INSERT INTO voice_sessions (user_id, guild_id, earning, active, seconds, awarded, last_activity, checkpoint_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, guild_id) DO UPDATE SET
+        earning = excluded.earning, active = excluded.active, seconds = excluded.seconds,
+        awarded = excluded.awarded, last_activity = excluded.last_activity, checkpoint_at = excluded.checkpoint_at
+'''
+DELETE_SESSION = 'DELETE FROM voice_sessions WHERE user_id = ? AND guild_id = ?'
+
+
+class VoiceSession:
+    """Time a member has spent in a guild's voice channels since joining"""
+
+    __slots__ = ('earning', 'earning_since', 'last_activity', 'seconds', 'awarded')
+
+    def __init__(self, now: float, earning: bool):
+        # Whether the voice state allows earning (unmuted, not AFK)
+        self.earning = earning
+        # Start of the current earning interval, None while muted, AFK or inactive
+        self.earning_since: Optional[float] = now if earning else None
+        self.last_activity = now
+        # Earning seconds not yet turned into whole points
+        self.seconds = 0.0
+        self.awarded = 0
+
+
+class VoiceAccounting:
+    """Voice points driven by voice state changes instead of polling
+
+    A session is opened when a member joins a voice channel and closed
+    when they leave. Each session alternates between earning intervals
+    (unmuted, outside the AFK channel) and idle ones; a member also stops
+    earning once inactive_after seconds pass without any voice state
+    change, detected by a deadline scheduler that only wakes when someone
+    actually crosses the threshold. Earned time is credited when an
+    interval ends and by settle(),
+    which the bot calls once a minute, so the work done is proportional to
+    the number of voice state changes and open sessions rather than to
+    members times minutes. Whole points go to the awards buffer; leftover
+    seconds carry over to the next interval.
+
+    Sessions changed since the last checkpoint are tracked so
+    VoiceSessionStore can persist just those, and restore() resumes them
+    after a restart.
+    """
+
+    def __init__(self, awards, points_per_minute: int = 20, inactive_after: float = 15 * 60,
+                 clock: Callable[[], float] = time.monotonic):
+        self.awards = awards
+        self.points_per_minute = points_per_minute
+        self.inactive_after = inactive_after
+        self.clock = clock
+        self.sessions: Dict[Key, VoiceSession] = {}
+        self.deadlines = DeadlineScheduler(self._expire, clock)
+        self.restored = False
+        self._dirty = set()
+        self._closed = set()
+        self.stats = {'updates': 0, 'settlements': 0, 'points': 0, 'inactive': 0}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _accrue(self, key: Key, session: VoiceSession, now: float):
+        """Credit the time earned since the last boundary"""
+        if session.earning_since is None:
+            return
+        # Nothing is earned past the inactivity deadline, even if the scheduler fires late
+        end = min(now, session.last_activity + self.inactive_after)
+        if end > session.earning_since:
+            session.seconds += end - session.earning_since
+        session.earning_since = now
+        points = int(session.seconds * self.points_per_minute / 60)
+        if points:
+            session.seconds -= points * 60 / self.points_per_minute
+            session.awarded += points
+            self.stats['points'] += points
+            self.awards.add(key[0], key[1], points)
+        self._dirty.add(key)
+
+    def _activity(self, key: Key, session: VoiceSession, now: float):
+        """Mark the member active and push back their inactivity deadline"""
+        session.last_activity = now
+        self._dirty.add(key)
+        if session.earning and session.earning_since is None:
+            session.earning_since = now
+        self.deadlines.schedule(key, now + self.inactive_after)
+
+    def _expire(self, key: Key):
+        """Stop earning for a member who crossed the inactivity threshold"""
+        session = self.sessions.get(key)
+        if session is None:
+            return
+        self._accrue(key, session, self.clock())
+        if session.earning_since is not None:
+            session.earning_since = None
+            self.stats['inactive'] += 1
+            logger.info(f"User {key[0]} is now inactive in guild {key[1]}, no longer earning voice points")
+
+    def _open(self, key: Key, now: float, earning: bool):
+        self.sessions[key] = VoiceSession(now, earning)
+        self._dirty.add(key)
+        self._closed.discard(key)
+        self.deadlines.schedule(key, now + self.inactive_after)
+
+    def update(self, user_id: int, guild_id: int, earning: bool):
+        """Record a voice state change for a member who is (still) in a channel"""
+        key = (user_id, guild_id)
+        now = self.clock()
+        self.stats['updates'] += 1
+        session = self.sessions.get(key)
+        if session is None:
+            self._open(key, now, earning)
+            return
+        self._accrue(key, session, now)
+        session.earning = earning
+        if not earning:
+            session.earning_since = None
+        # Any voice state change counts as activity
+        self._activity(key, session, now)
+
+    def leave(self, user_id: int, guild_id: int) -> int:
+        """Close a member's session and return the points it earned"""
+        key = (user_id, guild_id)
+        session = self.sessions.pop(key, None)
+        if session is None:
+            return 0
+        self.stats['updates'] += 1
+        self.deadlines.cancel(key)
+        self._dirty.discard(key)
+        self._closed.add(key)
+        self._accrue(key, session, self.clock())
+        return session.awarded
+
+    def touch(self, user_id: int, guild_id: int):
+        """Count the member as active again without changing their voice state"""
+        session = self.sessions.get((user_id, guild_id))
+        if session is None:
+            return
+        now = self.clock()
+        self._accrue((user_id, guild_id), session, now)
+        self._activity((user_id, guild_id), session, now)
+
+    def is_collecting(self, user_id: int, guild_id: int) -> bool:
+        session = self.sessions.get((user_id, guild_id))
+        return session is not None and session.earning_since is not None
+
+    def reconcile(self, states: Dict[Key, bool]) -> Tuple[int, int]:
+        """Match sessions to the members currently in voice, mapped to whether they can earn
+
+        Used after (re)connecting, when voice state events may have been
+        missed. Returns (opened, closed).
+        """
+        closed = 0
+        for key in [key for key in self.sessions if key not in states]:
+            self.leave(*key)
+            closed += 1
+        opened = 0
+        now = self.clock()
+        for key, earning in states.items():
+            session = self.sessions.get(key)
+            if session is None:
+                self._open(key, now, earning)
+                opened += 1
+            elif session.earning != earning:
+                self._accrue(key, session, now)
+                session.earning = earning
+                self._dirty.add(key)
+                if not earning:
+                    session.earning_since = None
+                elif self.deadlines.deadline(key) is not None:
+                    session.earning_since = now
+        return opened, closed
+
+    def restore(self, rows: Iterable[tuple], states: Dict[Key, bool],
+                last_seen: Optional[float] = None) -> Tuple[int, int, int]:
+        """Resume persisted sessions in one pass over the members currently in voice
+
+        rows come from VoiceSessionStore.load(). Members still in voice get
+        their session back with its leftover seconds; time spent idle
+        before the checkpoint still counts towards the inactivity
+        threshold, but downtime does not. Sessions for members no longer
+        in voice are closed and everyone else in voice gets a new session.
+        Returns (resumed, opened, closed).
+        """
+        now = self.clock()
+        rows = list(rows)
+        # Unchanged sessions keep older checkpoint times; the newest one is
+        # when the bot was last known to be running
+        if last_seen is None:
+            last_seen = max((row[7] for row in rows), default=0.0)
+        resumed = closed = 0
+        for user_id, guild_id, _, _, seconds, awarded, last_activity, _ in rows:
+            key = (user_id, guild_id)
+            if key in self.sessions:
+                continue
+            if key not in states:
+                self._closed.add(key)
+                closed += 1
+                continue
+            earning = states[key]
+            idle = max(0.0, last_seen - last_activity)
+            session = VoiceSession(now, earning)
+            session.last_activity = now - idle
+            session.seconds = seconds
+            session.awarded = awarded
+            self.sessions[key] = session
+            self._dirty.add(key)
+            if idle < self.inactive_after:
+                self.deadlines.schedule(key, session.last_activity + self.inactive_after)
+            else:
+                session.earning_since = None
+            resumed += 1
+        opened = 0
+        for key, earning in states.items():
+            if key not in self.sessions:
+                self._open(key, now, earning)
+                opened += 1
+        self.restored = True
+        return resumed, opened, closed
+
+    def hand_over(self, owner: Callable[[int], "VoiceAccounting"]):
+        """Move every session, pending award and unsaved close to owner(guild_id)
+
+        Used when the shard layout changes; this accounting is empty afterwards.
+        """
+        for key, session in self.sessions.items():
+            target = owner(key[1])
+            target.sessions[key] = session
+            target._dirty.add(key)
+            target._closed.discard(key)
+            deadline = self.deadlines.deadline(key)
+            if deadline is not None:
+                target.deadlines.schedule(key, deadline)
+            self.deadlines.cancel(key)
+        for key in self._closed:
+            target = owner(key[1])
+            if key not in target.sessions:
+                target._closed.add(key)
+        for (user_id, guild_id), points in self.awards.drain().items():
+            owner(guild_id).awards.add(user_id, guild_id, points)
+        self.sessions = {}
+        self._dirty = set()
+        self._closed = set()
+
+    def checkpoint_rows(self) -> Tuple[List[tuple], List[Key]]:
+        """Rows for the sessions changed since the last call, and the keys of closed ones"""
+        now = self.clock()
+        wall = time.time()
+        rows = []
+        for key in self._dirty:
+            session = self.sessions.get(key)
+            if session is None:
+                continue
+            rows.append((key[0], key[1], int(session.earning), int(session.earning_since is not None),
+                         session.seconds, session.awarded, wall - (now - session.last_activity), wall))
+        closed = list(self._closed)
+        self._dirty = set()
+        self._closed = set()
+        return rows, closed
+
+    def mark_unsaved(self, rows: List[tuple], closed: List[Key]):
+        """Put back a checkpoint that failed to write"""
+        self._dirty.update((row[0], row[1]) for row in rows)
+        self._closed.update(key for key in closed if key not in self.sessions)
+
+    def settle(self) -> int:
+        """Credit the time every open session has earned so far; returns the points queued"""
+        now = self.clock()
+        before = self.stats['points']
+        for key, session in self.sessions.items():
+            self._accrue(key, session, now)
+        self.stats['settlements'] += 1
+        return self.stats['points'] - before
+
+    def start(self):
+        self.deadlines.start()
+
+    async def stop(self):
+        await self.deadlines.stop()
+
+
+class VoiceShards:
+    """One VoiceAccounting per gateway shard, picked by guild id
+
+    Each shard has its own sessions, awards buffer and inactivity
+    deadlines, so a shard's settlement and reconnect reconciliation only
+    touch that shard's guilds.
+    """
+
+    def __init__(self, factory: Callable[[int], VoiceAccounting], shard_ids: Iterable[int] = (0,),
+                 shard_count: Optional[int] = None):
+        self.factory = factory
+        self.shard_count = shard_count
+        self.shards: Dict[int, VoiceAccounting] = {shard_id: factory(shard_id) for shard_id in shard_ids}
+        self.restored = False
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards.values())
+
+    def shard_id(self, guild_id: int) -> int:
+        return shard_for(guild_id, self.shard_count)
+
+    def shard(self, shard_id: int) -> VoiceAccounting:
+        if shard_id not in self.shards:
+            # Shards this process was not started with, e.g. SHARD_COUNT=auto
+            self.shards[shard_id] = self.factory(shard_id)
+        return self.shards[shard_id]
+
+    def for_guild(self, guild_id: int) -> VoiceAccounting:
+        return self.shard(self.shard_id(guild_id))
+
+    def configure(self, shard_ids: Iterable[int], shard_count: Optional[int]):
+        """Set the shards this process runs once the gateway has reported them
+
+        Voice events keep arriving while the bot starts up, so sessions may
+        already be open under the old layout; they move, with their
+        deadlines and unflushed awards, to the shard that now owns their
+        guild. Must run before start().
+        """
+        old = self.shards
+        if any(shard.deadlines.running for shard in old.values()):
+            raise RuntimeError("Shards must be configured before start()")
+        moved = len(self)
+        self.shard_count = shard_count
+        self.shards = {shard_id: self.factory(shard_id) for shard_id in shard_ids}
+        for shard in old.values():
+            shard.hand_over(self.for_guild)
+        if moved:
+            logger.info(f"Moved {moved} open voice sessions to {len(self.shards)} shards")
+
+    def update(self, user_id: int, guild_id: int, earning: bool):
+        self.for_guild(guild_id).update(user_id, guild_id, earning)
+
+    def leave(self, user_id: int, guild_id: int) -> int:
+        return self.for_guild(guild_id).leave(user_id, guild_id)
+
+    def touch(self, user_id: int, guild_id: int):
+        self.for_guild(guild_id).touch(user_id, guild_id)
+
+    def is_collecting(self, user_id: int, guild_id: int) -> bool:
+        return self.for_guild(guild_id).is_collecting(user_id, guild_id)
+
+    def _split(self, states: Dict[Key, bool]) -> Dict[int, Dict[Key, bool]]:
+        split = {shard_id: {} for shard_id in self.shards}
+        for key, earning in states.items():
+            split.setdefault(self.shard_id(key[1]), {})[key] = earning
+        return split
+
+    def restore(self, rows: Iterable[tuple], states: Dict[Key, bool]) -> Tuple[int, int, int]:
+        """VoiceAccounting.restore() for every shard in one pass
+
+        Saved sessions for shards run by another process are left alone.
+        """
+        rows = list(rows)
+        totals = [0, 0, 0]
+        split = self._split(states)
+        for shard_id in split:
+            self.shard(shard_id)
+        by_shard: Dict[int, List[tuple]] = {}
+        for row in rows:
+            by_shard.setdefault(self.shard_id(row[1]), []).append(row)
+        last_seen = max((row[7] for row in rows), default=0.0)
+        for shard_id, shard in self.shards.items():
+            shard_rows = by_shard.get(shard_id, [])
+            # Every shard measures idle time against the same last checkpoint
+            result = shard.restore(shard_rows, split.get(shard_id, {}), last_seen)
+            totals = [total + value for total, value in zip(totals, result)]
+        self.restored = True
+        return tuple(totals)
+
+    def reconcile(self, states: Dict[Key, bool], shard_id: Optional[int] = None) -> Tuple[int, int]:
+        """VoiceAccounting.reconcile() for one shard, or all of them"""
+        split = self._split(states)
+        shard_ids = list(self.shards) if shard_id is None else [shard_id]
+        opened = closed = 0
+        for shard_id in shard_ids:
+            result = self.shard(shard_id).reconcile(split.get(shard_id, {}))
+            opened += result[0]
+            closed += result[1]
+        return opened, closed
+
+    def settle(self) -> int:
+        return sum(shard.settle() for shard in self.shards.values())
+
+    async def flush(self) -> int:
+        """Write every shard's queued awards"""
+        return sum([await shard.awards.flush() for shard in self.shards.values()])
+
+    def checkpoint_rows(self) -> Tuple[List[tuple], List[Key]]:
+        rows, closed = [], []
+        for shard in self.shards.values():
+            shard_rows, shard_closed = shard.checkpoint_rows()
+            rows.extend(shard_rows)
+            closed.extend(shard_closed)
+        return rows, closed
+
+    def mark_unsaved(self, rows: List[tuple], closed: List[Key]):
+        for shard_id, shard in self.shards.items():
+            shard.mark_unsaved([row for row in rows if self.shard_id(row[1]) == shard_id],
+                               [key for key in closed if self.shard_id(key[1]) == shard_id])
+
+    def start(self):
+        for shard in self.shards.values():
+            shard.start()
+
+    async def stop(self):
+        for shard in self.shards.values():
+            await shard.stop()
+
+
+class VoiceSessionStore:
+    """Persists voice sessions in the voice_sessions table"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.stats = {'checkpoints': 0, 'rows': 0, 'last_ms': 0.0}
+
+    async def load(self) -> List[tuple]:
+        return await self.pool.fetchall(SELECT_SESSIONS)
+
+    async def checkpoint(self, accounting: VoiceAccounting) -> int:
+        """Write every session changed since the last checkpoint in one transaction"""
+        rows, closed = accounting.checkpoint_rows()
+        if not rows and not closed:
+            return 0
+        started = time.perf_counter()
+        try:
+            await self.write(rows, closed)
+        except Exception:
+            accounting.mark_unsaved(rows, closed)
+            raise
+        self.stats['checkpoints'] += 1
+        self.stats['rows'] += len(rows) + len(closed)
+        self.stats['last_ms'] = (time.perf_counter() - started) * 1000
+        return len(rows) + len(closed)
+
+    async def write(self, rows: List[tuple], closed: List[Key]):
+        """Save session rows and delete closed sessions in one transaction"""
+        async with self.pool.write() as db:
+            await db.executemany(UPSERT_SESSION, rows)
+            await db.executemany(DELETE_SESSION, closed)